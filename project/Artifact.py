@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+import numpy as np
+
+artifact_dir = os.path.join(os.getcwd(), 'model_artifact')
+token_re = re.compile(r'(?u)\b\w\w+\b')
+arrays = ['vocab', 'idf', 'coef', 'intercept', 'classes']
+
+
+def checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Exporting trained pipeline into memory-mappable arrays
+def export(model, path=artifact_dir):
+    vec, tfdf, lr = model.named_steps['vec'], model.named_steps['tfdf'], model.named_steps['lr']
+    if vec.ngram_range != (1, 1) or not vec.lowercase or tfdf.norm != 'l2' or tfdf.sublinear_tf:
+        raise ValueError('Поддерживаются только модели с настройками векторизатора по умолчанию')
+    terms = sorted(vec.vocabulary_)
+    order = [vec.vocabulary_[term] for term in terms]
+    version = time.strftime('%Y%m%d%H%M%S')
+    target = os.path.join(path, version)
+    os.makedirs(target)
+    data = {
+        'vocab': np.array(terms),
+        'idf': tfdf.idf_[order].astype(np.float32),
+        # Features in rows, so one document only touches rows of its own words
+        'coef': np.ascontiguousarray(lr.coef_[:, order].T, dtype=np.float32),
+        'intercept': lr.intercept_.astype(np.float32),
+        'classes': np.array([str(c) for c in lr.classes_]),
+    }
+    files = {}
+    for name in arrays:
+        np.save(os.path.join(target, name + '.npy'), data[name])
+        files[name] = checksum(os.path.join(target, name + '.npy'))
+    ovr = getattr(lr, 'multi_class', 'auto') == 'ovr' or lr.solver == 'liblinear'
+    manifest = {'version': version, 'format': 1, 'ovr': ovr, 'files': files}
+    with open(os.path.join(target, 'manifest.json'), 'w') as file:
+        json.dump(manifest, file, indent=2)
+    # Switching CURRENT pointer atomically so readers see either old or new version
+    tmp = os.path.join(path, 'CURRENT.tmp')
+    with open(tmp, 'w') as file:
+        file.write(version)
+    os.replace(tmp, os.path.join(path, 'CURRENT'))
+    return version
+
+
+def current_version(path=artifact_dir):
+    try:
+        with open(os.path.join(path, 'CURRENT')) as file:
+            return file.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# Artifact exported before the joblib model was last written holds an outdated model
+def is_stale(model_path, path=artifact_dir):
+    try:
+        return os.path.getmtime(os.path.join(path, 'CURRENT')) < os.path.getmtime(model_path)
+    except FileNotFoundError:
+        return False
+
+
+# Model which reads its arrays through mmap, so forked workers share the pages
+class MappedModel:
+    def __init__(self, path=artifact_dir, version=None, verify=True):
+        self.version = version or current_version(path)
+        if self.version is None:
+            raise FileNotFoundError('Артефакт модели не найден в ' + path)
+        target = os.path.join(path, self.version)
+        with open(os.path.join(target, 'manifest.json')) as file:
+            self.manifest = json.load(file)
+        for name in arrays:
+            file_path = os.path.join(target, name + '.npy')
+            if verify and checksum(file_path) != self.manifest['files'][name]:
+                raise ValueError('Контрольная сумма ' + name + ' не совпадает, версия ' + self.version)
+            setattr(self, name, np.load(file_path, mmap_mode='r'))
+        self.classes_ = np.asarray(self.classes)
+        self.max_len = self.vocab.dtype.itemsize // self.vocab.dtype.alignment
+
+    def decision_function(self, texts):
+        scores = np.empty((len(texts), len(self.intercept)), dtype=np.float32)
+        for row, txt in enumerate(texts):
+            tokens = np.array([token for token in token_re.findall(txt.lower()) if len(token) <= self.max_len],
+                              dtype=self.vocab.dtype)
+            idx = np.searchsorted(self.vocab, tokens).clip(max=len(self.vocab) - 1)
+            idx, counts = np.unique(idx[self.vocab[idx] == tokens], return_counts=True)
+            weights = counts * self.idf[idx]
+            norm = np.linalg.norm(weights)
+            if norm:
+                weights /= norm
+            scores[row] = weights @ self.coef[idx] + self.intercept
+        return scores
+
+    def predict_proba(self, texts):
+        scores = self.decision_function(texts)
+        if scores.shape[1] == 1:
+            proba = 1 / (1 + np.exp(-scores))
+            return np.hstack([1 - proba, proba])
+        if self.manifest['ovr']:
+            proba = 1 / (1 + np.exp(-scores))
+        else:
+            proba = np.exp(scores - scores.max(axis=1, keepdims=True))
+        return proba / proba.sum(axis=1, keepdims=True)
+
+    def predict(self, texts):
+        return self.classes_[self.predict_proba(texts).argmax(axis=1)]
+
+
+if __name__ == '__main__':
+    from joblib import load
+    from Classification import model_file
+    parser = argparse.ArgumentParser(description='exporting model into memory-mapped artifact')
+    parser.add_argument("--model", default=model_file, help="path to joblib model")
+    parser.add_argument("--out", default=artifact_dir, help="artifact directory")
+    args = parser.parse_args()
+    print('Версия артефакта: ' + export(load(args.model), args.out))
@@ -0,0 +1,355 @@
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+from aiohttp import web
+
+# Offline BENCHMARK: local stand-ins for Telegram, CBR, OpenWeatherMap and anecdotica feeding the real dispatcher
+parser = argparse.ArgumentParser(description='offline end-to-end benchmark')
+parser.add_argument("--updates", type=int, default=2000, help="number of timed updates")
+parser.add_argument("--concurrency", type=int, default=50, help="updates processed at the same time")
+parser.add_argument("--chats", type=int, default=500, help="number of simulated chats")
+parser.add_argument("--mix", default='currency=3,time=1,weather=3,weather_locale=1,joke=2,complaint=1',
+                    help="kind=weight pairs of the update stream")
+parser.add_argument("--delay", type=float, default=0.05, help="latency of every stubbed upstream, seconds")
+parser.add_argument("--record", help="jsonl file with recorded Telegram updates instead of synthetic ones")
+parser.add_argument("--hang", default='', help="comma separated stubs that never answer: cbr,owm,joke")
+parser.add_argument("--api", type=int, default=0, help="number of requests to the currency API endpoints")
+parser.add_argument("--convert", type=int, default=0, help="size of the batch for the conversion benchmark")
+parser.add_argument("--subscriptions", type=int, default=0, help="number of subscriptions for the scheduler benchmark")
+parser.add_argument("--seed", type=int, default=42)
+
+menus = {
+    'currency': 'Уровень валют восточной Европы',
+    'time': 'Другой вопрос',
+    'weather': 'Другой вопрос',
+    'weather_locale': 'Другой вопрос',
+    'joke': 'Другой вопрос',
+    'complaint': 'Заявка в УК',
+}
+questions = {
+    'currency': ['🇪🇺 Евро', '🇵🇱 Польский злотый', '🇨🇿 Чешская крона', '🇧🇾 Белорусский рубль'],
+    'time': ['Сколько времени?', 'Который час?', 'Время не подскажешь?'],
+    'weather': ['Какая погода в Москве?', 'Погода в Казани', 'Подскажи погоду в Сочи', 'Как погода в Урюпинске?'],
+    'weather_locale': ['Какая погода за окном?', 'Как погода?'],
+    'joke': ['Расскажи анекдот', 'Хочу анекдот'],
+    'complaint': ['Течет кран на кухне, прошу прислать сантехника', 'Не работает лифт во втором подъезде',
+                  'Во дворе уже неделю не вывозят мусор', 'В подъезде не горит свет на третьем этаже'],
+}
+
+
+class Upstreams:
+    def __init__(self, delay, hang=()):
+        self.delay = delay
+        self.hang = set(hang)
+        self.calls = {'cbr': 0, 'owm': 0, 'joke': 0, 'telegram': 0}
+        self.jokes = itertools.count()
+        self.messages = itertools.count(1)
+
+    # Fault injection: a hung stub keeps the connection open without ever answering
+    async def pause(self, name):
+        self.calls[name] += 1
+        await asyncio.sleep(3600 if name in self.hang else self.delay)
+
+    async def cbr(self, request):
+        await self.pause('cbr')
+        valute = {code: {'Name': 'Валюта ' + code, 'Value': random.uniform(1, 100), 'Nominal': 1}
+                  for code in ['EUR', 'USD', 'BYN', 'UAH', 'MDL', 'RON', 'BGN', 'HUF', 'CZK', 'PLN']}
+        return web.json_response({'Date': time.strftime('%Y-%m-%dT%H:%M:%S+03:00'), 'Valute': valute})
+
+    async def owm(self, request):
+        await self.pause('owm')
+        if request.query['q'] == 'Урюпинск':
+            return web.json_response({'cod': '404', 'message': 'city not found'}, status=404)
+        now = int(time.time())
+        return web.json_response({'cod': 200, 'dt': now, 'weather': [{'main': 'Clear', 'description': 'ясно'}],
+                                  'main': {'temp': 21.5}, 'wind': {'speed': 3},
+                                  'sys': {'country': 'RU', 'sunrise': now - 3600, 'sunset': now + 3600}})
+
+    async def joke(self, request):
+        await self.pause('joke')
+        return web.json_response({'result': {'error': 0}, 'item': {'text': 'Анекдот №' + str(next(self.jokes))}})
+
+    async def telegram(self, request):
+        await self.pause('telegram')
+        # setWebhook, deleteWebhook and the like answer with a plain flag
+        if not request.match_info['method'].startswith('send'):
+            return web.json_response({'ok': True, 'result': True})
+        data = await request.post() or await request.json()
+        chat_id = int(data['chat_id'])
+        return web.json_response({'ok': True, 'result': {
+            'message_id': next(self.messages), 'date': int(time.time()), 'text': data.get('text', ''),
+            'chat': {'id': chat_id, 'type': 'private'}}})
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/cbr/daily_json.js', self.cbr)
+        app.router.add_get('/owm/weather', self.owm)
+        app.router.add_get('/joke/api', self.joke)
+        app.router.add_post('/telegram/bot{token}/{method}', self.telegram)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, 'localhost', 0).start()
+        return runner, 'http://localhost:' + str(runner.addresses[0][1])
+
+
+def make_update(update_id, chat_id, text):
+    return {'update_id': update_id, 'message': {
+        'message_id': update_id, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Бенчмарк'}}}
+
+
+def synthetic_stream(args):
+    weights = dict((kind, float(weight)) for kind, weight in (pair.split('=') for pair in args.mix.split(',')))
+    kinds = random.choices(list(weights), weights=list(weights.values()), k=args.updates)
+    for i, kind in enumerate(kinds):
+        chat_id = 1000 + i % args.chats
+        yield kind, chat_id, menus[kind], random.choice(questions[kind])
+
+
+def recorded_stream(path):
+    with open(path, encoding='utf-8') as file:
+        for line in file:
+            update = json.loads(line)
+            yield 'recorded', update['message']['chat']['id'], None, update['message']['text']
+
+
+# Event loop LAG: how late a short sleep wakes up while handlers and NLP stages are busy
+async def watch_lag(lags, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        lags.append(max(0.0, loop.time() - start - interval))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))] * 1000
+
+
+async def run(args):
+    import Bot
+    from SendQueue import TokenBucket
+
+    # Measuring the bot itself, not the Telegram flood limits
+    Bot.outbox.global_bucket = TokenBucket(1e9, 1e9)
+    Bot.outbox.chat_rate = Bot.outbox.chat_burst = 1e9
+    Bot.background_tasks.update(Bot.outbox.start(args.concurrency))
+    Bot.background_tasks.update(Bot.complaints.start())
+    try:
+        await Bot.CurrencyData().refresh()
+    except (Bot.aiohttp.ClientError, asyncio.TimeoutError) as e:
+        print(f'Курсы валют не загружены: {e!r}')
+    Bot.background_tasks.add(asyncio.create_task(Bot.Joke.refill_jokes()))
+    await asyncio.sleep(1)
+
+    stream = list(recorded_stream(args.record) if args.record else synthetic_stream(args))
+    update_ids = itertools.count(1)
+    latencies = {}
+    errors = {}
+    semaphore = asyncio.Semaphore(args.concurrency)
+    chat_locks = {}
+
+    async def feed(text, chat_id):
+        update = Bot.types.Update.model_validate(make_update(next(update_ids), chat_id, text),
+                                                 context={'bot': Bot.bot})
+        await Bot.dp.feed_update(Bot.bot, update)
+
+    async def process(kind, chat_id, menu, text):
+        async with semaphore, chat_locks.setdefault(chat_id, asyncio.Lock()):
+            if menu:
+                await feed(menu, chat_id)
+            start = time.perf_counter()
+            try:
+                await feed(text, chat_id)
+            except Exception as e:
+                key = kind + ': ' + repr(e)
+                errors[key] = errors.get(key, 0) + 1
+                return
+            latencies.setdefault(kind, []).append(time.perf_counter() - start)
+
+    lags = []
+    lag_task = asyncio.create_task(watch_lag(lags))
+    start = time.perf_counter()
+    await asyncio.gather(*(process(*item) for item in stream))
+    handled = time.perf_counter() - start
+    while Bot.outbox.depth():
+        await asyncio.sleep(0.01)
+    delivered = time.perf_counter() - start
+    lag_task.cancel()
+    return latencies, errors, handled, delivered, lags
+
+
+# Calling the FastAPI app directly over ASGI, so the numbers show the endpoint and not the network stack
+async def call_api(app, path, headers=()):
+    scope = {'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+             'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+             'headers': [(name.encode(), value.encode()) for name, value in headers],
+             'client': ('127.0.0.1', 0), 'server': ('localhost', 8008)}
+    reply = {}
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            reply['status'] = message['status']
+            reply['headers'] = {name.decode().lower(): value.decode() for name, value in message['headers']}
+
+    await app(scope, receive, send)
+    return reply
+
+
+async def bench_api(args):
+    import Bot
+    codes = list(Bot.cD.cur_list)
+    etags = {}
+    for code in codes:
+        etags[code] = (await call_api(Bot.fp, '/' + code))['headers'].get('etag', '')
+    variants = {
+        'text': lambda code: (),
+        'json': lambda code: [('accept', 'application/json')],
+        'if-none-match': lambda code: [('if-none-match', etags[code])],
+    }
+    for variant, headers in variants.items():
+        statuses = {}
+        start = time.perf_counter()
+        for i in range(args.api):
+            code = codes[i % len(codes)]
+            status = (await call_api(Bot.fp, '/' + code, headers(code)))['status']
+            statuses[status] = statuses.get(status, 0) + 1
+        elapsed = time.perf_counter() - start
+        print(f'API {variant}: {args.api / elapsed:.0f} запросов в секунду, ответы ' +
+              ', '.join(f'{status}: {count}' for status, count in sorted(statuses.items())))
+
+
+def bench_convert(args):
+    import Bot
+    rates = Bot.CurrencyService.rates
+    codes = list(rates.codes) + ['XXX']
+    amounts = [random.uniform(1, 1000) for _ in range(args.convert)]
+    srcs = random.choices(codes, k=args.convert)
+    dsts = random.choices(codes, k=args.convert)
+    start = time.perf_counter()
+    rates.convert_many(amounts, srcs, dsts)
+    elapsed = time.perf_counter() - start
+    print(f'Пакетная конвертация: {args.convert / elapsed:.0f} конвертаций в секунду')
+    start = time.perf_counter()
+    for _ in range(100):
+        rates.matrix()
+    print(f'Матрица кросс-курсов {len(rates)}x{len(rates)}: {(time.perf_counter() - start) * 10:.3f} мс')
+
+
+# One virtual day of the subscription scheduler: the clock jumps straight to the next due minute
+async def bench_subscriptions(args):
+    from Subscriptions import Subscription, SubscriptionScheduler
+    now = [time.time()]
+    delivered = {}
+
+    async def render(kind, arg):
+        return kind + ' ' + arg
+
+    async def deliver(chat_id, text):
+        delivered[chat_id] = delivered.get(chat_id, 0) + 1
+
+    scheduler = SubscriptionScheduler(render, deliver, clock=lambda: now[0])
+    cities = ['Город ' + str(i) for i in range(200)]
+    codes = ['EUR', 'USD', 'CNY', 'PLN', 'BYN', 'KZT']
+    start = time.perf_counter()
+    for i in range(args.subscriptions):
+        kind = random.choice(['weather', 'currency', 'joke'])
+        arg = random.choice(cities) if kind == 'weather' else random.choice(codes) if kind == 'currency' else ''
+        scheduler.add(Subscription(i, 1000 + i, kind, arg, random.randrange(6 * 60, 10 * 60, 5)))
+    added = time.perf_counter() - start
+    end = now[0] + 24 * 60 * 60
+    start = time.perf_counter()
+    while (due := scheduler.next_time()) is not None and due <= end:
+        now[0] = due
+        await scheduler.tick()
+    elapsed = time.perf_counter() - start
+    metrics = scheduler.metrics
+    print(f'Подписки: {args.subscriptions} добавлены за {added:.2f} с, сутки обработаны за {elapsed:.2f} с')
+    print(f'Срабатываний {metrics["ticks"]}, подготовлено текстов {metrics["renders"]}, '
+          f'доставлено {metrics["delivered"]} сообщений в {len(delivered)} чатов')
+
+
+def report(latencies, errors, handled, delivered, lags, upstreams):
+    import Bot
+    for error, count in errors.items():
+        print(f'Ошибка ({count} раз): {error}')
+    total = [value for values in latencies.values() for value in values]
+    print(f'Обработано обновлений: {len(total)} за {handled:.2f} с ({len(total) / handled:.1f} в секунду)')
+    print(f'Все ответы доставлены за {delivered:.2f} с')
+    if lags:
+        print(f'Задержка цикла событий: p50 {percentile(lags, 50):.2f} мс, p99 {percentile(lags, 99):.2f} мс, '
+              f'максимум {max(lags) * 1000:.2f} мс')
+    print(f'{"тип":<16}{"кол-во":>8}{"p50, мс":>10}{"p95, мс":>10}{"p99, мс":>10}{"среднее, мс":>14}')
+    for kind, values in sorted(latencies.items()) + [('всего', total)]:
+        print(f'{kind:<16}{len(values):>8}{percentile(values, 50):>10.2f}{percentile(values, 95):>10.2f}'
+              f'{percentile(values, 99):>10.2f}{statistics.mean(values) * 1000:>14.2f}')
+    print('Поиск локации: ' + ', '.join(f'{path} {count} раз, {seconds * 1000:.1f} мс'
+                                        for path, (count, seconds) in Bot.Location.stats.items()))
+    print(f'Кэш погоды: {Bot.WeatherData.cache.hits} попаданий, {Bot.WeatherData.cache.misses} промахов')
+    print('Вызовы заглушек: ' + ', '.join(f'{name} {count}' for name, count in upstreams.calls.items()))
+    print('Пул NLP (' + Bot.executor.kind + '): ' + ', '.join(
+        f'{name} {stats["done"]} выполнено, {stats["rejected"]} отклонено, {stats["timeouts"]} по таймауту'
+        for name, stats in Bot.executor.stats().items()))
+    print('Предохранители: ' + ', '.join(f'{name} {state["state"]} ({state["failures"]} ошибок)'
+                                         for name, state in Bot.HttpClient.stats().items()))
+    if Bot.Metrics.enabled:
+        from prometheus_client import REGISTRY
+        for stage in ('fuzzy', 'gazetteer', 'ner', 'lemmatise', 'inference'):
+            seconds = REGISTRY.get_sample_value('bot_stage_seconds_total', {'stage': stage}) or 0
+            calls = REGISTRY.get_sample_value('bot_stage_calls_total', {'stage': stage}) or 0
+            print(f'Этап {stage}: {calls:.0f} вызовов, {seconds * 1000:.1f} мс')
+
+
+async def main():
+    args, _ = parser.parse_known_args()
+    random.seed(args.seed)
+    upstreams = Upstreams(args.delay, filter(None, args.hang.split(',')))
+    runner, base = await upstreams.start()
+    os.environ.update({
+        'TOKEN': '123456:BENCHMARK', 'WAKEY': 'bench', 'JOKEPID': 'bench', 'JOKETOKEN': 'bench',
+        'TELEGRAM_API': base + '/telegram', 'CBR_URL': base + '/cbr/daily_json.js',
+        'OWM_URL': base + '/owm/weather', 'JOKE_URL': base + '/joke/api', 'JOKE_REFILL_INTERVAL': '0.01',
+    })
+    # Running in a scratch directory so snapshots and history do not touch real data
+    project = os.path.dirname(os.path.abspath(__file__))
+    workdir = tempfile.mkdtemp(prefix='bot-bench-')
+    for name in ('trained_model.joblib', 'model_artifact'):
+        if os.path.exists(os.path.join(project, name)):
+            os.symlink(os.path.join(project, name), os.path.join(workdir, name))
+    os.chdir(workdir)
+    sys.path.insert(0, project)
+    try:
+        report(*await run(args), upstreams)
+        if args.api:
+            await bench_api(args)
+        if args.convert:
+            bench_convert(args)
+        if args.subscriptions:
+            await bench_subscriptions(args)
+    finally:
+        import Bot
+        for task in Bot.background_tasks:
+            task.cancel()
+        await Bot.HttpClient.close()
+        await Bot.bot.session.close()
+        Bot.executor.shutdown()
+        await runner.cleanup()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
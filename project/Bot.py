@@ -1,55 +1,63 @@
+import aiohttp
 import argparse
 import asyncio
+import json
 import logging
 import os
 import random
+import time
 import colorlog
+import fcntl
 import flag as flg
-import pymorphy2
-import requests
+import Metrics
 import uvicorn
 
 from ConstantData import ConstDat as cD
-from datetime import datetime
+from Complaints import ComplaintIntake
+from Converter import RateTable
+from CurrencyService import CurrencyService
+from Cache import TTLCache
+from Executor import StageOverloaded, executor
+from HttpClient import HttpClient, UpstreamError
+from IntentRouter import IntentRouter
+from Location import Location
+from RateHistory import RateHistory
+from SendQueue import Outbox
+from Subscriptions import Subscriptions
+from UserState import Menu, create_storage
+from collections import deque
+from datetime import date, datetime
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.client.session import aiohttp
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.context import FSMContext
 from aiogram.types import Message
-from fastapi import FastAPI, Response
-from fuzzywuzzy import process
-from joblib import load
-from natasha import Doc, Segmenter, NewsEmbedding, NewsNERTagger
-from pydantic import BaseModel
+from fastapi import FastAPI, Query, Request, Response
+from pydantic import BaseModel, ConfigDict, Field
 from dotenv import load_dotenv
 
 load_dotenv()
+Metrics.setup()
 
-from Classification import prepare
-
-
-# Loading MODEL
-cur_dir = os.getcwd()
-model = os.path.join(cur_dir, 'trained_model.joblib')
-pred_mod = load(model)
+from Classification import classifier, watch_model
+from Morph import get_morph
 
 
 # Setting LOGGER
-logging.basicConfig(level=logging.DEBUG)
-logger = colorlog.getLogger('base')
 parser = argparse.ArgumentParser(description='creating parser')
-parser.add_argument("--loglvl", help="logging levels")
-args = parser.parse_args()
+parser.add_argument("--loglvl", choices=['debug', 'info', 'warning'], type=str.lower,
+                    default=os.getenv('LOGLEVEL', 'info'), help="logging levels")
+parser.add_argument("--mode", choices=['polling', 'webhook'], default='polling', help="how to receive updates")
+parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes in webhook mode")
+parser.add_argument("--host", default='localhost', help="host for FastAPI server")
+parser.add_argument("--port", type=int, default=8008, help="port for FastAPI server")
+# Known args only, as uvicorn and gunicorn workers import this module with their own arguments
+args, _ = parser.parse_known_args()
 
 
 # Setting LOGGING LEVELS
-if args.loglvl:
-    loglevel = logging.getLogger("base")
-    log = args.logl
-    if log.lower() == "debug":
-        loglevel.setLevel(logging.DEBUG)
-    elif log.lower() == "info":
-        loglevel.setLevel(logging.INFO)
-    elif log.lower() == "warning":
-        loglevel.setLevel(logging.WARNING)
+logging.basicConfig(level=args.loglvl.upper())
+logger = colorlog.getLogger('base')
 
 # KEYS & TOKENS
 
@@ -57,159 +65,324 @@ TOKEN = os.getenv('TOKEN')
 WAKEY = os.getenv('WAKEY')
 JOKETOKEN = os.getenv('JOKETOKEN')
 JOKEPID = os.getenv('JOKEPID')
+UK_CHAT_ID = os.getenv('UK_CHAT_ID')
+TELEGRAM_API = os.getenv('TELEGRAM_API')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+# Worker processes sharing upstream quotas: BOT_WORKERS is set below for uvicorn, WEB_CONCURRENCY for gunicorn
+WORKERS = int(os.getenv('BOT_WORKERS', os.getenv('WEB_CONCURRENCY', 1)))
+snapshot_file = os.path.join(os.getcwd(), 'currency_snapshot.json')
+leader_lock_file = os.path.join(os.getcwd(), 'refresher.lock')
 
 
 # Creating ESSENTIAL OBJECTS
-sgmnt = Segmenter()
-emb = NewsEmbedding()
-ner_tagger = NewsNERTagger(emb)
-morph = pymorphy2.MorphAnalyzer()
-bot = Bot(token=TOKEN)
+if TELEGRAM_API:
+    bot = Bot(token=TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API)))
+else:
+    bot = Bot(token=TOKEN)
 fp = FastAPI()
-dp = Dispatcher()
+dp = Dispatcher(storage=create_storage(WORKERS))
+background_tasks = set()
+# Telegram flood limits are per bot, so the workers split them; a chat may be served by any of them
+outbox = Outbox(bot, rate=30 / WORKERS, chat_rate=1 / WORKERS, chat_burst=max(1, 3 // WORKERS))
+rate_history = RateHistory()
+history_re = r'(?i)^\s*(?:курс\s+)?(\w+)\s+за\s+(неделю|месяц|год|(\d+)\s*д\w*)\s*\??$'
+subscribe_re = r'(?i)^\s*(?:присылай|присылать|отправляй|напоминай)\s+(.+?)\s+в\s+(\d{1,2})[:.](\d{2})\s*$'
+unsubscribe_re = r'(?i)^\s*(?:отпишись|отписаться|отмени\w*\s+подписк\w*|стоп\s+подписк\w*)'
+subscriptions_re = r'(?i)^\s*мои\s+подписки\s*\??$'
+convert_re = r'(?i)^\s*(?:сколько\s+будет\s+)?(\d+(?:[.,]\d+)?)\s*(\w+)\s+(?:в|во|на|to)\s+(\w+)\s*\??$'
+intent_router = IntentRouter(cD.intents)
 
 
 # Class for VALIDATING currency data
 class Currency(BaseModel):
+    model_config = ConfigDict(frozen=True)
+
     code: str
     name: str
     value: float
 
 
+# Class for VALIDATING classification request
+class ClassifyRequest(BaseModel):
+    texts: list[str]
+
+
+# Class for VALIDATING one conversion of a batch
+class ConvertRequest(BaseModel):
+    model_config = ConfigDict(populate_by_name=True)
+
+    amount: float = 1
+    src: str = Field(alias='from')
+    dst: str = Field(alias='to')
+
+
 # Class for getting, updating and sending to API current CURRENCY LIST
 class CurrencyData:
+    url = os.getenv('CBR_URL', 'https://www.cbr-xml-daily.ru/daily_json.js')
+
+    def __init__(self):
+        self.etag = None
+        self.last_modified = None
+
     async def update_currencies(self):
         while True:
-            for cur in cD.cur_list:
-                chkcur = await self.get_cur_value(cur)
-                cD.cur_data_list[cur] = {'name': chkcur.name, 'value': chkcur.value}
-                logging.debug('Произошел запрос данных по валюте ' + cur)
+            try:
+                await self.refresh()
+            # OSError: the snapshot or the rate history could not be written
+            except (aiohttp.ClientError, asyncio.TimeoutError, OSError, ValueError, KeyError) as e:
+                logger.warning('Не удалось обновить данные по валютам: %r', e)
             await asyncio.sleep(3000)
 
+    async def refresh(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        reply = await HttpClient.get('cbr', self.url, headers=headers)
+        if reply.status == 304:
+            logger.debug('Данные API не изменились')
+            return
+        if reply.status != 200:
+            raise UpstreamError(f'cbr: HTTP {reply.status}')
+        data = reply.json()
+        etag = reply.headers.get('ETag')
+        last_modified = reply.headers.get('Last-Modified')
+        # Building the table and the currencies first, so a bad document changes nothing
+        rates = RateTable.from_cbr(data)
+        currencies = {cur: self.get_cur_value(data, cur) for cur in cD.cur_list}
+        # One timestamp for the responses and the snapshot, so Last-Modified survives a restart unchanged
+        updated = time.time()
+        CurrencyService.publish(currencies, rates, updated)
+        self.etag, self.last_modified = etag, last_modified
+        self.save_snapshot(updated)
+        await asyncio.to_thread(rate_history.append, data)
+        logger.info('Подгруженны данные API')
+
+    # Sharing last good snapshot with other worker processes and with the next start through a file
     @staticmethod
-    async def get_cur_value(code):
-        data = requests.get('https://www.cbr-xml-daily.ru/daily_json.js').json()
-        logging.info('Подгруженны данные API')
-        value = float(data['Valute'][code]['Value'] / data['Valute'][code]['Nominal'])
+    def save_snapshot(updated):
+        tmp = snapshot_file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as file:
+            json.dump({'updated': updated, 'currencies': [cur.model_dump() for cur in cD.cur_data_list.values()],
+                       'rates': CurrencyService.rates.as_dict()}, file, ensure_ascii=False)
+        os.replace(tmp, snapshot_file)
+
+    @staticmethod
+    def load_snapshot():
+        with open(snapshot_file, encoding='utf-8') as file:
+            snapshot = json.load(file)
+        currencies = [Currency(**cur) for cur in snapshot['currencies']]
+        rates = RateTable(snapshot.get('rates', {}))
+        CurrencyService.publish({cur.code: cur for cur in currencies}, rates, snapshot['updated'])
+
+    # Serving rates from the previous run until the first refresh succeeds
+    @staticmethod
+    def restore_snapshot():
+        try:
+            CurrencyData.load_snapshot()
+            logger.info('Данные по валютам восстановлены из снимка')
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logger.info('Снимок данных по валютам не загружен: %r', e)
+
+    @staticmethod
+    async def follow_snapshot(interval=30):
+        mtime = None
+        while True:
+            try:
+                new_mtime = os.stat(snapshot_file).st_mtime
+                if new_mtime != mtime:
+                    CurrencyData.load_snapshot()
+                    mtime = new_mtime
+                    logger.debug('Данные по валютам загружены из снимка')
+            except (OSError, ValueError, KeyError, TypeError) as e:
+                logger.debug('Снимок данных по валютам недоступен: %r', e)
+            await asyncio.sleep(interval)
+
+    @staticmethod
+    def get_cur_value(data, code):
+        valute = data['Valute'][code]
+        value = float(valute['Value'] / valute['Nominal'])
         return Currency(
             code=code,
-            name=data['Valute'][code]['Name'],
+            name=valute['Name'],
             value=f'{value:.3f}'
         )
 
 
+# OWM answers "404" as a string for unknown places; only these are cached as negative for hours
+def place_not_found(data):
+    return str(data['cod']) == '404'
+
+
 # Class for getting LOCATION and WEATHER from user request
 class WeatherData:
+    url = os.getenv('OWM_URL', 'http://api.openweathermap.org/data/2.5/weather')
+    cache = TTLCache(ttl=600, negative_ttl=6 * 60 * 60, is_negative=place_not_found)
+
     @staticmethod
     async def get_location(msg):
-        msg = msg.title()
-        doc = Doc(msg)
-        doc.segment(sgmnt)
-        doc.tag_ner(ner_tagger)
-        logger.debug('Итог таггера запроса: ' + str(doc.ner))
-        for span in doc.ner.spans:
-            if span.type == 'LOC':
-                loc = morph.parse(msg[span.start:span.stop])[0].normal_form
-                logger.debug('Погода будет предоставлена по локации ' + loc)
-                return loc.title()
-            else:
-                logger.debug('В запросе пользователя не обнаружено названия локации')
-                return None
+        loc = await executor.run('location', Location.extract, msg)
+        if loc is None:
+            logger.debug('В запросе пользователя не обнаружено названия локации')
+        else:
+            logger.debug('Погода будет предоставлена по локации %s', loc)
+        return loc
+
+    @staticmethod
+    async def fetch_weather(loc):
+        params = {'q': loc, 'lang': 'ru', 'units': 'metric', 'appid': WAKEY}
+        logger.debug('Запрос погоды по локации %s в API', loc)
+        data = (await HttpClient.get('openweathermap', WeatherData.url, params=params)).json()
+        # A bad key (401) or an exceeded quota (429) says nothing about the place and must not be cached
+        if str(data['cod']) not in ('200', '404'):
+            raise UpstreamError(f"openweathermap: {data['cod']} {data.get('message', '')}")
+        return data
 
     @staticmethod
     async def get_weather(msg):
-        loc = await WeatherData.get_location(msg)
+        try:
+            loc = await WeatherData.get_location(msg)
+        except (StageOverloaded, asyncio.TimeoutError):
+            return 'Слишком много запросов, попробуйте чуть позже 🙏'
         if loc is not None:
-            data = requests.get('http://api.openweathermap.org/data/2.5/weather?q=' + loc +
-                                '&lang=ru&units=metric&appid=' + WAKEY).json()
-            if data['cod'] != 200:
-                logger.debug('Локация "'+loc+'" не найдена в API')
-                return 'Простите, такого места я не знаю 😳'
-
-            city = str(morph.parse(loc)[0].inflect({'loct'}).word).capitalize()
-            clouds = str(data['weather'][0]['description']).capitalize()
-            temperature = float(data['main']['temp'])
-            wind = str(data['wind']['speed']) + 'м/с'
-            weather_state = data['weather'][0]['main']
-            sunset = int(data['sys']['sunset'])
-            sunrise = int(data['sys']['sunrise'])
-            now = int(data['dt'])
-            try:
-                flag = flg.flag(data['sys']['country'])
-                logger.debug('Флаг локации обнаружен')
-            except KeyError:
-                flag = ''
-                logger.debug('Флаг локации НЕ обнаружен')
-            if temperature > 25:
-                temperature = str(temperature) + '°C 🥵'
-            elif temperature < 15:
-                temperature = str(temperature) + '°C 🥶'
-            else:
-                temperature = str(temperature) + '°C 😁'
-            match weather_state:
-                case 'Thunderstorm':
-                    weather_state = '⚡️'
-                case 'Rain':
-                    weather_state = '💧'
-                case 'Drizzle':
-                    weather_state = '💦'
-                case 'Snow':
-                    weather_state = '❄️'
-                case 'Mist':
-                    weather_state = '🌁'
-                case 'Smoke':
-                    weather_state = '🌫'
-                case 'Haze':
-                    weather_state = '🌫'
-                case 'Fog':
-                    weather_state = '🌁'
-                case 'Squall':
-                    weather_state = '🌪️'
-                case 'Tornado':
-                    weather_state = '🌪️'
-                case 'Clear':
-                    if sunrise < now < sunset:
-                        weather_state = '🌞'
-                    else:
-                        weather_state = '🌛'
-                case 'Clouds':
-                    weather_state = '☁️'
-            logger.info('Бот сообщил погоду')
-            return ('Синоптики сообщают что на данный момент в ' + flag + city + '\n\nПогода: ' + clouds + ' ' +
-                    weather_state + '\nТемпература: ' + temperature + '\nСкорость ветра: ' + wind)
+            return await WeatherData.get_loc_weather(loc)
         else:
             return 'Простите, не понял Ваш вопрос😓'
 
-
-# Class for giving user random east-european JOKES
+    @staticmethod
+    async def get_loc_weather(loc):
+        try:
+            data = await WeatherData.cache.get(loc.lower(), lambda: WeatherData.fetch_weather(loc))
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning('Не удалось получить погоду из API: %r', e)
+            return 'Сервис погоды сейчас недоступен, попробуйте позже 🙏'
+        if place_not_found(data):
+            logger.debug('Локация "%s" не найдена в API', loc)
+            return 'Простите, такого места я не знаю 😳'
+
+        city = str(get_morph().parse(loc)[0].inflect({'loct'}).word).capitalize()
+        clouds = str(data['weather'][0]['description']).capitalize()
+        temperature = float(data['main']['temp'])
+        wind = str(data['wind']['speed']) + 'м/с'
+        weather_state = data['weather'][0]['main']
+        sunset = int(data['sys']['sunset'])
+        sunrise = int(data['sys']['sunrise'])
+        now = int(data['dt'])
+        try:
+            flag = flg.flag(data['sys']['country'])
+            logger.debug('Флаг локации обнаружен')
+        except KeyError:
+            flag = ''
+            logger.debug('Флаг локации НЕ обнаружен')
+        if temperature > 25:
+            temperature = str(temperature) + '°C 🥵'
+        elif temperature < 15:
+            temperature = str(temperature) + '°C 🥶'
+        else:
+            temperature = str(temperature) + '°C 😁'
+        match weather_state:
+            case 'Thunderstorm':
+                weather_state = '⚡️'
+            case 'Rain':
+                weather_state = '💧'
+            case 'Drizzle':
+                weather_state = '💦'
+            case 'Snow':
+                weather_state = '❄️'
+            case 'Mist':
+                weather_state = '🌁'
+            case 'Smoke':
+                weather_state = '🌫'
+            case 'Haze':
+                weather_state = '🌫'
+            case 'Fog':
+                weather_state = '🌁'
+            case 'Squall':
+                weather_state = '🌪️'
+            case 'Tornado':
+                weather_state = '🌪️'
+            case 'Clear':
+                if sunrise < now < sunset:
+                    weather_state = '🌞'
+                else:
+                    weather_state = '🌛'
+            case 'Clouds':
+                weather_state = '☁️'
+        logger.info('Бот сообщил погоду')
+        return ('Синоптики сообщают что на данный момент в ' + flag + city + '\n\nПогода: ' + clouds + ' ' +
+                weather_state + '\nТемпература: ' + temperature + '\nСкорость ветра: ' + wind)
+
+
+# Class for giving user random east-european JOKES from a prefetched buffer
 class Joke:
+    url = os.getenv('JOKE_URL', 'http://anecdotica.ru/api')
+    buffer_size = 10
+    # Every worker keeps its own buffers, so the API rate is split between them
+    refill_interval = float(os.getenv('JOKE_REFILL_INTERVAL', 3)) * WORKERS
+    exhausted_pause = 60 * 60
+    buffers = {i: deque() for i in range(len(cD.country_codes))}
+    seen = set()
+    seen_order = deque()
+    seen_size = 5000
+    metrics = {'served': 0, 'fallback': 0, 'fetched': 0, 'duplicates': 0, 'errors': 0, 'exhausted': 0}
+
     @staticmethod
-    async def get_joke():
-        rand = random.randint(0, len(cD.country_codes) - 1)
-        joke_cntr = 'country=' + str(cD.country_codes[rand])
-        data = requests.get('http://anecdotica.ru/api?pid=' + JOKEPID +
-                            '&method=getRandItem&' + joke_cntr +'&token=' + JOKETOKEN).json()
-        if data['result']['error'] != 0:
-            logger.debug('НЕ удалось получить анекдот из API')
-            return 'Анектода сегодня не будет, простите (вероятно подписка на API  санекдотами истекла)'
-        logger.debug('Анекдот из API получен')
-        return 'Для Вас анекдот из великой ' + cD.joke_flag[rand] + '\n' + data['item']['text']
-
-
-# API for sending currencies to bot
-class MyCurAPI:
+    async def fetch_joke(i):
+        params = {'pid': JOKEPID, 'method': 'getRandItem', 'country': cD.country_codes[i], 'token': JOKETOKEN}
+        return (await HttpClient.request('anecdotica', 'GET', Joke.url, params=params)).json()
+
+    @staticmethod
+    def remember(text):
+        if text in Joke.seen:
+            return False
+        Joke.seen.add(text)
+        Joke.seen_order.append(text)
+        if len(Joke.seen_order) > Joke.seen_size:
+            Joke.seen.discard(Joke.seen_order.popleft())
+        return True
+
     @staticmethod
-    async def send_request(param):
+    async def refill_jokes():
         while True:
-            fpurl = f'http://localhost:8008/' + param
-            async with aiohttp.ClientSession() as session:
-                async with session.get(fpurl) as resp:
-                    if resp.status == 200:
-                        logger.debug('Бот подключен')
-                        actResp = await resp.text()
-                        return actResp
-                    else:
-                        logger.warning('Не удается установить соединение с сервером')
+            i = min(Joke.buffers, key=lambda k: len(Joke.buffers[k]))
+            if len(Joke.buffers[i]) >= Joke.buffer_size:
+                await asyncio.sleep(Joke.refill_interval)
+                continue
+            pause = Joke.refill_interval
+            try:
+                data = await Joke.fetch_joke(i)
+                if data['result']['error'] != 0:
+                    logger.debug('НЕ удалось получить анекдот из API')
+                    Joke.metrics['exhausted'] += 1
+                    pause = Joke.exhausted_pause
+                elif Joke.remember(data['item']['text']):
+                    Joke.buffers[i].append(data['item']['text'])
+                    Joke.metrics['fetched'] += 1
+                    logger.debug('Анекдот из API получен')
+                else:
+                    Joke.metrics['duplicates'] += 1
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError, KeyError) as e:
+                Joke.metrics['errors'] += 1
+                logger.warning('Ошибка при загрузке анекдота: %r', e)
+            await asyncio.sleep(pause)
+
+    @staticmethod
+    def stats():
+        return {'depth': {cD.country_codes[i]: len(buf) for i, buf in Joke.buffers.items()}, **Joke.metrics}
+
+    @staticmethod
+    async def get_joke():
+        filled = [i for i, buf in Joke.buffers.items() if buf]
+        if not filled:
+            Joke.metrics['fallback'] += 1
+            logger.info('Бот рассказал анекдот из запаса')
+            return 'Свежих анекдотов пока нет, но есть проверенный:\n' + random.choice(cD.fallback_jokes)
+        rand = random.choice(filled)
+        Joke.metrics['served'] += 1
+        logger.info('Бот рассказал анекдот')
+        return 'Для Вас анекдот из великой ' + cD.joke_flag[rand] + '\n' + Joke.buffers[rand].popleft()
 
 
 #GETTERS FROM API functions start from here-----------------------------------------------------------------------------
@@ -219,160 +392,140 @@ async def root():
     return cD.cur_list
 
 
-@fp.get('/EUR')
-async def root():
-    logger.info('Переход на /EUR')
-    asccur = cD.cur_data_list['EUR']
-    resp = 'На текущий момент\n1 🇪🇺' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/BYN')
-async def root():
-    logger.info('Переход на /BYN')
-    asccur = cD.cur_data_list['BYN']
-    resp = 'На текущий момент\n1 🇧🇾' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/UAH')
-async def root():
-    logger.info('Переход на /UAH')
-    asccur = cD.cur_data_list['UAH']
-    resp = 'На текущий момент\n1 🇺🇦' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/MDL')
-async def root():
-    logger.info('Переход на /MDL')
-    asccur = cD.cur_data_list['MDL']
-    resp = 'На текущий момент\n1 🇲🇩' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/RON')
-async def root():
-    logger.info('Переход на /RON')
-    asccur = cD.cur_data_list['RON']
-    resp = 'На текущий момент\n1 🇷🇴' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/BGN')
-async def root():
-    logger.info('Переход на /BGN')
-    asccur = cD.cur_data_list['BGN']
-    resp = 'На текущий момент\n1 🇧🇬' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/HUF')
-async def root():
-    logger.info('Переход на /HUF')
-    asccur = cD.cur_data_list['HUF']
-    resp = 'На текущий момент\n1 🇭🇺' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
+@fp.post('/classify')
+async def classify(request: ClassifyRequest):
+    logger.info('Классификация %d заявок через API', len(request.texts))
+    results = await classifier.classify_many(request.texts)
+    return [{'text': txt, 'label': label, 'proba': proba} for txt, (label, proba) in zip(request.texts, results)]
 
 
-@fp.get('/CZK')
-async def root():
-    logger.info('Переход на /CZK')
-    asccur = cD.cur_data_list['CZK']
-    resp = 'На текущий момент\n1 🇨🇿' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
-
-
-@fp.get('/PLN')
-async def root():
-    logger.info('Переход на /PLN')
-    asccur = cD.cur_data_list['PLN']
-    resp = 'На текущий момент\n1 🇵🇱' + asccur['name'] + ' = ' + str(asccur['value']) + ' 🇷🇺 Российских рублей'
-    return Response(content=resp, media_type="text/plain")
+@fp.get('/history/{code}')
+async def history(code: str, days: int = 7):
+    logger.info('Переход на /history/%s', code)
+    summary = await asyncio.to_thread(rate_history.summary, code.upper(), days)
+    if summary is None:
+        return Response(content='Нет данных по валюте за этот период', status_code=404, media_type="text/plain")
+    return summary
+
+
+@fp.get('/history/{code}/range')
+async def history_range(code: str, start: date, end: date | None = None):
+    start = datetime.combine(start, datetime.min.time()).timestamp()
+    end = datetime.combine(end, datetime.max.time()).timestamp() if end else None
+    ts, val = await asyncio.to_thread(rate_history.range, code.upper(), start, end)
+    return [{'date': datetime.fromtimestamp(t).date().isoformat(), 'value': v}
+            for t, v in zip(ts.tolist(), val.tolist())]
+
+
+@fp.get('/convert')
+async def convert(amount: float = 1, src: str = Query(alias='from'), dst: str = Query(alias='to')):
+    rates = CurrencyService.rates
+    src, dst = src.upper(), dst.upper()
+    if len(rates) == 1:
+        return Response(content='Данные по валютам еще не загружены', status_code=503, media_type="text/plain")
+    if src not in rates or dst not in rates:
+        return Response(content='Неизвестная валюта', status_code=404, media_type="text/plain")
+    rate = rates.rate(src, dst)
+    return {'amount': amount, 'from': src, 'to': dst, 'rate': rate, 'result': amount * rate}
+
+
+@fp.post('/convert')
+async def convert_many(items: list[ConvertRequest]):
+    rates = CurrencyService.rates
+    if len(rates) == 1:
+        return Response(content='Данные по валютам еще не загружены', status_code=503, media_type="text/plain")
+    srcs = [item.src.upper() for item in items]
+    dsts = [item.dst.upper() for item in items]
+    results = rates.convert_many([item.amount for item in items], srcs, dsts).tolist()
+    # NaN marks an unknown currency, it is not valid JSON
+    return [{'amount': item.amount, 'from': src, 'to': dst, 'result': None if result != result else result}
+            for item, src, dst, result in zip(items, srcs, dsts, results)]
+
+
+@fp.get('/convert/matrix')
+async def convert_matrix(codes: str | None = None):
+    rates = CurrencyService.rates
+    if len(rates) == 1:
+        return Response(content='Данные по валютам еще не загружены', status_code=503, media_type="text/plain")
+    codes = [code.upper() for code in codes.split(',')] if codes else None
+    if codes and any(code not in rates for code in codes):
+        return Response(content='Неизвестная валюта', status_code=404, media_type="text/plain")
+    codes, matrix = rates.matrix(codes)
+    return {'codes': codes, 'matrix': matrix.tolist()}
+
+
+if Metrics.enabled:
+    @fp.get('/metrics')
+    async def metrics():
+        content, media_type = Metrics.render()
+        return Response(content=content, media_type=media_type)
+
+    dp.message.middleware(Metrics.HandlerMetrics())
+    Metrics.expose('weather_cache_hits', lambda: WeatherData.cache.hits)
+    Metrics.expose('weather_cache_misses', lambda: WeatherData.cache.misses)
+    Metrics.expose('location_gazetteer_hits', lambda: Location.stats['gazetteer'][0])
+    Metrics.expose('location_ner_hits', lambda: Location.stats['ner'][0])
+    Metrics.expose('location_misses', lambda: Location.stats['miss'][0])
+    Metrics.expose('joke_buffer_depth', lambda: sum(len(buf) for buf in Joke.buffers.values()))
+    Metrics.expose('joke_fallbacks', lambda: Joke.metrics['fallback'])
+    Metrics.expose('outbox_depth', outbox.depth)
+    Metrics.expose('outbox_retry_after', lambda: outbox.metrics['retry_after'])
+
+
+@fp.get('/outbox/stats')
+async def outbox_stats():
+    return {'depth': outbox.depth(), **outbox.metrics}
+
+
+@fp.get('/jokes/stats')
+async def joke_stats():
+    return Joke.stats()
+
+
+@fp.get('/upstreams/stats')
+async def upstream_stats():
+    return HttpClient.stats()
+
+
+@fp.get('/executor/stats')
+async def executor_stats():
+    return executor.stats()
+
+
+@fp.get('/subscriptions/stats')
+async def subscription_stats():
+    return {'subscriptions': len(subscriptions.scheduler), **subscriptions.scheduler.metrics}
+
+
+def currency_endpoint(code):
+    async def get_currency(request: Request):
+        logger.info('Переход на /%s', code)
+        json_wanted = (request.query_params.get('format') == 'json' or
+                       'application/json' in request.headers.get('accept', ''))
+        cached = CurrencyService.responses.get((code, 'json' if json_wanted else 'text'))
+        if cached is None:
+            return Response(content='Данные по валютам еще не загружены', status_code=503, media_type="text/plain",
+                            headers={'Retry-After': '5'})
+        body, media_type, headers = cached
+        if CurrencyService.not_modified(headers['ETag'], request.headers.get('if-none-match')):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type=media_type, headers=headers)
+    return get_currency
+
+
+for cur_code in cD.cur_list:
+    fp.add_api_route('/' + cur_code, currency_endpoint(cur_code), methods=['GET'])
 #GETTERS FROM API functions end from here-------------------------------------------------------------------------------
 
 
-#EXACT CURRENCY BUTTONS functions start here----------------------------------------------------------------------------
-@dp.message(F.text.in_(['🇪🇺 Евро']))
-async def req_eur(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Евро"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('EUR')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇧🇾 Белорусский рубль']))
-async def req_byn(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Белорусский рубль"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('BYN')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇺🇦 Украинская гривна']))
-async def req_uah(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Украинская гривна"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('UAH')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇲🇩 Молдавский лей']))
-async def req_mdl(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Молдавский лей"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('MDL')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇷🇴 Румынский лей']))
-async def req_ron(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Румынский лей"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('RON')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇧🇬 Болгарский лев']))
-async def req_bgn(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Болгарский лев"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('BGN')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇭🇺 Венгерский форинт']))
-async def req_huf(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Венгерский форинт"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('HUF')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇨🇿 Чешская крона']))
-async def req_czk(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Чешская крона"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('CZK')
-        await message.answer(resp)
-
-
-@dp.message(F.text.in_(['🇵🇱 Польский злотый']))
-async def req_pln(message: Message):
-    if cD.user_choose["choose_act"] == 1:
-        logger.info('Пользователь нажал кнопку "Польский злотый"')
-        sender = MyCurAPI()
-        resp = await sender.send_request('PLN')
-        await message.answer(resp)
-#EXACT CURRENCY BUTTONS functions end here------------------------------------------------------------------------------
+#EXACT CURRENCY BUTTONS function
+@dp.message(Menu.currencies, F.text.in_(cD.cur_buttons))
+async def req_currency(message: Message):
+    logger.info('Пользователь нажал кнопку "%s"', message.text)
+    resp = CurrencyService.render(cD.cur_buttons[message.text])
+    if resp is None:
+        resp = 'Курсы валют еще загружаются, попробуйте чуть позже 🙏'
+    await outbox.answer(message, resp)
 
 
 # START CHAT function
@@ -385,123 +538,314 @@ async def hello(message: types.Message):
         [types.KeyboardButton(text='Другой вопрос')]
     ]
     keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-    await message.answer('Привет!😄\nВыбери что тебя интересует👇', reply_markup=keyboard)
+    await outbox.answer(message, 'Привет!😄\nВыбери что тебя интересует👇', reply_markup=keyboard)
 
 
 # CURRENCIES LIST button function
 @dp.message(F.text.in_(['Уровень валют восточной Европы', 'уровень валют восточной европы', 'валюты', 'уровень валют']))
-async def currencies(message: types.Message):
-    if cD.user_choose["choose_act"] == 0 or 2 or 3:
-        cD.user_choose["choose_act"] = 1
-        logger.debug('переход в меню 1 (валюты)')
-        bttns = [
-            [types.KeyboardButton(text='🇪🇺 Евро')],
-            [types.KeyboardButton(text='🇧🇾 Белорусский рубль')],
-            [types.KeyboardButton(text='🇺🇦 Украинская гривна')],
-            [types.KeyboardButton(text='🇲🇩 Молдавский лей')],
-            [types.KeyboardButton(text='🇷🇴 Румынский лей')],
-            [types.KeyboardButton(text='🇧🇬 Болгарский лев')],
-            [types.KeyboardButton(text='🇭🇺 Венгерский форинт')],
-            [types.KeyboardButton(text='🇨🇿 Чешская крона')],
-            [types.KeyboardButton(text='🇵🇱 Польский злотый')],
-            [types.KeyboardButton(text='↩️ Назад')]
-        ]
-        keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-        await message.answer('Выберите интересующую валюту', reply_markup=keyboard)
+async def currencies(message: types.Message, state: FSMContext):
+    await state.set_state(Menu.currencies)
+    logger.debug('переход в меню 1 (валюты)')
+    bttns = [
+        [types.KeyboardButton(text='🇪🇺 Евро')],
+        [types.KeyboardButton(text='🇧🇾 Белорусский рубль')],
+        [types.KeyboardButton(text='🇺🇦 Украинская гривна')],
+        [types.KeyboardButton(text='🇲🇩 Молдавский лей')],
+        [types.KeyboardButton(text='🇷🇴 Румынский лей')],
+        [types.KeyboardButton(text='🇧🇬 Болгарский лев')],
+        [types.KeyboardButton(text='🇭🇺 Венгерский форинт')],
+        [types.KeyboardButton(text='🇨🇿 Чешская крона')],
+        [types.KeyboardButton(text='🇵🇱 Польский злотый')],
+        [types.KeyboardButton(text='↩️ Назад')]
+    ]
+    keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
+    await outbox.answer(message, 'Выберите интересующую валюту', reply_markup=keyboard)
 
 
 #BACK button function
 @dp.message(F.text.in_(['↩️ Назад', 'Назад', 'назад']))
-async def back(message: types.Message):
-    if cD.user_choose["choose_act"] == 1 or 2 or 3:
-        cD.user_choose["choose_act"] = 0
-        logger.debug('Возврат к меню 0 (главное меню)')
-        bttns = [
-            [types.KeyboardButton(text='Уровень валют восточной Европы')],
-            [types.KeyboardButton(text='Заявка в УК')],
-            [types.KeyboardButton(text='Другой вопрос')]
-        ]
-        keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-        await message.answer('Доступные действия:', reply_markup=keyboard)
+async def back(message: types.Message, state: FSMContext):
+    await state.set_state(None)
+    logger.debug('Возврат к меню 0 (главное меню)')
+    bttns = [
+        [types.KeyboardButton(text='Уровень валют восточной Европы')],
+        [types.KeyboardButton(text='Заявка в УК')],
+        [types.KeyboardButton(text='Другой вопрос')]
+    ]
+    keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
+    await outbox.answer(message, 'Доступные действия:', reply_markup=keyboard)
 
 
 #OTHER QUESTIONS button function
 @dp.message(F.text.in_(['Другой вопрос', 'другой вопрос', 'другое']))
-async def ask_anything(message: types.Message):
-    if cD.user_choose["choose_act"] == 0 or 1 or 2:
-        cD.user_choose["choose_act"] = 3
-        logger.debug('переход в меню 3 (другой вопрос)')
-        bttns = [[types.KeyboardButton(text='↩️ Назад')]]
-        keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-        await message.answer('Могу подсказать:\nСколько время🕰\nКакая погода в Перми и других городах🌤\nА так же '
-                             'рассказать восточноевропейский анекдот🤡🇷🇸', reply_markup=keyboard)
+async def ask_anything(message: types.Message, state: FSMContext):
+    await state.set_state(Menu.other)
+    logger.debug('переход в меню 3 (другой вопрос)')
+    bttns = [[types.KeyboardButton(text='↩️ Назад')]]
+    keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
+    await outbox.answer(message, 'Могу подсказать:\nСколько время🕰\nКакая погода в Перми и других '
+                                 'городах🌤\nКак менялся курс (например, «EUR за неделю»)📈\nА так же рассказать '
+                                 'восточноевропейский анекдот🤡🇷🇸', reply_markup=keyboard)
 
 
 #QUERRY button function
 @dp.message(F.text.in_(['Заявка в УК']))
-async def ask_for_query(message: Message):
-    if cD.user_choose['choose_act'] == 0 or 1 or 3:
-        cD.user_choose['choose_act'] = 2
-        logger.debug('переход в меню 2 (заявка в ук)')
-        bttns = [[types.KeyboardButton(text='↩️ Назад')]]
-        keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-        await message.answer('Пожалуйста, напишите ваше обращение для управляющей компании в чат',
-                             reply_markup=keyboard)
+async def ask_for_query(message: Message, state: FSMContext):
+    await state.set_state(Menu.query)
+    logger.debug('переход в меню 2 (заявка в ук)')
+    bttns = [[types.KeyboardButton(text='↩️ Назад')]]
+    keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
+    await outbox.answer(message, 'Пожалуйста, напишите ваше обращение для управляющей компании в чат',
+                        reply_markup=keyboard)
+
+
+#RATE HISTORY QUESTIONS function
+@dp.message(Menu.other, F.text.regexp(history_re).as_('match'))
+async def history_question(message: types.Message, match):
+    code = CurrencyService.resolve(match.group(1))
+    days = int(match.group(3)) if match.group(3) else cD.history_periods[match.group(2).lower()]
+    summary = await asyncio.to_thread(rate_history.summary, code, days) if code else None
+    if summary is None:
+        await outbox.answer(message, 'Простите, истории курса этой валюты у меня нет 😓')
+    else:
+        await outbox.answer(message, CurrencyService.render_history(summary))
+        logger.info('Бот сообщил историю курса %s', code)
+
+
+@dp.message(Menu.other, F.text.regexp(convert_re).as_('match'))
+async def convert_question(message: types.Message, match):
+    amount = float(match.group(1).replace(',', '.'))
+    src, dst = CurrencyService.resolve(match.group(2)), CurrencyService.resolve(match.group(3))
+    rates = CurrencyService.rates
+    if src not in rates or dst not in rates:
+        await outbox.answer(message, 'Простите, такой валюты я не знаю 😓')
+        return
+    result = rates.convert(amount, src, dst)
+    await outbox.answer(message, CurrencyService.render_conversion(amount, src, dst, result))
+    logger.info('Бот перевел %s в %s', src, dst)
+
+
+# Rendering one subscription text; the scheduler calls it once per city or currency per tick
+async def render_subscription(kind, arg):
+    if kind == 'weather':
+        return await WeatherData.get_loc_weather(arg)
+    if kind == 'joke':
+        return await Joke.get_joke()
+    resp = CurrencyService.render(arg)
+    if resp is None:
+        rate = CurrencyService.rates.rate(arg, 'RUB')
+        resp = 'На текущий момент\n' + CurrencyService.render_conversion(1, arg, 'RUB', rate)
+    return resp
+
+
+async def deliver_subscription(chat_id, text):
+    await outbox.send(chat_id, text, priority=2)
+
+
+subscriptions = Subscriptions(render_subscription, deliver_subscription)
+
+
+async def parse_subscription(subject):
+    words = subject.lower().split()
+    if words[0].startswith('погод'):
+        if len(words) == 1:
+            return 'weather', 'Пермь'
+        # A place nobody recognised is not a reason to send the weather in Perm
+        loc = await executor.run('location', Location.extract, subject)
+        return ('weather', loc) if loc else (None, None)
+    if words[0].startswith(('анекдот', 'шутк')):
+        return 'joke', ''
+    for word in words:
+        code = CurrencyService.resolve(word)
+        # Ruble to ruble is always 1, "курс рубля к евро" is about the other currency
+        if code != 'RUB' and (code in CurrencyService.rates or code in cD.cur_list):
+            return 'currency', code
+    return None, None
+
+
+def describe_subscription(sub):
+    what = {'weather': 'погода: ' + sub.arg, 'currency': 'курс ' + sub.arg, 'joke': 'анекдот'}[sub.kind]
+    return f'{sub.minute // 60}:{sub.minute % 60:02d} - {what}'
+
+
+@dp.message(Menu.other, F.text.regexp(subscribe_re).as_('match'))
+async def subscribe(message: types.Message, match):
+    hour, minute = int(match.group(2)), int(match.group(3))
+    try:
+        kind, arg = await parse_subscription(match.group(1))
+    except (StageOverloaded, asyncio.TimeoutError):
+        await outbox.answer(message, 'Слишком много запросов, попробуйте чуть позже 🙏')
+        return
+    if kind is None or hour > 23 or minute > 59:
+        await outbox.answer(message, 'Простите, не понял на что подписаться 😓\n'
+                                     'Например: присылай погоду в Перми в 8:00')
+        return
+    subscription_id = await subscriptions.add(message.chat.id, kind, arg, hour * 60 + minute)
+    if subscription_id is None:
+        await outbox.answer(message, 'У Вас уже слишком много подписок, отпишитесь от старых 🙏')
+        return
+    await outbox.answer(message, f'Готово! Буду присылать каждый день в {hour}:{minute:02d} ⏰')
+    logger.info('Пользователь подписался на %s в %d:%02d', kind, hour, minute)
+
+
+@dp.message(Menu.other, F.text.regexp(unsubscribe_re))
+async def unsubscribe(message: types.Message):
+    count = await subscriptions.remove_chat(message.chat.id)
+    await outbox.answer(message, f'Подписки отменены: {count}' if count else 'У Вас нет подписок')
+    logger.info('Пользователь отменил подписки')
+
+
+@dp.message(Menu.other, F.text.regexp(subscriptions_re))
+async def list_subscriptions(message: types.Message):
+    subs = await subscriptions.list_chat(message.chat.id)
+    if not subs:
+        await outbox.answer(message, 'У Вас нет подписок')
+    else:
+        await outbox.answer(message, 'Ваши подписки:\n' + '\n'.join(describe_subscription(sub) for sub in subs))
 
 
-#FREE-FORM & GARBAGE QUESTIONS button function
-@dp.message()
+#FREE-FORM QUESTIONS function
+@dp.message(Menu.other)
 async def other_questions(message: types.Message):
-    if cD.user_choose["choose_act"] == 3:
-        logger.info('Обработка пользовательского вопроса в свободной форме')
-        t = process.extractOne(message.text, cD.time_question)
-        w = process.extractOne(message.text, cD.weather_question)
-        wp = process.extractOne(message.text, cD.weather_locale_question)
-        j = process.extractOne(message.text, cD.joke_question)
-        logger.debug('Схожесть вопроса по Левенштейну:\nВремя - ' + str(t[1]) + '\nПогода локально - ' + str(wp[1]) +
-                     '\nПогода в другом месте - ' + str(w[1]) + '\nАнекдот - ' + str(j[1]))
-        if t[1] >= 80:
-            await message.answer(str(datetime.now().strftime('Текущее время по Перми - %H ч. %M мин.')))
-            logger.info('Бот сообщил время')
-        elif wp[1] > 95:
-            wd = await WeatherData.get_weather('Какая погода в Перми?')
-            await message.answer(wd)
-        elif w[1] >= 80:
-            wd = await WeatherData.get_weather(message.text)
-            await message.answer(wd)
-        elif j[1] >= 80:
-            jk = await Joke.get_joke()
-            await message.answer(jk)
-            if jk is not 'Анектода сегодня не будет, простите (вероятно подписка на API  санекдотами истекла)':
-                logger.info('Бот рассказал анекдот')
-            else:
-                logger.info('Бот не смог выдать анекдот')
-        else:
-            await message.answer('Простите, на данный вопрос ответить я не могу 😓')
-            logger.debug('Бот не уловил суть вопроса')
-    elif cD.user_choose['choose_act'] == 2:
-        query = message.text
-        bttns = [[types.KeyboardButton(text='↩️ Назад')]]
-        logger.info('Пользователь отправил заявку о проблемах в управляющую компанию')
-        keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
-        query = prepare(query)
-        query_stat = pred_mod.predict([query])
-        logger.debug('Заявке присвоен тип')
-        await message.answer(f'Заявке присвоен тип: {query_stat[0]}.\nСпасибо что обратились, уже работаем над'
-                             f' вашей проблемой!', reply_markup=keyboard)
+    logger.info('Обработка пользовательского вопроса в свободной форме')
+    with Metrics.stage('fuzzy'):
+        intent, scores = intent_router.route(message.text)
+    logger.debug('Схожесть вопроса по Левенштейну: %s', scores)
+    if intent == 'time':
+        await outbox.answer(message, str(datetime.now().strftime('Текущее время по Перми - %H ч. %M мин.')))
+        logger.info('Бот сообщил время')
+    elif intent == 'weather_locale':
+        wd = await WeatherData.get_loc_weather('Пермь')
+        await outbox.answer(message, wd)
+    elif intent == 'weather':
+        wd = await WeatherData.get_weather(message.text)
+        await outbox.answer(message, wd)
+    elif intent == 'joke':
+        jk = await Joke.get_joke()
+        await outbox.answer(message, jk)
+    else:
+        await outbox.answer(message, 'Простите, на данный вопрос ответить я не могу 😓')
+        logger.debug('Бот не уловил суть вопроса')
+
+
+# Forwarding classified complaint to management company and telling the user its type;
+# the complaint is done only once Telegram has it, a failed send raises and the intake retries it
+async def forward_complaint(complaint_id, chat_id, text, label):
+    await outbox.deliver(int(UK_CHAT_ID), f'Заявка №{complaint_id}, тип: {label}\n{text}')
+    await outbox.send(chat_id, f'Заявке №{complaint_id} присвоен тип: {label}.\nУже работаем над вашей проблемой!')
+    logger.debug('Заявке %d присвоен тип', complaint_id)
+
+
+complaints = ComplaintIntake(classifier, forward_complaint)
+
+
+# Without the management chat complaints are only stored, and forwarded once it is configured
+def start_complaints():
+    if not UK_CHAT_ID:
+        logger.error('UK_CHAT_ID не задан: заявки сохраняются, но не пересылаются в управляющую компанию')
+        return set()
+    return complaints.start()
+
+
+#QUERRY MESSAGE function
+@dp.message(Menu.query)
+async def query_message(message: types.Message):
+    bttns = [[types.KeyboardButton(text='↩️ Назад')]]
+    logger.info('Пользователь отправил заявку о проблемах в управляющую компанию')
+    keyboard = types.ReplyKeyboardMarkup(keyboard=bttns, resize_keyboard=True)
+    complaint_id, duplicate_of = await complaints.submit(message.chat.id, message.text)
+    if duplicate_of is not None:
+        await outbox.answer(message, f'Такая заявка уже принята под номером {duplicate_of}, мы уже работаем над'
+                                     f' этой проблемой!', reply_markup=keyboard)
+    else:
+        await outbox.answer(message, f'Заявка №{complaint_id} принята. Спасибо что обратились, тип заявки сообщим'
+                                     f' сразу после обработки!', reply_markup=keyboard)
+
+
+#GARBAGE MESSAGE function
+@dp.message()
+async def garbage_message(message: types.Message):
+    await outbox.answer(message, 'Простите, на данный вопрос ответить я не могу 😓')
+
+
+#WEBHOOK for receiving updates from Telegram
+@fp.post('/webhook')
+async def webhook(request: Request):
+    if WEBHOOK_SECRET and request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+        return Response(status_code=403)
+    update = types.Update.model_validate(await request.json(), context={'bot': bot})
+    await dp.feed_update(bot, update)
+    return Response()
+
+
+# Only one worker process gets the lock and refreshes currencies
+def elect_leader():
+    lock = open(leader_lock_file, 'w')
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock.close()
+        return None
+    return lock
+
+
+@fp.on_event('startup')
+async def on_startup():
+    if os.getenv('BOT_MODE') != 'webhook':
+        return
+    if not WEBHOOK_URL:
+        raise RuntimeError('Для режима webhook нужна переменная окружения WEBHOOK_URL')
+    fp.state.leader_lock = elect_leader()
+    if fp.state.leader_lock is not None:
+        logger.info('Процесс %d обновляет данные по валютам', os.getpid())
+        CurrencyData.restore_snapshot()
+        background_tasks.add(asyncio.create_task(CurrencyData().update_currencies()))
+        background_tasks.add(asyncio.create_task(subscriptions.run()))
+        await bot.set_webhook(WEBHOOK_URL + '/webhook', secret_token=WEBHOOK_SECRET)
     else:
-        await message.answer('Простите, на данный вопрос ответить я не могу 😓')
+        background_tasks.add(asyncio.create_task(CurrencyData.follow_snapshot()))
+    background_tasks.add(asyncio.create_task(Joke.refill_jokes()))
+    background_tasks.add(asyncio.create_task(watch_model()))
+    background_tasks.update(outbox.start())
+    background_tasks.update(start_complaints())
+
+
+@fp.on_event('shutdown')
+async def on_shutdown():
+    if os.getenv('BOT_MODE') == 'webhook':
+        await HttpClient.close()
+        await bot.session.close()
+        executor.shutdown()
 
 
 #Building ORDER OF EXECUTION functions
 async def main():
     check = CurrencyData()
+    CurrencyData.restore_snapshot()
     asyncio.create_task(check.update_currencies())
+    background_tasks.add(asyncio.create_task(subscriptions.run()))
+    asyncio.create_task(Joke.refill_jokes())
+    asyncio.create_task(watch_model())
+    background_tasks.update(outbox.start())
+    background_tasks.update(start_complaints())
     asyncio.create_task(dp.start_polling(bot))
-    config = uvicorn.Config(fp, host='localhost', port=8008)
+    config = uvicorn.Config(fp, host=args.host, port=args.port)
     server = uvicorn.Server(config)
-    await server.serve()
+    try:
+        await server.serve()
+    finally:
+        await HttpClient.close()
+        executor.shutdown()
 
 
 if __name__ == '__main__':
-    asyncio.run(main())
+    if args.mode == 'webhook':
+        if not WEBHOOK_URL:
+            parser.error('для режима webhook нужна переменная окружения WEBHOOK_URL')
+        if args.workers > 1 and not os.getenv('REDIS_URL'):
+            parser.error('для нескольких рабочих процессов нужна переменная окружения REDIS_URL')
+        os.environ['BOT_MODE'] = 'webhook'
+        os.environ['BOT_WORKERS'] = str(args.workers)
+        uvicorn.run('Bot:fp', host=args.host, port=args.port, workers=args.workers)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+from collections import OrderedDict
+
+
+# TTL CACHE that also merges concurrent requests for the same key into one
+class TTLCache:
+    def __init__(self, ttl, negative_ttl=None, maxsize=1024, is_negative=None):
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.maxsize = maxsize
+        self.is_negative = is_negative
+        self.items = OrderedDict()
+        self.pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get_cached(self, key):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        if item[0] < time.monotonic():
+            del self.items[key]
+            return None
+        self.items.move_to_end(key)
+        return item
+
+    def put(self, key, value):
+        ttl = self.negative_ttl if self.is_negative and self.is_negative(value) else self.ttl
+        self.items[key] = (time.monotonic() + ttl, value)
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    async def get(self, key, fetch):
+        item = self.get_cached(key)
+        if item is not None:
+            self.hits += 1
+            return item[1]
+        self.misses += 1
+        task = self.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fetch())
+            self.pending[key] = task
+            task.add_done_callback(lambda t: self.on_done(key, t))
+        # Shielding so one cancelled caller does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    def on_done(self, key, task):
+        self.pending.pop(key, None)
+        if not task.cancelled() and task.exception() is None:
+            self.put(key, task.result())
@@ -1,64 +1,156 @@
+import asyncio
+import logging
 import os
+import Metrics
 import string
-import re
-import pymorphy3
-import pandas as pd
 
-from joblib import dump
-from nltk.corpus import stopwords
-from sklearn.model_selection import train_test_split
-from sklearn.linear_model import LogisticRegression
-from sklearn.pipeline import Pipeline
-from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.feature_extraction.text import CountVectorizer
+from concurrent.futures import ProcessPoolExecutor
+from Executor import executor
+from functools import lru_cache
+from itertools import islice
+from Morph import get_morph
 
-morph = pymorphy3.MorphAnalyzer()
+logger = logging.getLogger('base')
 
-cur_dir = os.getcwd()
-test_dat = os.path.join(cur_dir, 'train_dataset.csv')
-test_dat = pd.read_csv(test_dat)
+model_file = os.path.join(os.getcwd(), 'trained_model.joblib')
 
 garbage = string.punctuation + string.digits + 'club' + 'id' + '—'
 
-# Deleting TRASH and NON-ESSENTIAL INFO
+translator = str.maketrans('', '', garbage)
+
+
+# Class for deleting TRASH and NON-ESSENTIAL INFO from texts
+class Normalizer:
+    def __init__(self, cache_size=100000):
+        from nltk.corpus import stopwords
+        self.stop_words = frozenset(stopwords.words("russian"))
+        self.lemma = lru_cache(maxsize=cache_size)(self.get_lemma)
+
+    @staticmethod
+    def get_lemma(word):
+        return get_morph().parse(word)[0].normal_form
+
+    def normalize(self, txt):
+        return ' '.join(self.lemma(word.lower()) for word in txt.translate(translator).split()
+                        if word not in self.stop_words)
+
+    def normalize_many(self, texts, workers=None, chunksize=256):
+        if not workers:
+            for txt in texts:
+                yield self.normalize(txt)
+            return
+        texts = iter(texts)
+        with ProcessPoolExecutor(workers) as pool:
+            while batch := list(islice(texts, chunksize * workers)):
+                yield from pool.map(prepare, batch, chunksize=chunksize)
+
+
+normalizer = None
+model = None
+
+
+def get_normalizer():
+    global normalizer
+    if normalizer is None:
+        normalizer = Normalizer()
+    return normalizer
+
+
 def prepare(txt):
-    prep_text = ''
-    txt = txt.translate(str.maketrans('', '', garbage))
-    for word in txt.split():
-        new_line = ''
-        if word not in stopwords.words("russian"):
-            word = morph.parse(word)[0].normal_form
-            new_line += word + ' '
+    return get_normalizer().normalize(txt)
+
+
+# Loading trained MODEL on first use: shared mmap artifact if exported, joblib otherwise
+def get_model():
+    global model
+    if model is None:
+        from Artifact import MappedModel, current_version, is_stale
+        mapped = current_version() is not None
+        if mapped and is_stale(model_file):
+            logger.warning('Артефакт модели старше %s, модель загружается из joblib', model_file)
+            mapped = False
+        if mapped:
+            model = MappedModel()
         else:
-            new_line += ''
-        prep_text += '' + new_line.lower()
-    re.sub(r'\s+', ' ', prep_text, flags=re.I)
-    return prep_text
+            from joblib import load
+            model = load(model_file)
+    return model
+
+
+# Swapping model when a new artifact version is exported, without restart
+def reload_model():
+    global model
+    from Artifact import MappedModel, current_version, is_stale
+    version = current_version()
+    if version is None or getattr(model, 'version', None) == version or is_stale(model_file):
+        return False
+    model = MappedModel(version=version)
+    return True
+
 
+async def watch_model(interval=60):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            if await asyncio.to_thread(reload_model):
+                logger.info('Загружена новая версия модели %s', model.version)
+                executor.recycle()
+        except (OSError, ValueError) as e:
+            logger.warning('Не удалось загрузить новую версию модели: %r', e)
 
-# Teaching MODEL
-def teach(file):
-    file['preproccessed'] = list(map(prepare, file['Текст инцидента']))
 
-    x = file['preproccessed']
-    y = file['Тема']
-    x_train, x_test, y_train, y_test = train_test_split(x, y, test_size=0.3, random_state=42)
+# Micro-batching CLASSIFIER: collects requests for a few ms and predicts them in one call
+class BatchClassifier:
+    def __init__(self, max_batch=64, max_delay=0.005):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.queue = None
+        self.task = None
 
-    file['Тема'].unique()
+    @staticmethod
+    def predict(texts):
+        model = get_model()
+        with Metrics.stage('lemmatise'):
+            prepared = [prepare(txt) for txt in texts]
+        with Metrics.stage('inference'):
+            proba = model.predict_proba(prepared)
+        best = proba.argmax(axis=1)
+        return [(str(model.classes_[i]), float(proba[row, i])) for row, i in enumerate(best)]
 
-    logreg = Pipeline([('vec', CountVectorizer()),
-                       ('tfdf', TfidfTransformer()),
-                       ('lr', LogisticRegression(n_jobs=1, C=1e5)),
-                       ])
+    async def classify(self, txt):
+        if self.task is None or self.task.done():
+            self.queue = asyncio.Queue()
+            self.task = asyncio.create_task(self.run())
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((txt, future))
+        return await future
 
-    logreg.fit(x_train, y_train)
+    async def classify_many(self, texts):
+        return await asyncio.gather(*(self.classify(txt) for txt in texts))
 
-    model_file = 'trained_model.joblib'
-    dump(logreg, model_file)
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                results = await executor.run('predict', BatchClassifier.predict, [txt for txt, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
 
 
-'''match input('Необходимо провести новое обучение модели?(Y/N):\n'):
-    case 'N', 'n':
-        print('Ok')
-    case 'Y', 'y':
-        teach(test_dat)'''
+classifier = BatchClassifier()
@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from Classification import prepare
+from Executor import StageOverloaded, executor
+
+logger = logging.getLogger('base')
+
+db_file = os.path.join(os.getcwd(), 'complaints.sqlite3')
+
+
+# Durable STORE of complaints, safe to share between worker processes
+class ComplaintStore:
+    def __init__(self, path=db_file, lease=300, dedup_window=24 * 60 * 60, max_attempts=5):
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self.dedup_window = dedup_window
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=FULL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS complaints (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               chat_id INTEGER NOT NULL,
+                               text TEXT NOT NULL,
+                               norm TEXT NOT NULL,
+                               status TEXT NOT NULL DEFAULT 'new',
+                               duplicate_of INTEGER,
+                               label TEXT,
+                               attempts INTEGER NOT NULL DEFAULT 0,
+                               created REAL NOT NULL,
+                               claimed REAL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS complaints_status ON complaints (status, id)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS complaints_norm ON complaints (norm, created)')
+
+    # Saving complaint; the same normalised text within the window is stored as a duplicate
+    def add(self, chat_id, text, norm):
+        now = time.time()
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                # Texts of only stop words, digits or punctuation normalise to nothing and are never duplicates
+                row = self.db.execute("SELECT id FROM complaints WHERE norm = ? AND created > ? "
+                                      "AND duplicate_of IS NULL ORDER BY id LIMIT 1",
+                                      (norm, now - self.dedup_window)).fetchone() if norm else None
+                if row is None:
+                    cursor = self.db.execute('INSERT INTO complaints (chat_id, text, norm, created) '
+                                             'VALUES (?, ?, ?, ?)', (chat_id, text, norm, now))
+                else:
+                    cursor = self.db.execute("INSERT INTO complaints (chat_id, text, norm, status, duplicate_of, "
+                                             "created) VALUES (?, ?, ?, 'duplicate', ?, ?)",
+                                             (chat_id, text, norm, row[0], now))
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return cursor.lastrowid, None if row is None else row[0]
+
+    # Taking complaints for processing; claims of crashed workers expire after the lease
+    def claim(self, limit):
+        now = time.time()
+        with self.lock:
+            # A complaint that keeps crashing its worker is given up like one that keeps failing
+            for complaint_id, attempts in self.db.execute(
+                    "UPDATE complaints SET status = 'failed' WHERE status = 'processing' AND claimed < ? "
+                    "AND attempts >= ? RETURNING id, attempts", (now - self.lease, self.max_attempts)).fetchall():
+                logger.error('Заявка %d не обработана за %d попыток и помечена как failed', complaint_id, attempts)
+            return self.db.execute("UPDATE complaints SET status = 'processing', claimed = ?, attempts = attempts + 1 "
+                                   "WHERE id IN (SELECT id FROM complaints WHERE status = 'new' "
+                                   "OR (status = 'processing' AND claimed < ?) ORDER BY id LIMIT ?) "
+                                   "RETURNING id, chat_id, text, attempts",
+                                   (now, now - self.lease, limit)).fetchall()
+
+    def done(self, complaint_id, label):
+        with self.lock:
+            self.db.execute("UPDATE complaints SET status = 'done', label = ? WHERE id = ?", (label, complaint_id))
+
+    def release(self, complaint_id):
+        with self.lock:
+            self.db.execute("UPDATE complaints SET status = 'new' WHERE id = ?", (complaint_id,))
+
+    def fail(self, complaint_id):
+        with self.lock:
+            self.db.execute("UPDATE complaints SET status = 'failed' WHERE id = ?", (complaint_id,))
+
+
+# INTAKE: persists complaints at once, classifies and forwards them with a bounded pool of workers
+class ComplaintIntake:
+    def __init__(self, classifier, forward, workers=4, maxsize=100, poll=5, max_attempts=5, backoff=1.0):
+        self.classifier = classifier
+        self.forward = forward
+        self.workers = workers
+        self.poll = poll
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.store = None
+        self.queue = asyncio.Queue(maxsize)
+        self.wakeup = asyncio.Event()
+
+    def get_store(self):
+        if self.store is None:
+            self.store = ComplaintStore(max_attempts=self.max_attempts)
+        return self.store
+
+    async def submit(self, chat_id, text):
+        try:
+            norm = await executor.run('lemmatise', prepare, text)
+        except (StageOverloaded, asyncio.TimeoutError):
+            # The complaint is saved anyway, only duplicates with other word forms are missed
+            norm = ' '.join(text.lower().split())
+        complaint_id, duplicate_of = await asyncio.to_thread(self.get_store().add, chat_id, text, norm)
+        if duplicate_of is None:
+            self.wakeup.set()
+        return complaint_id, duplicate_of
+
+    # Claiming only as many complaints as the queue can hold, the rest waits in the database
+    async def feed(self):
+        while True:
+            self.wakeup.clear()
+            free = self.queue.maxsize - self.queue.qsize()
+            rows = await asyncio.to_thread(self.get_store().claim, free) if free else []
+            for row in rows:
+                self.queue.put_nowait(row)
+            if len(rows) < free or not free:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), self.poll)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def work(self):
+        while True:
+            complaint_id, chat_id, text, attempts = await self.queue.get()
+            if self.queue.qsize() < self.queue.maxsize // 2:
+                self.wakeup.set()
+            try:
+                label, _ = await self.classifier.classify(text)
+                await self.forward(complaint_id, chat_id, text, label)
+                await asyncio.to_thread(self.store.done, complaint_id, label)
+            except Exception as e:
+                if attempts >= self.max_attempts:
+                    logger.error('Заявка %d не обработана за %d попыток и помечена как failed: %r',
+                                 complaint_id, attempts, e)
+                    await asyncio.to_thread(self.store.fail, complaint_id)
+                    continue
+                logger.warning('Не удалось обработать заявку %d (попытка %d): %r', complaint_id, attempts, e)
+                await asyncio.sleep(min(60, self.backoff * 2 ** attempts))
+                await asyncio.to_thread(self.store.release, complaint_id)
+                self.wakeup.set()
+            finally:
+                self.queue.task_done()
+
+    def start(self):
+        self.get_store()
+        return {asyncio.create_task(self.feed())} | {asyncio.create_task(self.work()) for _ in range(self.workers)}
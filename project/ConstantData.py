@@ -1,16 +1,30 @@
 from dataclasses import dataclass
+from types import MappingProxyType
 
 
 @dataclass
 class ConstDat:
     # LISTS
     cur_list = ["EUR", "BYN", "UAH", "MDL", "RON", "BGN", "HUF", "CZK", "PLN"]
-    cur_data_list = {}
+    cur_data_list = MappingProxyType({})
+    cur_flags = {"EUR": "🇪🇺", "BYN": "🇧🇾", "UAH": "🇺🇦", "MDL": "🇲🇩", "RON": "🇷🇴", "BGN": "🇧🇬", "HUF": "🇭🇺",
+                 "CZK": "🇨🇿", "PLN": "🇵🇱"}
+    cur_buttons = {'🇪🇺 Евро': "EUR", '🇧🇾 Белорусский рубль': "BYN", '🇺🇦 Украинская гривна': "UAH",
+                   '🇲🇩 Молдавский лей': "MDL", '🇷🇴 Румынский лей': "RON", '🇧🇬 Болгарский лев': "BGN",
+                   '🇭🇺 Венгерский форинт': "HUF", '🇨🇿 Чешская крона': "CZK", '🇵🇱 Польский злотый': "PLN"}
+    cur_aliases = {"евро": "EUR", "доллар": "USD", "юань": "CNY", "злотый": "PLN", "форинт": "HUF", "гривна": "UAH",
+                   "лев": "BGN", "крона": "CZK", "лей": "RON", "франк": "CHF", "фунт": "GBP", "иена": "JPY",
+                   "тенге": "KZT", "рубль": "RUB"}
+    history_periods = {"неделю": 7, "месяц": 30, "год": 365}
     country_codes = [1, 2, 6, 11, 12, 13, 15, 38, 42, 43, 44, 45, 46, 50]
     joke_flag = ['России🇷🇺:', 'СССР🇨🇳:', 'Болгарии🇧🇬:', 'Беларуси🇧🇾:', 'Чехии🇨🇿:', 'России🇷🇺:', 'Польши🇵🇱:',
                  'Румынии🇷🇴:',
                  'Югославии🇷🇸:', 'Сербии🇷🇸:', 'Хорватии🇭🇷:', 'Боснии и Герцоговины🇧🇦:', 'Словении🇸🇮:', 'Македонии🇲🇰:']
-    user_choose = {"choose_act": 0}
+    fallback_jokes = ['Встречаются два программиста:\n- Как дела?\n- Нормально, но в продакшене не проверял.',
+                      '- Доктор, у меня провалы в памяти.\n- С каких пор?\n- С каких пор что?',
+                      'Штирлиц долго смотрел в одну точку. Потом в другую. "Двоеточие!" - догадался Штирлиц.',
+                      'Купил мужик шляпу, а она ему как раз.',
+                      '- Сколько стоит этот попугай?\n- Тысячу рублей.\n- А он говорит?\n- Он считает.']
     time_question = ['Какое время?', 'Сколько времени?', 'Скажи время', 'Подскажи время', 'Текущее время',
                      'Время не подскажешь?', 'Сколько часов?', 'Какой сейчас час?', 'Который час?']
     weather_question = ['Какая погода в', 'Подскажи погоду в', 'Сколько градусов в', 'Как погода в', 'Погода в',
@@ -18,3 +32,10 @@ class ConstDat:
     weather_locale_question = ['Какая погода на улице?', 'Как погода?', 'Что за погода за окном?', 'Что с погодой?',
                                'Какая погода?', 'Как погодка?', 'Какая погода за окном?', 'Как погода за окном?']
     joke_question = ['Расскажи анекдот', 'Анекдот', 'Хочу анекдот']
+    # Intents checked in this order: templates and minimal similarity score
+    intents = {
+        'time': (time_question, 80),
+        'weather_locale': (weather_locale_question, 96),
+        'weather': (weather_question, 80),
+        'joke': (joke_question, 80),
+    }
@@ -0,0 +1,47 @@
+import numpy as np
+
+
+# Dense TABLE of all CBR rates in rubles: any cross rate is two lookups, the full matrix is one outer division
+class RateTable:
+    def __init__(self, rates):
+        self.codes = ('RUB',) + tuple(sorted(code for code in rates if code != 'RUB'))
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.rates = np.array([1.0] + [float(rates[code]) for code in self.codes[1:]])
+        if not np.all(np.isfinite(self.rates) & (self.rates > 0)):
+            raise ValueError('rates must be positive numbers')
+        self.rates.flags.writeable = False
+
+    @staticmethod
+    def from_cbr(data):
+        return RateTable({code: cur['Value'] / cur['Nominal'] for code, cur in data['Valute'].items()})
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __contains__(self, code):
+        return code in self.index
+
+    def as_dict(self):
+        return dict(zip(self.codes[1:], self.rates[1:].tolist()))
+
+    # Units of dst for one unit of src
+    def rate(self, src, dst):
+        return float(self.rates[self.index[src]] / self.rates[self.index[dst]])
+
+    def convert(self, amount, src, dst):
+        return amount * self.rate(src, dst)
+
+    # Vectorised batch; unknown codes give NaN instead of failing the whole batch
+    def convert_many(self, amounts, srcs, dsts):
+        src = np.fromiter((self.index.get(code, -1) for code in srcs), dtype=np.intp, count=len(srcs))
+        dst = np.fromiter((self.index.get(code, -1) for code in dsts), dtype=np.intp, count=len(dsts))
+        valid = (src >= 0) & (dst >= 0)
+        result = np.asarray(amounts, dtype=np.float64) * self.rates[src] / self.rates[dst]
+        result[~valid] = np.nan
+        return result
+
+    # matrix[i, j]: units of codes[j] for one unit of codes[i]
+    def matrix(self, codes=None):
+        codes = self.codes if codes is None else tuple(codes)
+        rates = self.rates[[self.index[code] for code in codes]]
+        return codes, rates[:, None] / rates[None, :]
@@ -0,0 +1,77 @@
+import hashlib
+import json
+
+from ConstantData import ConstDat as cD
+from Converter import RateTable
+from email.utils import formatdate
+from Location import get_lemma
+from types import MappingProxyType
+
+
+# Shared CURRENCY layer for bot handlers and API endpoints
+class CurrencyService:
+    # Pre-rendered HTTP RESPONSES: (code, 'text' | 'json') -> (body, media type, headers)
+    responses = {}
+    rates = RateTable({})
+    cache_control = 'public, max-age=60, stale-while-revalidate=3600, stale-if-error=86400'
+
+    @staticmethod
+    def get(code):
+        return cD.cur_data_list.get(code)
+
+    @staticmethod
+    def render(code):
+        cur = CurrencyService.get(code)
+        if cur is None:
+            return None
+        return CurrencyService.render_currency(cur)
+
+    @staticmethod
+    def render_currency(cur):
+        return ('На текущий момент\n1 ' + cD.cur_flags[cur.code] + cur.name + ' = ' + str(cur.value) +
+                ' 🇷🇺 Российских рублей')
+
+    # Swapping data, rate table and rendered responses together, once per snapshot
+    @staticmethod
+    def publish(currencies, rates, updated):
+        responses = {}
+        for code, cur in currencies.items():
+            bodies = {'text': (CurrencyService.render_currency(cur).encode('utf-8'), 'text/plain; charset=utf-8'),
+                      'json': (json.dumps({**cur.model_dump(), 'updated': updated}, ensure_ascii=False).encode('utf-8'),
+                               'application/json')}
+            for kind, (body, media_type) in bodies.items():
+                headers = {'ETag': '"' + hashlib.sha1(body).hexdigest() + '"',
+                           'Last-Modified': formatdate(updated, usegmt=True),
+                           'Cache-Control': CurrencyService.cache_control,
+                           'Vary': 'Accept'}
+                responses[(code, kind)] = (body, media_type, headers)
+        # Everything is built above, so no reader sees new rates next to old responses
+        cD.cur_data_list = MappingProxyType(currencies)
+        CurrencyService.rates = rates
+        CurrencyService.responses = responses
+
+    @staticmethod
+    def not_modified(etag, if_none_match):
+        if not if_none_match:
+            return False
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in tags or 'W/' + etag in tags
+
+    # Currency code from user word: "EUR", "евро", "злотых"
+    @staticmethod
+    def resolve(word):
+        if len(word) == 3 and word.isascii() and word.isalpha():
+            return word.upper()
+        return cD.cur_aliases.get(get_lemma(word.lower()))
+
+    @staticmethod
+    def render_conversion(amount, src, dst, result):
+        return (f'{amount:,.2f}'.replace(',', ' ') + ' ' + cD.cur_flags.get(src, '') + src + ' = ' +
+                f'{result:,.2f}'.replace(',', ' ') + ' ' + cD.cur_flags.get(dst, '') + dst)
+
+    @staticmethod
+    def render_history(summary):
+        return ('Курс ' + summary['code'] + ' за ' + str(summary['days']) + ' дн. 📈\n'
+                'Минимум: ' + f"{summary['min']:.3f}" + ' (' + summary['min_date'] + ')\n'
+                'Максимум: ' + f"{summary['max']:.3f}" + ' (' + summary['max_date'] + ')\n'
+                'Изменение: ' + f"{summary['change']:+.3f} ({summary['change_pct']:+.2f}%)")
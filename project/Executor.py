@@ -0,0 +1,116 @@
+import asyncio
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger('base')
+
+
+class StageOverloaded(Exception):
+    pass
+
+
+# Limits of one CPU-bound STAGE: tasks in the pool, tasks waiting for it and time for the whole call
+class Stage:
+    def __init__(self, name, limit, maxsize, timeout):
+        self.name = name
+        self.limit = limit
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(limit)
+        self.pending = 0
+        self.running = 0
+        self.metrics = {'done': 0, 'rejected': 0, 'timeouts': 0}
+
+    def release(self):
+        self.running -= 1
+        self.slots.release()
+
+
+# Process worker initialiser: models are loaded once per worker, not with every task
+def preload():
+    from Classification import get_model, get_normalizer
+    from Location import Location
+    get_normalizer()
+    Location.get_gazetteer()
+    Location.get_ner()
+    try:
+        get_model()
+    except OSError as e:
+        logger.warning('Модель классификации не загружена в процесс %d: %r', os.getpid(), e)
+
+
+# EXECUTOR for NLP stages, so NER, lemmatisation and prediction never run on the event loop
+class StageExecutor:
+    def __init__(self, kind=None, workers=None):
+        self.kind = kind or os.getenv('NLP_EXECUTOR', 'thread')
+        self.workers = workers or int(os.getenv('NLP_WORKERS', min(4, os.cpu_count() or 1)))
+        self.pool = None
+        self.stages = {stage.name: stage for stage in (
+            Stage('location', limit=self.workers, maxsize=200, timeout=5),
+            Stage('lemmatise', limit=self.workers, maxsize=1000, timeout=5),
+            Stage('predict', limit=max(1, self.workers // 2), maxsize=50, timeout=10),
+        )}
+
+    def get_pool(self):
+        if self.pool is None:
+            if self.kind == 'process':
+                self.pool = ProcessPoolExecutor(self.workers, initializer=preload)
+            else:
+                self.pool = ThreadPoolExecutor(self.workers, thread_name_prefix='nlp')
+            logger.info('Запущен пул %s на %d исполнителей', self.kind, self.workers)
+        return self.pool
+
+    # New worker processes pick up a freshly exported model; threads share it with the loop already
+    def recycle(self):
+        if self.kind == 'process' and self.pool is not None:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    async def run(self, name, fn, *args):
+        stage = self.stages[name]
+        if stage.pending >= stage.maxsize:
+            stage.metrics['rejected'] += 1
+            raise StageOverloaded(name)
+        stage.pending += 1
+        try:
+            return await asyncio.wait_for(self.submit(stage, fn, *args), stage.timeout)
+        except asyncio.TimeoutError:
+            stage.metrics['timeouts'] += 1
+            logger.warning('Этап %s не уложился в %.1f с', name, stage.timeout)
+            raise
+        finally:
+            stage.pending -= 1
+
+    async def submit(self, stage, fn, *args):
+        await stage.slots.acquire()
+        try:
+            future = self.get_pool().submit(fn, *args)
+        except BaseException:
+            stage.slots.release()
+            raise
+        stage.running += 1
+        # Slot is freed only when the work really ends, so timed out tasks still count against the limit
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(stage.release))
+        try:
+            result = await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            self.pool = None
+            raise
+        stage.metrics['done'] += 1
+        return result
+
+    def stats(self):
+        return {name: {'running': stage.running, 'pending': stage.pending, **stage.metrics}
+                for name, stage in self.stages.items()}
+
+
+executor = StageExecutor()
@@ -0,0 +1,152 @@
+import aiohttp
+import asyncio
+import json
+import logging
+import Metrics
+import os
+import random
+import time
+
+from typing import NamedTuple
+
+logger = logging.getLogger('base')
+
+
+class UpstreamError(aiohttp.ClientError):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+class Reply(NamedTuple):
+    status: int
+    headers: dict
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body)
+
+    def text(self):
+        return self.body.decode('utf-8')
+
+
+# CIRCUIT BREAKER: after several failures in a row the upstream is skipped, then probed by a single request
+class CircuitBreaker:
+    def __init__(self, name, threshold, reset):
+        self.name = name
+        self.threshold = threshold
+        self.reset = reset
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+
+    def allow(self):
+        if self.opened is None:
+            return True
+        if not self.probing and time.monotonic() - self.opened >= self.reset:
+            self.probing = True
+            return True
+        return False
+
+    def success(self):
+        self.failures = 0
+        self.opened = None
+        self.probing = False
+
+    def failure(self):
+        self.failures += 1
+        self.probing = False
+        if self.failures >= self.threshold:
+            if self.opened is None:
+                logger.warning('Сервис %s недоступен, запросы к нему приостановлены на %d с', self.name, self.reset)
+            self.opened = time.monotonic()
+
+    @property
+    def state(self):
+        if self.opened is None:
+            return 'closed'
+        return 'half-open' if self.probing else 'open'
+
+
+# Shared ASYNC HTTP client for all upstream requests: keep-alive pools, retries, breakers, merged GETs
+class HttpClient:
+    session = None
+    timeout = aiohttp.ClientTimeout(total=float(os.getenv('HTTP_TIMEOUT', 10)),
+                                    connect=float(os.getenv('HTTP_CONNECT_TIMEOUT', 3)))
+    retries = int(os.getenv('HTTP_RETRIES', 2))
+    backoff = float(os.getenv('HTTP_BACKOFF', 0.5))
+    limit_per_host = int(os.getenv('HTTP_LIMIT_PER_HOST', 20))
+    breaker_threshold = int(os.getenv('HTTP_BREAKER_THRESHOLD', 5))
+    breaker_reset = float(os.getenv('HTTP_BREAKER_RESET', 30))
+    breakers = {}
+    pending = {}
+
+    @classmethod
+    async def get_session(cls):
+        if cls.session is None or cls.session.closed:
+            connector = aiohttp.TCPConnector(limit=0, limit_per_host=cls.limit_per_host,
+                                             keepalive_timeout=60, ttl_dns_cache=300)
+            cls.session = aiohttp.ClientSession(timeout=cls.timeout, connector=connector)
+        return cls.session
+
+    @classmethod
+    async def close(cls):
+        if cls.session is not None and not cls.session.closed:
+            await cls.session.close()
+        cls.session = None
+
+    @classmethod
+    def get_breaker(cls, upstream):
+        breaker = cls.breakers.get(upstream)
+        if breaker is None:
+            breaker = cls.breakers[upstream] = CircuitBreaker(upstream, cls.breaker_threshold, cls.breaker_reset)
+        return breaker
+
+    @classmethod
+    def stats(cls):
+        return {upstream: {'state': breaker.state, 'failures': breaker.failures}
+                for upstream, breaker in cls.breakers.items()}
+
+    # GET with identical requests already in flight merged into one
+    @classmethod
+    async def get(cls, upstream, url, params=None, headers=None, timeout=None, retries=None):
+        key = (url, tuple(sorted((params or {}).items())), tuple(sorted((headers or {}).items())))
+        task = cls.pending.get(key)
+        if task is None:
+            task = asyncio.ensure_future(cls.request(upstream, 'GET', url, params=params, headers=headers,
+                                                     timeout=timeout, retries=retries))
+            cls.pending[key] = task
+            task.add_done_callback(lambda t: cls.pending.pop(key, None))
+        # Shielding so one cancelled caller does not cancel the request for everyone else
+        return await asyncio.shield(task)
+
+    # Request with retries on network errors and 5xx answers; 4xx answers are returned to the caller
+    @classmethod
+    async def request(cls, upstream, method, url, timeout=None, retries=None, **kwargs):
+        breaker = cls.get_breaker(upstream)
+        retries = cls.retries if retries is None else retries
+        timeout = cls.timeout if timeout is None else aiohttp.ClientTimeout(total=timeout)
+        session = await cls.get_session()
+        for attempt in range(retries + 1):
+            if not breaker.allow():
+                raise CircuitOpenError(upstream + ': circuit open')
+            try:
+                with Metrics.upstream(upstream):
+                    async with session.request(method, url, timeout=timeout, **kwargs) as resp:
+                        reply = Reply(resp.status, dict(resp.headers), await resp.read())
+                    if reply.status >= 500 or reply.status == 429:
+                        raise UpstreamError(f'{upstream}: HTTP {reply.status}')
+            except asyncio.CancelledError:
+                breaker.probing = False
+                raise
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                breaker.failure()
+                if attempt == retries:
+                    raise
+                logger.debug('Ошибка запроса к %s (попытка %d): %r', upstream, attempt + 1, e)
+                await asyncio.sleep(cls.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+            else:
+                breaker.success()
+                return reply
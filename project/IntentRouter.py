@@ -0,0 +1,32 @@
+import numpy as np
+
+from rapidfuzz import fuzz, process, utils
+
+
+# Scoring a message against ALL INTENT templates in one call
+class IntentRouter:
+    def __init__(self, intents):
+        self.names = list(intents)
+        self.thresholds = np.array([intents[name][1] for name in self.names])
+        self.templates = []
+        self.offsets = []
+        for name in self.names:
+            self.offsets.append(len(self.templates))
+            self.templates.extend(intents[name][0])
+
+    def scores(self, messages):
+        matrix = process.cdist(messages, self.templates, scorer=fuzz.WRatio, processor=utils.default_process,
+                               dtype=np.float32, workers=1 if len(messages) < 64 else -1)
+        # Best template score per intent, rounded like fuzzywuzzy did
+        return np.rint(np.maximum.reduceat(matrix, self.offsets, axis=1))
+
+    # Best score among intents over their thresholds wins; on a tie the one listed first
+    def route_many(self, messages):
+        scores = self.scores(messages)
+        passed = scores >= self.thresholds
+        best = np.where(passed, scores, -1).argmax(axis=1)
+        return [(self.names[i] if passed[row, i] else None, dict(zip(self.names, scores[row].tolist())))
+                for row, i in enumerate(best)]
+
+    def route(self, message):
+        return self.route_many([message])[0]
@@ -0,0 +1,113 @@
+import logging
+import os
+import Metrics
+import re
+import sys
+import time
+
+from functools import lru_cache
+from Morph import get_morph
+
+logger = logging.getLogger('base')
+
+locations_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'locations.txt')
+token_re = re.compile(r'[\w-]+')
+
+
+@lru_cache(maxsize=100000)
+def get_lemma(word):
+    return get_morph().parse(word)[0].normal_form.replace('ё', 'е')
+
+
+# Index of known LOCATIONS: lemmatised name -> canonical name
+class Gazetteer:
+    def __init__(self, path=locations_file):
+        self.index = {}
+        with open(path, encoding='utf-8') as file:
+            for line in file:
+                if line.startswith('#') or not line.strip():
+                    continue
+                key, name = line.rstrip('\n').split('\t')
+                self.index[key.replace('ё', 'е')] = name
+        self.max_len = max(len(key.split()) for key in self.index)
+
+    def find(self, text):
+        words = [word.replace('ё', 'е') for word in token_re.findall(text.lower())]
+        lemmas = [get_lemma(word) for word in words]
+        for n in range(min(self.max_len, len(words)), 0, -1):
+            for i in range(len(words) - n + 1):
+                for tokens in (lemmas, words):
+                    name = self.index.get(' '.join(tokens[i:i + n]))
+                    if name is not None:
+                        return name
+        return None
+
+    # Rebuilding index file from a plain list of canonical names
+    @staticmethod
+    def build(names_path, path=locations_file):
+        with open(names_path, encoding='utf-8') as names, open(path, 'w', encoding='utf-8') as file:
+            file.write('# lemma<TAB>canonical name, used by Location.py before falling back to NER\n')
+            for name in names:
+                name = name.strip()
+                if name:
+                    key = ' '.join(get_lemma(word) for word in token_re.findall(name.lower()))
+                    file.write(key + '\t' + name + '\n')
+
+
+# Class for extracting LOCATION from user request: gazetteer first, NER as a fallback
+class Location:
+    gazetteer = None
+    ner = None
+    stats = {'gazetteer': [0, 0.0], 'ner': [0, 0.0], 'miss': [0, 0.0]}
+
+    @classmethod
+    def get_gazetteer(cls):
+        if cls.gazetteer is None:
+            cls.gazetteer = Gazetteer()
+        return cls.gazetteer
+
+    @classmethod
+    def get_ner(cls):
+        if cls.ner is None:
+            from natasha import Segmenter, NewsEmbedding, NewsNERTagger
+            cls.ner = (Segmenter(), NewsNERTagger(NewsEmbedding()))
+        return cls.ner
+
+    @classmethod
+    def find_ner(cls, msg):
+        from natasha import Doc
+        sgmnt, ner_tagger = cls.get_ner()
+        msg = msg.title()
+        doc = Doc(msg)
+        with Metrics.stage('ner'):
+            doc.segment(sgmnt)
+            doc.tag_ner(ner_tagger)
+        logger.debug('Итог таггера запроса: %s', doc.ner)
+        for span in doc.ner.spans:
+            if span.type == 'LOC':
+                return get_morph().parse(msg[span.start:span.stop])[0].normal_form.title()
+        return None
+
+    @classmethod
+    def extract(cls, msg):
+        start = time.perf_counter()
+        with Metrics.stage('gazetteer'):
+            loc = cls.get_gazetteer().find(msg)
+        path = 'gazetteer'
+        if loc is None:
+            loc = cls.find_ner(msg)
+            path = 'ner' if loc is not None else 'miss'
+        elapsed = time.perf_counter() - start
+        cls.stats[path][0] += 1
+        cls.stats[path][1] += elapsed
+        total = sum(count for count, _ in cls.stats.values())
+        logger.debug('Локация %s найдена через %s за %.2f мс (попаданий в справочник %.0f%%)',
+                     loc, path, elapsed * 1000, 100 * cls.stats['gazetteer'][0] / total)
+        return loc
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3 or sys.argv[1] != 'build':
+        print('usage: python Location.py build <names.txt>')
+    else:
+        Gazetteer.build(sys.argv[2])
@@ -0,0 +1,73 @@
+import os
+import time
+
+from contextlib import contextmanager, nullcontext
+
+# Switching METRICS off leaves only a flag check on the hot path
+enabled = False
+
+
+def setup():
+    global enabled, handler_seconds, upstream_seconds, stage_seconds, stage_calls, exposed
+    if enabled:
+        return
+    enabled = os.getenv('METRICS', '1') != '0'
+    if not enabled:
+        return
+    from prometheus_client import Counter, Gauge, Histogram
+    handler_seconds = Histogram('bot_handler_seconds', 'Latency of bot handlers', ['handler'])
+    upstream_seconds = Histogram('bot_upstream_seconds', 'Latency of upstream API calls', ['upstream', 'outcome'])
+    stage_seconds = Counter('bot_stage_seconds_total', 'Time spent in CPU-bound stages', ['stage'])
+    stage_calls = Counter('bot_stage_calls_total', 'Calls of CPU-bound stages', ['stage'])
+    exposed = Gauge('bot_state', 'Cache hits, buffer depths and other internal values', ['name'])
+
+
+@contextmanager
+def _upstream(name):
+    start = time.perf_counter()
+    outcome = 'error'
+    try:
+        yield
+        outcome = 'ok'
+    finally:
+        upstream_seconds.labels(name, outcome).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def _stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_seconds.labels(name).inc(time.perf_counter() - start)
+        stage_calls.labels(name).inc()
+
+
+def upstream(name):
+    return _upstream(name) if enabled else nullcontext()
+
+
+def stage(name):
+    return _stage(name) if enabled else nullcontext()
+
+
+# Internal value read at scrape time, so nothing is counted twice on the hot path
+def expose(name, getter):
+    if enabled:
+        exposed.labels(name).set_function(getter)
+
+
+def render():
+    from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+# Aiogram middleware measuring latency of every message handler
+class HandlerMetrics:
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data['handler'].callback.__name__ if 'handler' in data else 'unknown'
+            handler_seconds.labels(name).observe(time.perf_counter() - start)
@@ -0,0 +1,902 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from Benchmark import Upstreams, make_update, percentile
+
+# Component BENCHMARKS: every subcommand measures one part of the bot on its own
+parser = argparse.ArgumentParser(description='component benchmarks')
+commands = parser.add_subparsers(dest='command', required=True)
+project = os.path.dirname(os.path.abspath(__file__))
+workdir = None
+
+
+# Scratch directory as the working one, so snapshots, models and databases do not touch real data
+def enter_workdir(models=True):
+    global workdir
+    if workdir is None:
+        workdir = tempfile.mkdtemp(prefix='bot-microbench-')
+        for name in ('trained_model.joblib', 'model_artifact') if models else ():
+            if os.path.exists(os.path.join(project, name)):
+                os.symlink(os.path.join(project, name), os.path.join(workdir, name))
+        os.chdir(workdir)
+    sys.path.insert(0, project)
+    return workdir
+
+
+def load_bot():
+    os.environ.update({name: os.getenv(name, value) for name, value in (
+        ('TOKEN', '123456:BENCHMARK'), ('WAKEY', 'bench'), ('JOKEPID', 'bench'), ('JOKETOKEN', 'bench'),
+        ('METRICS', '0'))})
+    enter_workdir()
+    import Bot
+    return Bot
+
+
+def publish_rates(Bot):
+    values = {code: 10.0 + i for i, code in enumerate(Bot.cD.cur_list)}
+    Bot.CurrencyService.publish({code: Bot.Currency(code=code, name='Валюта ' + code, value=value)
+                                 for code, value in values.items()}, Bot.RateTable(values), time.time())
+
+
+# Replies are collected instead of being sent to Telegram
+def capture_replies(Bot):
+    replies = {}
+
+    async def send(chat_id, text, reply_markup=None, priority=1):
+        replies.setdefault(chat_id, []).append(text)
+
+    async def answer(message, text, reply_markup=None, priority=1):
+        await send(message.chat.id, text, reply_markup, priority)
+
+    Bot.outbox.send = send
+    Bot.outbox.answer = answer
+    Bot.outbox.deliver = send
+    return replies
+
+
+async def feed(Bot, chat_id, text, update_id=1):
+    update = Bot.types.Update.model_validate(make_update(update_id, chat_id, text), context={'bot': Bot.bot})
+    await Bot.dp.feed_update(Bot.bot, update)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def print_latencies(title, rows):
+    print(title)
+    print(f'{"вариант":<28}{"кол-во":>8}{"p50, мс":>10}{"p99, мс":>10}{"среднее, мс":>14}')
+    for name, values in rows:
+        print(f'{name:<28}{len(values):>8}{percentile(values, 50):>10.3f}{percentile(values, 99):>10.3f}'
+              f'{statistics.mean(values) * 1000:>14.3f}')
+
+
+# BUTTONS: currency button latency with the old loopback HTTP hop and with the shared in-process service
+async def bench_buttons(args):
+    import aiohttp
+    import uvicorn
+    Bot = load_bot()
+    publish_rates(Bot)
+    capture_replies(Bot)
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(Bot.fp, host='127.0.0.1', port=port, log_level='warning'))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    codes = list(Bot.cD.cur_list)
+    buttons = list(Bot.cD.cur_buttons)
+
+    # Before: every press opened a new session and asked our own FastAPI app over localhost
+    loopback = []
+    for i in range(args.presses):
+        start = time.perf_counter()
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f'http://127.0.0.1:{port}/{codes[i % len(codes)]}') as resp:
+                await resp.text()
+        loopback.append(time.perf_counter() - start)
+
+    direct = []
+    for i in range(args.presses):
+        start = time.perf_counter()
+        Bot.CurrencyService.render(codes[i % len(codes)])
+        direct.append(time.perf_counter() - start)
+
+    await feed(Bot, 1, 'валюты')
+    pressed = []
+    for i in range(args.presses):
+        start = time.perf_counter()
+        await feed(Bot, 1, buttons[i % len(buttons)], i + 2)
+        pressed.append(time.perf_counter() - start)
+
+    server.should_exit = True
+    await serving
+    print_latencies('Нажатие кнопки валюты:', [('до: запрос к своему API', loopback),
+                                                ('после: CurrencyService', direct),
+                                                ('после: весь обработчик', pressed)])
+
+
+buttons = commands.add_parser('buttons', help='currency button latency before and after CurrencyService')
+buttons.add_argument("--presses", type=int, default=2000)
+buttons.set_defaults(run=bench_buttons)
+
+
+# CHATS: thousands of chats walking the menus at once, every chat must see only its own replies
+async def bench_chats(args):
+    Bot = load_bot()
+    publish_rates(Bot)
+    replies = capture_replies(Bot)
+    buttons = list(Bot.cD.cur_buttons)
+    script = ['/start', 'валюты'] + buttons[:args.presses] + ['Назад']
+    latencies = []
+
+    async def chat(chat_id):
+        for i, text in enumerate(script):
+            start = time.perf_counter()
+            await feed(Bot, chat_id, text, chat_id * len(script) + i)
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(chat(chat_id) for chat_id in range(1, args.chats + 1)))
+    elapsed = time.perf_counter() - start
+    expected = [Bot.CurrencyService.render(Bot.cD.cur_buttons[button]) for button in buttons[:args.presses]]
+    mixed = sum(replies.get(chat_id, [])[2:-1] != expected for chat_id in range(1, args.chats + 1))
+    print(f'Чатов: {args.chats}, обновлений: {len(latencies)}, {len(latencies) / elapsed:.0f} обновлений/с')
+    print(f'Состояний в хранилище: {len(getattr(Bot.dp.storage, "records", ()))}, чатов с чужими ответами: {mixed}')
+    print_latencies('Обработка обновления:', [('все чаты одновременно', latencies)])
+
+
+chats = commands.add_parser('chats', help='many concurrent chats walking the menus with per-chat state')
+chats.add_argument("--chats", type=int, default=5000)
+chats.add_argument("--presses", type=int, default=3)
+chats.set_defaults(run=bench_chats)
+
+
+# Synthetic complaints in the style of the training dataset, reproducible for a given seed
+complaint_topics = {
+    'Сантехника': ['течет кран', 'прорвало трубу', 'нет горячей воды', 'засор канализации', 'капает батарея'],
+    'Электрика': ['не горит свет', 'искрит розетка', 'выбивает автомат', 'перегорела лампа', 'нет электричества'],
+    'Уборка': ['грязно в подъезде', 'не вывозят мусор', 'не убран снег', 'разбросан мусор', 'грязные окна'],
+    'Лифт': ['не работает лифт', 'застрял лифт', 'лифт скрипит', 'сломана кнопка лифта', 'лифт не закрывается'],
+}
+complaint_places = ['в подъезде', 'на кухне', 'в ванной', 'на третьем этаже', 'во дворе', 'у входа', 'в подвале']
+complaint_tails = ['уже третий день', 'с самого утра', 'после ремонта', 'просим срочно исправить',
+                   'жильцы недовольны', 'второй раз за месяц', '!!!', 'кв. 42']
+
+
+def synthetic_complaints(count, seed=0):
+    rnd = random.Random(seed)
+    labels = list(complaint_topics)
+    for i in range(count):
+        label = labels[i % len(labels)]
+        words = [rnd.choice(complaint_topics[label]), rnd.choice(complaint_places)]
+        words += rnd.sample(complaint_tails, rnd.randint(0, 3))
+        rnd.shuffle(words)
+        yield ' '.join(words).capitalize(), label
+
+
+# NORMALIZER: tokens per second for single texts and batches, with a cold and a warm lemma cache
+def bench_normalizer(args):
+    sys.path.insert(0, project)
+    from Classification import Normalizer
+    texts = [text for text, _ in synthetic_complaints(args.texts)]
+    tokens = sum(len(text.split()) for text in texts)
+    rows = []
+
+    def measure(name, normalizer, run):
+        start = time.perf_counter()
+        run(normalizer)
+        elapsed = time.perf_counter() - start
+        info = normalizer.lemma.cache_info()
+        rows.append((name, elapsed, info.hits / max(1, info.hits + info.misses)))
+
+    def single(normalizer):
+        for text in texts:
+            normalizer.normalize(text)
+
+    def batch(normalizer):
+        for _ in normalizer.normalize_many(texts):
+            pass
+
+    normalizer = Normalizer()
+    measure('по одному, холодный кэш', normalizer, single)
+    measure('по одному, теплый кэш', normalizer, single)
+    measure('пакетом, холодный кэш', Normalizer(), batch)
+    measure('пакетом, теплый кэш', normalizer, batch)
+    if args.jobs > 1:
+        measure(f'пакетом, {args.jobs} процессов', Normalizer(),
+                lambda normalizer: list(normalizer.normalize_many(texts, workers=args.jobs)))
+    print(f'Текстов: {len(texts)}, токенов: {tokens}')
+    print(f'{"вариант":<28}{"время, с":>10}{"токенов/с":>12}{"попаданий в кэш":>18}')
+    for name, elapsed, hit_rate in rows:
+        print(f'{name:<28}{elapsed:>10.3f}{tokens / elapsed:>12.0f}{hit_rate:>18.1%}')
+
+
+normalize = commands.add_parser('normalizer', help='text normaliser throughput, single vs batch, cold vs warm cache')
+normalize.add_argument("--texts", type=int, default=20000)
+normalize.add_argument("--jobs", type=int, default=0, help="also run the batch through a pool of this many processes")
+normalize.set_defaults(run=bench_normalizer)
+
+
+# Child side of the startup benchmark: import the bot and handle the first update, timings go to stdout
+def startup_child():
+    start = time.perf_counter()
+    Bot = load_bot()
+    imported = time.perf_counter()
+    capture_replies(Bot)
+    asyncio.run(feed(Bot, 1, '/start'))
+    handled = time.perf_counter()
+    print(json.dumps({'import': imported - start, 'first_update': handled - start}))
+
+
+# STARTUP: -X importtime breakdown by top-level package and wall clock to the first handled update
+def bench_startup(args):
+    if args.child:
+        return startup_child()
+    command = [sys.executable, os.path.abspath(__file__), 'startup', '--child']
+    runs = []
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        out = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+        timings = json.loads(out.strip().splitlines()[-1])
+        timings['process'] = time.perf_counter() - start
+        runs.append(timings)
+    print(f'Холодный старт, запусков: {args.runs}')
+    print(f'{"этап":<36}{"мин, с":>10}{"медиана, с":>12}')
+    for name, title in (('import', 'импорт Bot'), ('first_update', 'первое обработанное обновление'),
+                        ('process', 'процесс целиком')):
+        values = [timings[name] for timings in runs]
+        print(f'{title:<36}{min(values):>10.3f}{statistics.median(values):>12.3f}')
+
+    stderr = subprocess.run([sys.executable, '-X', 'importtime'] + command[1:], capture_output=True, text=True,
+                            check=True).stderr
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        package = name.strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + int(self_us)
+    print(f'\nИмпорт по пакетам (-X importtime), первые {args.top}:')
+    print(f'{"пакет":<28}{"мс":>10}')
+    for package, total in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f'{package:<28}{total / 1000:>10.1f}')
+    print(f'{"всего":<28}{sum(packages.values()) / 1000:>10.1f}')
+
+
+startup = commands.add_parser('startup', help='import time breakdown and time to the first handled update')
+startup.add_argument("--runs", type=int, default=5)
+startup.add_argument("--top", type=int, default=20)
+startup.add_argument("--child", action='store_true', help=argparse.SUPPRESS)
+startup.set_defaults(run=bench_startup)
+
+
+# Weather questions the way users write them: known cities, places only NER knows, and no place at all
+weather_templates = ['Какая погода в {}?', 'погода в {} сегодня', 'Что там с погодой в {}', 'сколько градусов в {}',
+                     'Скажи пожалуйста погоду в {}', 'в {} сейчас холодно?', 'Будет ли дождь в {} завтра']
+unknown_places = ['Лиссабоне', 'Бангкоке', 'Рейкьявике', 'Сыктывкаре', 'Монтевидео', 'Ханое']
+placeless_questions = ['Какая погода?', 'будет ли дождь завтра', 'на улице холодно?', 'нужен ли зонт',
+                       'Какая сейчас погода на улице']
+
+
+def weather_corpus(count, seed=0):
+    from Location import Location
+    from Morph import get_morph
+    rnd = random.Random(seed)
+    cities = []
+    for name in sorted(set(Location.get_gazetteer().index.values())):
+        form = get_morph().parse(name)[0].inflect({'loct'}) if ' ' not in name else None
+        cities.append(form.word.capitalize() if form is not None else name)
+    corpus = []
+    for _ in range(count):
+        kind = rnd.random()
+        if kind < 0.8:
+            corpus.append(rnd.choice(weather_templates).format(rnd.choice(cities)))
+        elif kind < 0.9:
+            corpus.append(rnd.choice(weather_templates).format(rnd.choice(unknown_places)))
+        else:
+            corpus.append(rnd.choice(placeless_questions))
+    return corpus
+
+
+# LOCATION: gazetteer fast path against NER on every message, latency per path and gazetteer hit rate
+def bench_location(args):
+    sys.path.insert(0, project)
+    from Location import Location
+    corpus = weather_corpus(args.questions)
+    Location.get_ner()
+    Location.extract(corpus[0])
+
+    ner_only = []
+    for msg in corpus:
+        start = time.perf_counter()
+        Location.find_ner(msg)
+        ner_only.append(time.perf_counter() - start)
+
+    for counters in Location.stats.values():
+        counters[:] = [0, 0.0]
+    paths = {}
+    for msg in corpus:
+        before = {path: counters[0] for path, counters in Location.stats.items()}
+        start = time.perf_counter()
+        Location.extract(msg)
+        elapsed = time.perf_counter() - start
+        path = next(path for path, counters in Location.stats.items() if counters[0] != before[path])
+        paths.setdefault(path, []).append(elapsed)
+
+    print(f'Вопросов: {len(corpus)}, попаданий в справочник: '
+          f'{len(paths.get("gazetteer", ())) / len(corpus):.1%}')
+    print_latencies('Поиск локации:', [('до: только NER', ner_only),
+                                       ('после: все вопросы', [value for values in paths.values()
+                                                               for value in values])]
+                    + [('после: ' + path, values) for path, values in paths.items()])
+
+
+location = commands.add_parser('location', help='location extraction latency per path over a question corpus')
+location.add_argument("--questions", type=int, default=5000)
+location.set_defaults(run=bench_location)
+
+
+# Old intent matching: extractOne over each template list in turn, fuzzywuzzy if it is still installed
+def sequential_router(intents):
+    try:
+        from fuzzywuzzy import process
+        scan = process.extractOne
+    except ImportError:
+        from rapidfuzz import fuzz, process, utils
+
+        def scan(message, templates):
+            return process.extractOne(message, templates, scorer=fuzz.WRatio, processor=utils.default_process)
+
+    def route(message):
+        for name, (templates, threshold) in intents.items():
+            if round(scan(message, templates)[1]) >= threshold:
+                return name
+        return None
+    return route
+
+
+# INTENTS: messages per second of the old sequential scans and of the single-call IntentRouter
+def bench_intents(args):
+    sys.path.insert(0, project)
+    from ConstantData import ConstDat
+    from IntentRouter import IntentRouter
+    rnd = random.Random(0)
+    phrasings = [template for templates, _ in ConstDat.intents.values() for template in templates]
+    phrasings += weather_templates + placeless_questions + [text for text, _ in synthetic_complaints(20)]
+    messages = [rnd.choice(phrasings).replace('{}', rnd.choice(unknown_places)) for _ in range(args.messages)]
+    old = sequential_router(ConstDat.intents)
+    router = IntentRouter(ConstDat.intents)
+    router.route(messages[0])
+    rows = []
+
+    def measure(name, run):
+        start = time.perf_counter()
+        routed = run()
+        rows.append((name, time.perf_counter() - start))
+        return routed
+
+    expected = measure('до: extractOne по спискам', lambda: [old(message) for message in messages])
+    single = measure('после: route по одному', lambda: [router.route(message)[0] for message in messages])
+    batch = measure(f'после: route_many по {args.batch}', lambda: [
+        intent for i in range(0, len(messages), args.batch)
+        for intent, _ in router.route_many(messages[i:i + args.batch])])
+    print(f'Сообщений: {len(messages)}, расхождений с прежним алгоритмом: '
+          f'{sum(a != b for a, b in zip(expected, single))} / {sum(a != b for a, b in zip(expected, batch))}')
+    print(f'{"вариант":<32}{"время, с":>10}{"сообщений/с":>14}')
+    for name, elapsed in rows:
+        print(f'{name:<32}{elapsed:>10.3f}{len(messages) / elapsed:>14.0f}')
+
+
+intents = commands.add_parser('intents', help='intent routing throughput against the old sequential scans')
+intents.add_argument("--messages", type=int, default=20000)
+intents.add_argument("--batch", type=int, default=256)
+intents.set_defaults(run=bench_intents)
+
+
+def write_dataset(path, rows):
+    import csv
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['Текст инцидента', 'Тема'])
+        writer.writerows(rows)
+
+
+# TRAINING: full fit with cold and warm lemma cache, then incremental updates with a few percent of new rows
+def bench_training(args):
+    enter_workdir(models=False)
+    import Training
+    rows = list(synthetic_complaints(args.rows))
+    # Numbered tails make every text unique, like real incident reports
+    rows = [(f'{text} (обращение {i})', label) for i, (text, label) in enumerate(rows)]
+    if args.save:
+        write_dataset(args.save, rows)
+    dataset = os.path.join(workdir, 'train_dataset.csv')
+    added = max(1, args.rows * args.added // 100)
+    extra = [(f'{text} (обращение {args.rows + i})', label) for i, (text, label) in
+             enumerate(synthetic_complaints(added, seed=1))]
+    runs = []
+
+    def measure(name, incremental, data):
+        write_dataset(dataset, data)
+        start = time.perf_counter()
+        Training.teach(dataset, incremental, args.jobs)
+        runs.append((name, len(data), time.perf_counter() - start))
+
+    measure('полное, холодный кэш', False, rows)
+    measure('полное, теплый кэш', False, rows)
+    os.remove(Training.model_file)
+    measure('дообучение, новая модель', True, rows)
+    measure(f'дообучение, +{args.added}% строк', True, rows + extra)
+    measure('дообучение без изменений', True, rows + extra)
+    print(f'{"вариант":<32}{"строк":>8}{"время, с":>10}')
+    for name, count, elapsed in runs:
+        print(f'{name:<32}{count:>8}{elapsed:>10.2f}')
+
+
+training = commands.add_parser('training', help='training time on a synthetic dataset, full and incremental')
+training.add_argument("--rows", type=int, default=50000)
+training.add_argument("--added", type=int, default=5, help="percent of new rows for the incremental update")
+training.add_argument("--jobs", type=int, default=os.cpu_count(), help="processes for lemmatisation")
+training.add_argument("--save", help="also write the generated dataset to this csv file")
+training.set_defaults(run=bench_training)
+
+
+def memory_kb(pid):
+    values = {}
+    with open(f'/proc/{pid}/smaps_rollup') as file:
+        for line in file:
+            name, _, rest = line.partition(':')
+            if name in ('Rss', 'Pss'):
+                values[name] = int(rest.split()[0])
+    return values
+
+
+# Child side of the RSS benchmark: load the model one way, touch all of it with predictions and wait
+def rss_child(args):
+    os.chdir(args.dir)
+    sys.path.insert(0, project)
+    import numpy as np
+    if args.source == 'artifact':
+        from Artifact import MappedModel
+        model = MappedModel()
+    elif args.source == 'joblib':
+        from joblib import load
+        from Classification import model_file
+        model = load(model_file)
+    else:
+        model = None
+    if model is not None:
+        texts = [text for text, _ in synthetic_complaints(1000, seed=2)]
+        np.asarray(model.predict_proba(texts)).sum()
+    print('ready', flush=True)
+    sys.stdin.read()
+
+
+# RSS: memory of 1 and N worker processes holding the model as a joblib copy and as a shared mmap artifact
+def bench_rss(args):
+    if args.child:
+        return rss_child(args)
+    enter_workdir(models=False)
+    from joblib import dump
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+    from Artifact import export
+    from Classification import model_file
+    # Unique words per text give a vocabulary, and so a coefficient matrix, of a realistic size
+    rows = [(f'{text} слово{i} метка{i % 997}', label)
+            for i, (text, label) in enumerate(synthetic_complaints(args.rows))]
+    model = Pipeline([('vec', CountVectorizer()), ('tfdf', TfidfTransformer()), ('lr', LogisticRegression())])
+    model.fit([text for text, _ in rows], [label for _, label in rows])
+    dump(model, model_file)
+    export(model)
+    print(f'Словарь модели: {len(model.named_steps["vec"].vocabulary_)} слов, '
+          f'joblib: {os.path.getsize(model_file) / 2 ** 20:.1f} МБ')
+
+    def start(source, count):
+        command = [sys.executable, os.path.abspath(__file__), 'rss', '--child', '--source', source, '--dir', workdir]
+        children = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                    for _ in range(count)]
+        for child in children:
+            child.stdout.readline()
+        usage = [memory_kb(child.pid) for child in children]
+        for child in children:
+            child.stdin.close()
+            child.wait()
+        return usage
+
+    base = start('none', 1)[0]
+    print(f'{"модель":<10}{"процессов":>10}{"RSS всего, МБ":>16}{"PSS всего, МБ":>16}{"PSS на модель, МБ":>20}')
+    for source in ('joblib', 'artifact'):
+        for count in (1, args.processes):
+            usage = start(source, count)
+            rss = sum(item['Rss'] for item in usage) / 1024
+            pss = sum(item['Pss'] for item in usage) / 1024
+            print(f'{source:<10}{count:>10}{rss:>16.1f}{pss:>16.1f}{(pss - count * base["Pss"] / 1024) / count:>20.1f}')
+
+
+rss = commands.add_parser('rss', help='memory of 1 and N workers with a joblib model and with the mmap artifact')
+rss.add_argument("--rows", type=int, default=200000)
+rss.add_argument("--processes", type=int, default=4)
+rss.add_argument("--child", action='store_true', help=argparse.SUPPRESS)
+rss.add_argument("--source", choices=['none', 'joblib', 'artifact'], default='none', help=argparse.SUPPRESS)
+rss.add_argument("--dir", help=argparse.SUPPRESS)
+rss.set_defaults(run=bench_rss)
+
+
+# Local throwaway redis-server for the menu state of several workers, if one is installed
+def start_redis():
+    binary = shutil.which('redis-server')
+    if binary is None:
+        return None, None
+    port = free_port()
+    server = subprocess.Popen([binary, '--port', str(port), '--save', '', '--appendonly', 'no'],
+                              stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return server, f'redis://127.0.0.1:{port}/0'
+        except OSError:
+            time.sleep(0.05)
+    server.terminate()
+    server.wait()
+    return None, None
+
+
+# WEBHOOK: updates posted to /webhook of a real uvicorn server with 1, 2, 4... worker processes
+async def bench_webhook(args):
+    import aiohttp
+    upstreams = Upstreams(args.delay)
+    runner, base = await upstreams.start()
+    enter_workdir()
+    secret = 'benchmark-secret'
+    texts = ['/start', 'валюты', 'Назад', 'привет', 'Другой вопрос', 'Назад']
+    rows = []
+    redis_server, redis_url = None, args.redis_url or os.getenv('REDIS_URL')
+    if not redis_url and max(args.counts) > 1:
+        redis_server, redis_url = start_redis()
+    try:
+        async with aiohttp.ClientSession() as session:
+            for count in args.counts:
+                # Without shared state every worker keeps its own menus: a setup the bot refuses to run
+                if count > 1 and not redis_url:
+                    rows.append((count, None))
+                    continue
+                port = free_port()
+                url = f'http://127.0.0.1:{port}'
+                env = dict(os.environ, TOKEN='123456:BENCHMARK', WAKEY='bench', JOKEPID='bench', JOKETOKEN='bench',
+                           METRICS='0', BOT_MODE='webhook', BOT_WORKERS=str(count), WEBHOOK_URL=url,
+                           WEBHOOK_SECRET=secret, TELEGRAM_API=base + '/telegram',
+                           CBR_URL=base + '/cbr/daily_json.js', OWM_URL=base + '/owm/weather',
+                           JOKE_URL=base + '/joke/api')
+                env.pop('REDIS_URL', None)
+                if redis_url:
+                    env['REDIS_URL'] = redis_url
+                # Straight to uvicorn, so the benchmark picks the host and the port itself
+                server = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'Bot:fp', '--app-dir', project,
+                                           '--host', '127.0.0.1', '--port', str(port), '--workers', str(count),
+                                           '--log-level', 'warning'], env=env)
+                try:
+                    rows.append((count, await post_updates(session, url, secret, texts, args)))
+                finally:
+                    server.terminate()
+                    server.wait()
+    finally:
+        await runner.cleanup()
+        if redis_server is not None:
+            redis_server.terminate()
+            redis_server.wait()
+    print(f'Обновлений на запуск: {args.updates}, одновременно: {args.concurrency}, '
+          f'состояние чатов: {redis_url or "в памяти процесса"}')
+    print(f'{"процессов":<10}{"обновлений/с":>14}{"p50, мс":>10}{"p99, мс":>10}{"ошибок":>8}')
+    for count, result in rows:
+        if result is None:
+            print(f'{count:<10}  не измерено: нет redis-server и --redis-url, без общего состояния бот не запускается')
+            continue
+        rate, latencies, errors = result
+        print(f'{count:<10}{rate:>14.0f}{percentile(latencies, 50):>10.2f}{percentile(latencies, 99):>10.2f}'
+              f'{errors:>8}')
+
+
+async def post_updates(session, url, secret, texts, args):
+    import aiohttp
+    deadline = time.monotonic() + 60
+    while True:
+        try:
+            async with session.get(url + '/') as resp:
+                if resp.status == 200:
+                    break
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError('Сервер бота не запустился за 60 с')
+        await asyncio.sleep(0.2)
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret}
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def post(i):
+        nonlocal errors
+        update = make_update(i + 1, 1 + i % args.chats, texts[i % len(texts)])
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                async with session.post(url + '/webhook', json=update, headers=headers) as resp:
+                    await resp.read()
+                    ok = resp.status == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                ok = False
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    await asyncio.gather(*(post(i) for i in range(args.warmup)))
+    latencies.clear()
+    errors = 0
+    start = time.perf_counter()
+    await asyncio.gather(*(post(args.warmup + i) for i in range(args.updates)))
+    return len(latencies) / (time.perf_counter() - start), latencies, errors
+
+
+webhook = commands.add_parser('webhook', help='updates/sec and latency of /webhook for several worker counts')
+webhook.add_argument("--counts", type=lambda value: [int(n) for n in value.split(',')], default=[1, 2, 4],
+                     help="comma separated worker counts")
+webhook.add_argument("--updates", type=int, default=5000)
+webhook.add_argument("--warmup", type=int, default=200)
+webhook.add_argument("--concurrency", type=int, default=64)
+webhook.add_argument("--chats", type=int, default=2000)
+webhook.add_argument("--delay", type=float, default=0.0, help="latency of the stubbed Telegram API, seconds")
+webhook.add_argument("--redis-url", help="shared state for several workers; default REDIS_URL or a local redis-server")
+webhook.set_defaults(run=bench_webhook)
+
+
+# OUTBOX: achieved send rate against the configured flood limits, for many quiet chats and a few busy ones
+async def bench_outbox(args):
+    sys.path.insert(0, project)
+    from SendQueue import Outbox
+
+    class TelegramStub:
+        def __init__(self):
+            self.sent = {}
+
+        async def send_message(self, chat_id, text, reply_markup=None):
+            await asyncio.sleep(args.delay)
+            self.sent.setdefault(chat_id, []).append((time.monotonic(), float(text)))
+
+    print(f'Лимиты: {args.rate} сообщений/с всего, {args.chat_rate} в секунду на чат (запас {args.chat_burst})')
+    print(f'{"нагрузка":<24}{"сообщений":>10}{"устойчиво/с":>14}{"от лимита":>11}{"макс. в чат/с":>15}'
+          f'{"ожидание p50, мс":>18}{"p99, мс":>10}')
+    for name, chats in (('много чатов', args.messages), ('10 активных чатов', 10)):
+        stub = TelegramStub()
+        outbox = Outbox(stub, rate=args.rate, chat_rate=args.chat_rate, chat_burst=args.chat_burst)
+        tasks = outbox.start()
+        start = time.monotonic()
+        # Offered load: twice the global limit for the whole run
+        for i in range(args.messages):
+            await outbox.send(i % chats, str(time.monotonic()))
+            await asyncio.sleep(max(0.0, start + i / (2 * args.rate) - time.monotonic()))
+        while outbox.depth():
+            await asyncio.sleep(0.01)
+        for task in tasks:
+            task.cancel()
+        sends = sorted(sent for chat in stub.sent.values() for sent, _ in chat)
+        waits = [sent - queued for chat in stub.sent.values() for sent, queued in chat]
+        # Steady rates: the first second and each chat's initial burst are spent from full buckets
+        rate = sum(sent >= start + 1 for sent in sends) / max(sends[-1] - start - 1, 1e-9)
+        per_chat = max([(len(chat) - args.chat_burst) / (chat[-1][0] - chat[0][0])
+                        for chat in stub.sent.values() if len(chat) > args.chat_burst] or [0.0])
+        print(f'{name:<24}{outbox.metrics["sent"]:>10}{rate:>14.1f}{rate / args.rate:>11.0%}{per_chat:>15.2f}'
+              f'{percentile(waits, 50):>18.1f}{percentile(waits, 99):>10.1f}')
+
+
+outbox = commands.add_parser('outbox', help='outbox throughput close to the configured Telegram flood limits')
+outbox.add_argument("--messages", type=int, default=300)
+outbox.add_argument("--rate", type=float, default=30)
+outbox.add_argument("--chat-rate", type=float, default=1)
+outbox.add_argument("--chat-burst", type=float, default=3)
+outbox.add_argument("--delay", type=float, default=0.02, help="latency of the stubbed sendMessage, seconds")
+outbox.set_defaults(run=bench_outbox)
+
+
+# Daily CBR documents for the given days: every currency walks randomly from its own starting rate
+def synthetic_cbr_days(days, codes=40, seed=0):
+    from datetime import date, timedelta
+    rnd = random.Random(seed)
+    rates = {f'C{i:02d}': rnd.uniform(1, 100) for i in range(codes)}
+    first = date.today() - timedelta(days=days - 1)
+    for i in range(days):
+        day = first + timedelta(days=i)
+        for code in rates:
+            rates[code] *= 1 + rnd.gauss(0, 0.005)
+        yield {'Date': f'{day:%Y-%m-%d}T11:30:00+03:00',
+               'Valute': {code: {'Value': value, 'Nominal': 1} for code, value in rates.items()}}
+
+
+# HISTORY: backfill, daily appends and range or summary queries over years of daily rates
+def bench_history(args):
+    enter_workdir(models=False)
+    from RateHistory import RateHistory
+    days = args.years * 365
+    documents = list(synthetic_cbr_days(days, args.codes))
+    history = RateHistory(os.path.join(workdir, 'rate_history'))
+
+    start = time.perf_counter()
+    history.merge(documents[:days - args.appends])
+    merged = time.perf_counter() - start
+    appends = []
+    for data in documents[days - args.appends:]:
+        start = time.perf_counter()
+        history.append(data)
+        appends.append(time.perf_counter() - start)
+    size = sum(os.path.getsize(os.path.join(history.path, name)) for name in os.listdir(history.path))
+    print(f'Лет: {args.years}, валют: {args.codes}, документов: {days}, '
+          f'загрузка архива: {merged:.2f} с, на диске: {size / 2 ** 20:.1f} МБ')
+
+    rnd = random.Random(1)
+    codes = [f'C{i:02d}' for i in range(args.codes)]
+    rows = [('добавление дня', appends)]
+    for window in sorted({7, 30, 365, days}):
+        values = []
+        for _ in range(args.queries):
+            start = time.perf_counter()
+            history.summary(rnd.choice(codes), window)
+            values.append(time.perf_counter() - start)
+        rows.append((f'сводка за {window} дн.', values))
+    now = time.time()
+    values = []
+    for _ in range(args.queries):
+        lo = now - rnd.uniform(0, days) * 24 * 60 * 60
+        start = time.perf_counter()
+        history.range(rnd.choice(codes), lo, lo + 90 * 24 * 60 * 60)
+        values.append(time.perf_counter() - start)
+    rows.append(('диапазон 90 дн.', values))
+    print_latencies('Запросы к истории курсов:', rows)
+
+
+history = commands.add_parser('history', help='rate history backfill, appends and queries over years of daily data')
+history.add_argument("--years", type=int, default=20)
+history.add_argument("--codes", type=int, default=40)
+history.add_argument("--appends", type=int, default=30)
+history.add_argument("--queries", type=int, default=2000)
+history.set_defaults(run=bench_history)
+
+
+# COMPLAINTS: durable submit rate and end-to-end throughput of the intake, with a stand-in classifier
+async def bench_complaints(args):
+    enter_workdir(models=False)
+    import Complaints
+    from Complaints import ComplaintIntake, ComplaintStore
+    if not args.lemmatise:
+        Complaints.prepare = lambda text: ' '.join(text.lower().split())
+
+    class Classifier:
+        async def classify(self, text):
+            await asyncio.sleep(args.delay)
+            return 'Сантехника', 1.0
+
+    forwarded = []
+
+    async def forward(complaint_id, chat_id, text, label):
+        forwarded.append(time.perf_counter())
+
+    texts = [f'{text} (кв. {i})' for i, (text, _) in enumerate(synthetic_complaints(args.complaints))]
+    intake = ComplaintIntake(Classifier(), forward, workers=args.consumers)
+    intake.store = ComplaintStore(os.path.join(workdir, 'complaints.sqlite3'))
+    tasks = intake.start()
+    submits = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def submit(i):
+        async with semaphore:
+            begin = time.perf_counter()
+            await intake.submit(i, texts[i])
+            submits.append(time.perf_counter() - begin)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(submit(i) for i in range(len(texts))))
+    submitted = time.perf_counter() - start
+    while len(forwarded) < len(texts):
+        await asyncio.sleep(0.01)
+    processed = forwarded[-1] - start
+    for task in tasks:
+        task.cancel()
+    print(f'Заявок: {len(texts)}, обработчиков: {args.consumers}, классификация: {args.delay * 1000:.0f} мс')
+    print(f'Прием: {len(texts) / submitted:.0f} заявок/с, до пересылки: {len(texts) / processed:.0f} заявок/с')
+    print_latencies('Сохранение заявки:', [('submit', submits)])
+
+
+complaints = commands.add_parser('complaints', help='complaint intake throughput with a durable SQLite store')
+complaints.add_argument("--complaints", type=int, default=5000)
+complaints.add_argument("--concurrency", type=int, default=64)
+complaints.add_argument("--consumers", type=int, default=4)
+complaints.add_argument("--delay", type=float, default=0.005, help="time of one classification, seconds")
+complaints.add_argument("--lemmatise", action='store_true', help="normalise texts with the real lemmatiser")
+complaints.set_defaults(run=bench_complaints)
+
+
+# CLASSIFY: requests/sec and latency of the micro-batching classifier for several batch sizes and delays
+async def bench_classify(args):
+    enter_workdir(models=False)
+    import Classification
+    from Classification import BatchClassifier
+    from joblib import dump
+    from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.pipeline import Pipeline
+    from types import SimpleNamespace
+    if not args.lemmatise:
+        Classification.normalizer = SimpleNamespace(normalize=lambda text: ' '.join(text.lower().split()))
+    texts, labels = zip(*synthetic_complaints(2000, seed=1))
+    model = Pipeline([('vec', CountVectorizer()), ('tfdf', TfidfTransformer()), ('lr', LogisticRegression())])
+    model.fit([Classification.prepare(text) for text in texts], labels)
+    Classification.model_file = os.path.join(workdir, 'trained_model.joblib')
+    dump(model, Classification.model_file)
+    Classification.model = None
+    requests = [text for text, _ in synthetic_complaints(args.requests)]
+    rows = []
+    summary = []
+    for max_batch in [int(size) for size in args.batches.split(',')]:
+        for max_delay in [float(delay) / 1000 for delay in args.delays.split(',')]:
+            classifier = BatchClassifier(max_batch=max_batch, max_delay=max_delay)
+            await classifier.classify(requests[0])
+            semaphore = asyncio.Semaphore(args.concurrency)
+            latencies = []
+
+            async def classify(text):
+                async with semaphore:
+                    begin = time.perf_counter()
+                    await classifier.classify(text)
+                    latencies.append(time.perf_counter() - begin)
+
+            start = time.perf_counter()
+            await asyncio.gather(*(classify(text) for text in requests))
+            elapsed = time.perf_counter() - start
+            classifier.task.cancel()
+            await asyncio.gather(classifier.task, return_exceptions=True)
+            name = f'batch {max_batch}, {max_delay * 1000:g} мс'
+            rows.append((name, latencies))
+            summary.append((name, len(requests) / elapsed))
+    print(f'Запросов: {len(requests)}, одновременно: {args.concurrency}')
+    print(f'{"вариант":<24}{"запросов/с":>12}')
+    for name, rate in summary:
+        print(f'{name:<24}{rate:>12.0f}')
+    print_latencies('Задержка классификации:', rows)
+
+
+classify = commands.add_parser('classify', help='micro-batching classifier throughput and latency per batch setting')
+classify.add_argument("--requests", type=int, default=5000)
+classify.add_argument("--concurrency", type=int, default=256)
+classify.add_argument("--batches", default='1,8,32,64,128', help="comma separated max_batch values")
+classify.add_argument("--delays", default='1,5,20', help="comma separated max_delay values, milliseconds")
+classify.add_argument("--lemmatise", action='store_true', help="normalise texts with the real lemmatiser")
+classify.set_defaults(run=bench_classify)
+
+
+def main():
+    args = parser.parse_args()
+    try:
+        result = args.run(args)
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+    finally:
+        if workdir is not None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,12 @@
+import pymorphy3
+
+
+# Single MORPH ANALYZER shared by the bot and the classifier
+morph = None
+
+
+def get_morph():
+    global morph
+    if morph is None:
+        morph = pymorphy3.MorphAnalyzer()
+    return morph
@@ -0,0 +1,133 @@
+import argparse
+import asyncio
+import os
+import aiohttp
+import numpy as np
+
+from datetime import date, datetime, timedelta
+
+history_dir = os.path.join(os.getcwd(), 'rate_history')
+archive_url = 'https://www.cbr-xml-daily.ru/archive/{:%Y/%m/%d}/daily_json.js'
+
+
+# Append-only store of exchange rates: per currency float64 columns of timestamps and values
+class RateHistory:
+    def __init__(self, path=history_dir):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+
+    def column(self, code, name):
+        return os.path.join(self.path, code + '.' + name)
+
+    def sizes(self, code):
+        return [os.path.getsize(path) if os.path.exists(path) else 0
+                for path in (self.column(code, 'ts'), self.column(code, 'val'))]
+
+    def read(self, code):
+        columns = []
+        for name, size in zip(('ts', 'val'), self.sizes(code)):
+            count = size // 8
+            columns.append(np.memmap(self.column(code, name), dtype=np.float64, mode='r', shape=(count,))
+                           if count else np.empty(0))
+        # Values may be one write ahead of timestamps if a reader races an append
+        n = min(len(columns[0]), len(columns[1]))
+        return columns[0][:n], columns[1][:n]
+
+    # Cutting what a failed append left in one column only, so the next pair is written in step
+    def repair(self, code):
+        sizes = self.sizes(code)
+        common = min(sizes) // 8 * 8
+        for name, size in zip(('ts', 'val'), sizes):
+            if size != common:
+                os.truncate(self.column(code, name), common)
+
+    @staticmethod
+    def parse(data):
+        ts = datetime.fromisoformat(data['Date']).timestamp()
+        return ts, {code: cur['Value'] / cur['Nominal'] for code, cur in data['Valute'].items()}
+
+    def append(self, data):
+        ts, rates = self.parse(data)
+        for code, value in rates.items():
+            self.repair(code)
+            known, _ = self.read(code)
+            if len(known) and known[-1] >= ts:
+                continue
+            with open(self.column(code, 'val'), 'ab') as file:
+                file.write(np.float64(value).tobytes())
+            with open(self.column(code, 'ts'), 'ab') as file:
+                file.write(np.float64(ts).tobytes())
+
+    # Merging a batch of documents with stored data and rewriting columns in order
+    def merge(self, documents):
+        series = {}
+        for data in documents:
+            ts, rates = self.parse(data)
+            for code, value in rates.items():
+                series.setdefault(code, {})[ts] = value
+        for code, points in series.items():
+            known_ts, known_val = self.read(code)
+            points = {**points, **dict(zip(known_ts.tolist(), known_val.tolist()))}
+            ts = np.array(sorted(points), dtype=np.float64)
+            val = np.array([points[t] for t in ts], dtype=np.float64)
+            for name, column in (('ts', ts), ('val', val)):
+                tmp = self.column(code, name) + '.tmp'
+                column.tofile(tmp)
+                os.replace(tmp, self.column(code, name))
+
+    def range(self, code, start, end=None):
+        ts, val = self.read(code)
+        lo = np.searchsorted(ts, start)
+        hi = len(ts) if end is None else np.searchsorted(ts, end, side='right')
+        return ts[lo:hi], val[lo:hi]
+
+    def summary(self, code, days):
+        start = datetime.now().timestamp() - days * 24 * 60 * 60
+        ts, val = self.range(code, start)
+        if not len(val):
+            return None
+        low, high = int(val.argmin()), int(val.argmax())
+        return {
+            'code': code,
+            'days': days,
+            'points': len(val),
+            'first': float(val[0]),
+            'last': float(val[-1]),
+            'min': float(val[low]),
+            'min_date': datetime.fromtimestamp(ts[low]).date().isoformat(),
+            'max': float(val[high]),
+            'max_date': datetime.fromtimestamp(ts[high]).date().isoformat(),
+            'mean': float(val.mean()),
+            'change': float(val[-1] - val[0]),
+            'change_pct': float((val[-1] / val[0] - 1) * 100),
+        }
+
+
+async def fetch_archive(session, day):
+    async with session.get(archive_url.format(day)) as resp:
+        if resp.status == 404:
+            return None
+        resp.raise_for_status()
+        return await resp.json(content_type=None)
+
+
+# Loading CBR archive for past days (weekends and holidays have no documents)
+async def backfill(days, concurrency=4):
+    history = RateHistory()
+    semaphore = asyncio.Semaphore(concurrency)
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async def load(day):
+            async with semaphore:
+                return await fetch_archive(session, day)
+        today = date.today()
+        documents = await asyncio.gather(*(load(today - timedelta(days=i)) for i in range(days)))
+    history.merge(data for data in documents if data is not None)
+    print('Загружено документов: ' + str(sum(data is not None for data in documents)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='exchange rates history')
+    parser.add_argument("command", choices=['backfill'])
+    parser.add_argument("--days", type=int, default=365, help="how many days back to load")
+    args = parser.parse_args()
+    asyncio.run(backfill(args.days))
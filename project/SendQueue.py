@@ -0,0 +1,139 @@
+import asyncio
+import itertools
+import logging
+import time
+
+from collections import OrderedDict, deque
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger('base')
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    # Taking a token if there is one, otherwise returning seconds until the next one
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+# OUTGOING messages queue respecting Telegram flood limits per chat and globally
+class Outbox:
+    def __init__(self, bot, rate=30, chat_rate=1, chat_burst=3, maxsize=10000, max_chats=100000, retries=3,
+                 backoff=1.0):
+        self.bot = bot
+        self.retries = retries
+        self.backoff = backoff
+        self.global_bucket = TokenBucket(rate, rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = OrderedDict()
+        self.max_chats = max_chats
+        self.chats = {}
+        self.ready = asyncio.PriorityQueue()
+        self.slots = asyncio.Semaphore(maxsize)
+        self.counter = itertools.count()
+        self.paused_until = 0
+        self.metrics = {'sent': 0, 'coalesced': 0, 'retry_after': 0, 'retried': 0, 'failed': 0}
+
+    def chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self.chat_buckets) > self.max_chats:
+                self.chat_buckets.popitem(last=False)
+        self.chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    def schedule(self, chat_id):
+        queue = self.chats.get(chat_id)
+        if queue:
+            self.ready.put_nowait((queue[0]['priority'], next(self.counter), chat_id))
+
+    async def answer(self, message, text, reply_markup=None, priority=1):
+        await self.send(message.chat.id, text, reply_markup, priority)
+
+    async def send(self, chat_id, text, reply_markup=None, priority=1, delivered=None):
+        queue = self.chats.get(chat_id)
+        # Same keyboard message already waiting for this chat: no need to send it twice
+        # A delivery someone waits for is never merged into another message
+        if delivered is None and reply_markup is not None and queue and any(
+                item['text'] == text and item['reply_markup'] == reply_markup for item in queue):
+            self.metrics['coalesced'] += 1
+            return
+        await self.slots.acquire()
+        queue = self.chats.setdefault(chat_id, deque())
+        queue.append({'text': text, 'reply_markup': reply_markup, 'priority': priority, 'attempts': 0,
+                      'delivered': delivered})
+        if len(queue) == 1:
+            self.schedule(chat_id)
+
+    # Sending through the queue and waiting until Telegram has the message; a dropped message raises its error
+    async def deliver(self, chat_id, text, reply_markup=None, priority=1):
+        delivered = asyncio.get_running_loop().create_future()
+        await self.send(chat_id, text, reply_markup, priority, delivered)
+        await delivered
+
+    def start(self, senders=8):
+        return {asyncio.create_task(self.run()) for _ in range(senders)}
+
+    def depth(self):
+        return sum(len(queue) for queue in self.chats.values())
+
+    async def run(self):
+        while True:
+            _, _, chat_id = await self.ready.get()
+            queue = self.chats.get(chat_id)
+            if not queue:
+                continue
+            wait = self.chat_bucket(chat_id).take()
+            if wait:
+                asyncio.get_running_loop().call_later(wait, self.schedule, chat_id)
+                continue
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            while wait := self.global_bucket.take():
+                await asyncio.sleep(wait)
+            item = queue[0]
+            try:
+                await self.bot.send_message(chat_id, item['text'], reply_markup=item['reply_markup'])
+                self.metrics['sent'] += 1
+                if item['delivered'] is not None and not item['delivered'].done():
+                    item['delivered'].set_result(None)
+            except TelegramRetryAfter as e:
+                self.metrics['retry_after'] += 1
+                logger.warning('Telegram просит подождать %s с.', e.retry_after)
+                self.paused_until = time.monotonic() + e.retry_after
+                asyncio.get_running_loop().call_later(e.retry_after, self.schedule, chat_id)
+                continue
+            # Other errors drop the message, so one bad send never stops the sender or leaks its slot;
+            # network errors and 5xx are transient and get a few more tries first, the chat waits for them
+            except Exception as e:
+                if isinstance(e, (TelegramNetworkError, TelegramServerError)) and item['attempts'] < self.retries:
+                    item['attempts'] += 1
+                    self.metrics['retried'] += 1
+                    logger.warning('Ошибка отправки в чат %s (попытка %d), повтор: %r', chat_id, item['attempts'], e)
+                    asyncio.get_running_loop().call_later(self.backoff * 2 ** (item['attempts'] - 1),
+                                                          self.schedule, chat_id)
+                    continue
+                self.metrics['failed'] += 1
+                logger.warning('Не удалось отправить сообщение в чат %s: %r', chat_id, e)
+                if item['delivered'] is not None and not item['delivered'].done():
+                    item['delivered'].set_exception(e)
+            queue.popleft()
+            self.slots.release()
+            if queue:
+                self.schedule(chat_id)
+            else:
+                del self.chats[chat_id]
@@ -0,0 +1,217 @@
+import asyncio
+import heapq
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from datetime import datetime, timedelta
+from typing import NamedTuple
+
+logger = logging.getLogger('base')
+
+db_file = os.path.join(os.getcwd(), 'subscriptions.sqlite3')
+
+
+class Subscription(NamedTuple):
+    id: int
+    chat_id: int
+    kind: str
+    arg: str
+    minute: int
+
+
+# Next moment the given minute of the day comes, in server local time
+def next_due(minute, now):
+    day = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+    due = day + timedelta(minutes=minute)
+    if due.timestamp() <= now:
+        due += timedelta(days=1)
+    return due.timestamp()
+
+
+# Durable STORE of subscriptions; every change gets a new seq, so other processes can follow it
+class SubscriptionStore:
+    def __init__(self, path=db_file):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS subscriptions (
+                               id INTEGER PRIMARY KEY AUTOINCREMENT,
+                               chat_id INTEGER NOT NULL,
+                               kind TEXT NOT NULL,
+                               arg TEXT NOT NULL,
+                               minute INTEGER NOT NULL,
+                               active INTEGER NOT NULL DEFAULT 1,
+                               seq INTEGER NOT NULL)''')
+        self.db.execute('CREATE INDEX IF NOT EXISTS subscriptions_seq ON subscriptions (seq)')
+        self.db.execute('CREATE INDEX IF NOT EXISTS subscriptions_chat ON subscriptions (chat_id, active)')
+
+    def next_seq(self):
+        return self.db.execute('SELECT COALESCE(MAX(seq), 0) + 1 FROM subscriptions').fetchone()[0]
+
+    # Returning None when the chat already has too many subscriptions
+    def add(self, chat_id, kind, arg, minute, limit=10):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.db.execute('SELECT id FROM subscriptions WHERE chat_id = ? AND kind = ? AND arg = ? '
+                                      'AND minute = ? AND active = 1', (chat_id, kind, arg, minute)).fetchone()
+                if row is not None:
+                    subscription_id = row[0]
+                elif self.db.execute('SELECT COUNT(*) FROM subscriptions WHERE chat_id = ? AND active = 1',
+                                     (chat_id,)).fetchone()[0] >= limit:
+                    subscription_id = None
+                else:
+                    subscription_id = self.db.execute('INSERT INTO subscriptions (chat_id, kind, arg, minute, seq) '
+                                                      'VALUES (?, ?, ?, ?, ?)',
+                                                      (chat_id, kind, arg, minute, self.next_seq())).lastrowid
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return subscription_id
+
+    def remove_chat(self, chat_id):
+        with self.lock:
+            self.db.execute('BEGIN IMMEDIATE')
+            try:
+                count = self.db.execute('UPDATE subscriptions SET active = 0, seq = ? WHERE chat_id = ? AND active = 1',
+                                        (self.next_seq(), chat_id)).rowcount
+                self.db.execute('COMMIT')
+            except BaseException:
+                self.db.execute('ROLLBACK')
+                raise
+        return count
+
+    def list_chat(self, chat_id):
+        with self.lock:
+            rows = self.db.execute('SELECT id, chat_id, kind, arg, minute FROM subscriptions '
+                                   'WHERE chat_id = ? AND active = 1 ORDER BY minute', (chat_id,)).fetchall()
+        return [Subscription(*row) for row in rows]
+
+    def changes(self, since):
+        with self.lock:
+            return self.db.execute('SELECT id, chat_id, kind, arg, minute, active, seq FROM subscriptions '
+                                   'WHERE seq > ? ORDER BY seq', (since,)).fetchall()
+
+
+# SCHEDULER: heap of minutes of the day that have subscribers; one tick serves the whole minute
+class SubscriptionScheduler:
+    def __init__(self, render, deliver, clock=time.time):
+        self.render = render
+        self.deliver = deliver
+        self.clock = clock
+        self.slots = {}
+        self.heap = []
+        self.scheduled = set()
+        self.by_id = {}
+        self.metrics = {'ticks': 0, 'renders': 0, 'delivered': 0, 'errors': 0}
+
+    def __len__(self):
+        return len(self.by_id)
+
+    def add(self, sub):
+        self.remove(sub.id)
+        self.by_id[sub.id] = sub
+        self.slots.setdefault(sub.minute, {})[sub.id] = sub
+        if sub.minute not in self.scheduled:
+            self.scheduled.add(sub.minute)
+            heapq.heappush(self.heap, (next_due(sub.minute, self.clock()), sub.minute))
+
+    # Emptied minutes stay in the heap and are dropped when they come up
+    def remove(self, subscription_id):
+        sub = self.by_id.pop(subscription_id, None)
+        if sub is not None:
+            slot = self.slots[sub.minute]
+            del slot[sub.id]
+            if not slot:
+                del self.slots[sub.minute]
+
+    def next_time(self):
+        return self.heap[0][0] if self.heap else None
+
+    # Serving everything due by now; clock is a parameter, so a virtual one can drive it
+    async def tick(self, now=None):
+        now = self.clock() if now is None else now
+        while self.heap and self.heap[0][0] <= now:
+            due, minute = heapq.heappop(self.heap)
+            slot = self.slots.get(minute)
+            if not slot:
+                self.scheduled.discard(minute)
+                continue
+            # From now, not from due: after a sleep or a pause each minute fires once, not once per missed day
+            heapq.heappush(self.heap, (next_due(minute, now), minute))
+            await self.fire(list(slot.values()))
+
+    # Each distinct city or currency is rendered once and fanned out to all its subscribers
+    async def fire(self, subs):
+        self.metrics['ticks'] += 1
+        groups = {}
+        for sub in subs:
+            groups.setdefault((sub.kind, sub.arg), []).append(sub.chat_id)
+        keys = list(groups)
+        texts = await asyncio.gather(*(self.render(kind, arg) for kind, arg in keys), return_exceptions=True)
+        self.metrics['renders'] += len(keys)
+        for key, text in zip(keys, texts):
+            if isinstance(text, Exception):
+                self.metrics['errors'] += 1
+                logger.warning('Не удалось подготовить рассылку %s: %r', key, text)
+                continue
+            for chat_id in groups[key]:
+                await self.deliver(chat_id, text)
+            self.metrics['delivered'] += len(groups[key])
+
+
+# SUBSCRIPTIONS: store shared by all workers, scheduler running only in the process that owns it
+class Subscriptions:
+    def __init__(self, render, deliver, poll=30):
+        self.scheduler = SubscriptionScheduler(render, deliver)
+        self.poll = poll
+        self.store = None
+        self.seq = 0
+        self.changed = asyncio.Event()
+
+    def get_store(self):
+        if self.store is None:
+            self.store = SubscriptionStore()
+        return self.store
+
+    async def add(self, chat_id, kind, arg, minute):
+        subscription_id = await asyncio.to_thread(self.get_store().add, chat_id, kind, arg, minute)
+        self.changed.set()
+        return subscription_id
+
+    async def remove_chat(self, chat_id):
+        count = await asyncio.to_thread(self.get_store().remove_chat, chat_id)
+        self.changed.set()
+        return count
+
+    async def list_chat(self, chat_id):
+        return await asyncio.to_thread(self.get_store().list_chat, chat_id)
+
+    # Applying changes made by this and other worker processes since the last sync
+    async def sync(self):
+        for subscription_id, chat_id, kind, arg, minute, active, seq in await asyncio.to_thread(
+                self.get_store().changes, self.seq):
+            if active:
+                self.scheduler.add(Subscription(subscription_id, chat_id, kind, arg, minute))
+            else:
+                self.scheduler.remove(subscription_id)
+            self.seq = seq
+
+    async def run(self):
+        while True:
+            self.changed.clear()
+            try:
+                await self.sync()
+                await self.scheduler.tick()
+            except (sqlite3.Error, OSError) as e:
+                logger.warning('Ошибка планировщика подписок: %r', e)
+            due = self.scheduler.next_time()
+            delay = self.poll if due is None else min(self.poll, max(0.0, due - self.scheduler.clock()))
+            try:
+                await asyncio.wait_for(self.changed.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
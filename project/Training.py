@@ -0,0 +1,123 @@
+import argparse
+import os
+import shelve
+import time
+import numpy as np
+import pandas as pd
+
+from contextlib import contextmanager
+from hashlib import sha1
+from Artifact import export
+from Classification import get_normalizer, model_file
+from joblib import dump, load
+from sklearn.metrics import accuracy_score, classification_report
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.feature_extraction.text import TfidfTransformer
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+
+dataset_file = os.path.join(os.getcwd(), 'train_dataset.csv')
+cache_file = os.path.join(os.getcwd(), 'preprocessed_cache')
+
+
+@contextmanager
+def stage(name, timings):
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def text_key(txt):
+    return sha1(txt.encode('utf-8')).hexdigest()
+
+
+# Lemmatising only texts that are not in the on-disk cache yet; flags tell which rows are new or changed
+def preprocess(texts, workers=None, cache_path=cache_file):
+    keys = [text_key(txt) for txt in texts]
+    with shelve.open(cache_path) as cache:
+        missing = {key: txt for key, txt in zip(keys, texts) if key not in cache}
+        for key, prepared in zip(missing, get_normalizer().normalize_many(missing.values(), workers=workers)):
+            cache[key] = prepared
+        return [cache[key] for key in keys], [key in missing for key in keys]
+
+
+# Split by hash of the text, so a row stays on its side when the dataset grows or gets reordered
+def in_test(txt, test_size=0.3):
+    return int(text_key(txt)[:8], 16) < test_size * 16 ** 8
+
+
+def build_model():
+    return Pipeline([('vec', CountVectorizer()),
+                     ('tfdf', TfidfTransformer()),
+                     ('lr', LogisticRegression(n_jobs=1, C=1e5)),
+                     ])
+
+
+# Model that can be updated with new data without full retraining
+def load_incremental_model(classes):
+    if os.path.exists(model_file):
+        model = load(model_file)
+        if 'sgd' not in model.named_steps:
+            raise ValueError('Модель в ' + model_file + ' обучена полностью и не поддерживает дообучение, '
+                             'запустите обучение без --incremental')
+        unknown = set(classes) - set(model.named_steps['sgd'].classes_)
+        if unknown:
+            raise ValueError('Новые темы требуют полного обучения: ' + ', '.join(map(str, unknown)))
+        return model, None
+    model = Pipeline([('vec', HashingVectorizer(alternate_sign=False)),
+                      ('sgd', SGDClassifier(loss='log_loss', random_state=42)),
+                      ])
+    return model, classes
+
+
+# Teaching MODEL
+def teach(path=dataset_file, incremental=False, workers=None):
+    timings = {}
+    with stage('load', timings):
+        file = pd.read_csv(path)
+    texts = list(file['Текст инцидента'])
+    with stage('preprocess', timings):
+        x, fresh = preprocess(texts, workers)
+    y = list(file['Тема'])
+    test = [in_test(txt) for txt in texts]
+    x_train = [row for row, is_test in zip(x, test) if not is_test]
+    y_train = [label for label, is_test in zip(y, test) if not is_test]
+    x_test = [row for row, is_test in zip(x, test) if is_test]
+    y_test = [label for label, is_test in zip(y, test) if is_test]
+
+    with stage('fit', timings):
+        if incremental:
+            model, classes = load_incremental_model(np.unique(y))
+            # An existing model has already seen every cached row, only new and edited ones are fed to it
+            rows = [i for i, is_test in enumerate(test) if not is_test and (classes is not None or fresh[i])]
+            print('Строк для дообучения: ' + str(len(rows)))
+            if rows:
+                model.named_steps['sgd'].partial_fit(model.named_steps['vec'].transform([x[i] for i in rows]),
+                                                     [y[i] for i in rows], classes=classes)
+        else:
+            model = build_model()
+            model.fit(x_train, y_train)
+
+    with stage('evaluate', timings):
+        predicted = model.predict(x_test)
+
+    dump(model, model_file)
+    # Serving workers prefer the mmap artifact, so it is refreshed together with the joblib file
+    if 'lr' in model.named_steps:
+        print('Экспортирована версия модели ' + export(model))
+
+    print('Строк в датасете: ' + str(len(x)) + ', заново лемматизировано: ' + str(sum(fresh)))
+    print('Точность на отложенной выборке: ' + f'{accuracy_score(y_test, predicted):.3f}')
+    print(classification_report(y_test, predicted, zero_division=0))
+    for name, seconds in timings.items():
+        print(f'{name}: {seconds:.2f} с')
+    return model
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='training classification model')
+    parser.add_argument("--dataset", default=dataset_file, help="path to csv dataset")
+    parser.add_argument("--incremental", action='store_true', help="update existing model with partial_fit")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="processes for lemmatisation")
+    args = parser.parse_args()
+    teach(args.dataset, args.incremental, args.workers)
@@ -0,0 +1,73 @@
+import logging
+import os
+import time
+
+from collections import OrderedDict
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage
+
+logger = logging.getLogger('base')
+
+
+# Menus the user can be in (main menu is the empty state)
+class Menu(StatesGroup):
+    currencies = State()
+    query = State()
+    other = State()
+
+
+# In-process per-chat storage with LRU eviction and TTL
+class LRUStorage(BaseStorage):
+    def __init__(self, maxsize=100000, ttl=24 * 60 * 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.records = OrderedDict()
+
+    def _get(self, key):
+        record = self.records.get(key)
+        if record is None:
+            return None
+        if record['expires'] < time.monotonic():
+            del self.records[key]
+            return None
+        self.records.move_to_end(key)
+        return record
+
+    def _put(self, key, field, value):
+        record = self._get(key) or {'state': None, 'data': {}}
+        record[field] = value
+        record['expires'] = time.monotonic() + self.ttl
+        self.records[key] = record
+        self.records.move_to_end(key)
+        while len(self.records) > self.maxsize:
+            self.records.popitem(last=False)
+
+    async def set_state(self, key, state=None):
+        self._put(key, 'state', state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key):
+        record = self._get(key)
+        return record['state'] if record else None
+
+    async def set_data(self, key, data):
+        self._put(key, 'data', data.copy())
+
+    async def get_data(self, key):
+        record = self._get(key)
+        return record['data'].copy() if record else {}
+
+    async def close(self):
+        self.records.clear()
+
+
+# Choosing storage backend: Redis for several workers, LRU for a single process
+def create_storage(workers=1):
+    ttl = int(os.getenv('STATE_TTL', 24 * 60 * 60))
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        from aiogram.fsm.storage.redis import RedisStorage
+        return RedisStorage.from_url(redis_url, state_ttl=ttl, data_ttl=ttl)
+    if workers > 1:
+        logger.error('REDIS_URL не задан при %d рабочих процессах: состояние чатов будет своим в каждом процессе, '
+                     'и пользователи будут терять меню между сообщениями', workers)
+    return LRUStorage(maxsize=int(os.getenv('STATE_MAXSIZE', 100000)), ttl=ttl)
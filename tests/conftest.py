@@ -0,0 +1,58 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_dir), 'project'))
+sys.path.insert(0, tests_dir)
+
+from helpers import bot_requirements
+
+
+# One loop for the whole run: module-level queues, semaphores and the HTTP session get bound to it
+@pytest.fixture(scope='session')
+def loop():
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    loop.close()
+
+
+# Bot module imported once, in a scratch directory, with fake tokens and without Prometheus
+@pytest.fixture(scope='session')
+def bot_module(loop, tmp_path_factory):
+    for name in bot_requirements:
+        pytest.importorskip(name)
+    os.environ.update({'TOKEN': '123456:TEST', 'WAKEY': 'test', 'JOKEPID': 'test', 'JOKETOKEN': 'test',
+                       'METRICS': '0'})
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('bot'))
+    try:
+        import Bot
+    finally:
+        os.chdir(cwd)
+    yield Bot
+    loop.run_until_complete(Bot.HttpClient.close())
+    loop.run_until_complete(Bot.bot.session.close())
+
+
+@pytest.fixture
+def replies(bot_module, monkeypatch):
+    from helpers import capture_replies
+    return capture_replies(bot_module, monkeypatch)
+
+
+# Rates for the nine menu currencies, put back as they were after the test
+@pytest.fixture
+def published(bot_module, monkeypatch):
+    Bot = bot_module
+    monkeypatch.setattr(Bot.CurrencyService, 'rates', Bot.CurrencyService.rates)
+    monkeypatch.setattr(Bot.CurrencyService, 'responses', Bot.CurrencyService.responses)
+    monkeypatch.setattr(Bot.cD, 'cur_data_list', Bot.cD.cur_data_list)
+    values = {code: 10.0 + i for i, code in enumerate(Bot.cD.cur_list)}
+    Bot.CurrencyService.publish({code: Bot.Currency(code=code, name='Валюта ' + code, value=value)
+                                 for code, value in values.items()}, Bot.RateTable(values), time.time())
+    return Bot
@@ -0,0 +1,53 @@
+import itertools
+import time
+
+from contextlib import asynccontextmanager
+
+update_ids = itertools.count(1)
+
+bot_requirements = ['aiogram', 'aiohttp', 'colorlog', 'dotenv', 'fastapi', 'flag', 'numpy', 'pydantic', 'pymorphy3',
+                    'rapidfuzz', 'uvicorn']
+
+
+def make_update(chat_id, text):
+    return {'update_id': next(update_ids), 'message': {
+        'message_id': 1, 'date': int(time.time()), 'text': text,
+        'chat': {'id': chat_id, 'type': 'private'},
+        'from': {'id': chat_id, 'is_bot': False, 'first_name': 'Тест'}}}
+
+
+async def feed(Bot, chat_id, text):
+    update = Bot.types.Update.model_validate(make_update(chat_id, text), context={'bot': Bot.bot})
+    await Bot.dp.feed_update(Bot.bot, update)
+
+
+# Replies are collected per chat instead of going through the outbox to Telegram
+def capture_replies(Bot, monkeypatch):
+    replies = {}
+
+    async def send(chat_id, text, reply_markup=None, priority=1):
+        replies.setdefault(chat_id, []).append(text)
+
+    async def answer(message, text, reply_markup=None, priority=1):
+        await send(message.chat.id, text, reply_markup, priority)
+
+    monkeypatch.setattr(Bot.outbox, 'send', send)
+    monkeypatch.setattr(Bot.outbox, 'answer', answer)
+    monkeypatch.setattr(Bot.outbox, 'deliver', send)
+    return replies
+
+
+# Local stand-in for an upstream HTTP API
+@asynccontextmanager
+async def serve(*routes):
+    from aiohttp import web
+    app = web.Application()
+    for method, path, handler in routes:
+        app.router.add_route(method, path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', 0).start()
+    try:
+        yield 'http://127.0.0.1:' + str(runner.addresses[0][1])
+    finally:
+        await runner.cleanup()
@@ -0,0 +1,65 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('pymorphy3')
+pytest.importorskip('sklearn')
+joblib = pytest.importorskip('joblib')
+
+import Classification
+from Classification import BatchClassifier
+from sklearn.feature_extraction.text import CountVectorizer, TfidfTransformer
+from sklearn.linear_model import LogisticRegression
+from sklearn.pipeline import Pipeline
+
+dataset = [
+    ('течет кран на кухне', 'Сантехника'), ('прорвало трубу в подвале', 'Сантехника'),
+    ('нет горячей воды', 'Сантехника'), ('засор канализации в ванной', 'Сантехника'),
+    ('не горит свет в подъезде', 'Электрика'), ('искрит розетка', 'Электрика'),
+    ('выбивает автомат', 'Электрика'), ('нет электричества в квартире', 'Электрика'),
+    ('не работает лифт', 'Лифт'), ('застрял лифт', 'Лифт'), ('лифт скрипит', 'Лифт'),
+    ('сломана кнопка лифта', 'Лифт'),
+]
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    texts, labels = zip(*dataset)
+    model = Pipeline([('vec', CountVectorizer()), ('tfdf', TfidfTransformer()), ('lr', LogisticRegression())])
+    model.fit(texts, labels)
+    # The way the bot gets it: a joblib file written by Training.py
+    joblib.dump(model, tmp_path / 'trained_model.joblib')
+    monkeypatch.setattr(Classification, 'model_file', str(tmp_path / 'trained_model.joblib'))
+    monkeypatch.setattr(Classification, 'model', None)
+    monkeypatch.setattr(Classification, 'normalizer', SimpleNamespace(normalize=str.lower))
+    monkeypatch.setattr('Artifact.current_version', lambda *args: None)
+    return model
+
+
+def test_predict_through_joblib_pipeline(pipeline):
+    results = BatchClassifier.predict(['Течет кран', 'Лифт застрял между этажами', 'Искрит розетка'])
+    assert [label for label, _ in results] == ['Сантехника', 'Лифт', 'Электрика']
+    assert all(type(label) is str and 0 < score <= 1 for label, score in results)
+
+
+def test_classify_batches_requests(pipeline, loop):
+    classifier = BatchClassifier(max_delay=0.01)
+    texts = ['течет кран', 'не горит свет', 'застрял лифт'] * 10
+    results = loop.run_until_complete(classifier.classify_many(texts))
+    assert [label for label, _ in results] == ['Сантехника', 'Электрика', 'Лифт'] * 10
+    classifier.task.cancel()
+    loop.run_until_complete(asyncio.gather(classifier.task, return_exceptions=True))
+
+
+def test_mapped_artifact_agrees_with_pipeline(pipeline, tmp_path, monkeypatch):
+    from Artifact import MappedModel, export
+    version = export(pipeline, str(tmp_path / 'model_artifact'))
+    texts = [text for text, _ in dataset]
+    expected = BatchClassifier.predict(texts)
+    monkeypatch.setattr(Classification, 'model', MappedModel(str(tmp_path / 'model_artifact'), version))
+    mapped = BatchClassifier.predict(texts)
+    assert [label for label, _ in mapped] == [label for label, _ in expected]
+    assert [score for _, score in mapped] == pytest.approx([score for _, score in expected], abs=1e-4)
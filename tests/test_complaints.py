@@ -0,0 +1,170 @@
+import asyncio
+import logging
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('pymorphy3')
+
+import Complaints
+from Complaints import ComplaintIntake, ComplaintStore
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1700000000.0]
+    monkeypatch.setattr(Complaints, 'time', SimpleNamespace(time=lambda: now[0]))
+    return now
+
+
+def statuses(store):
+    return dict(store.db.execute('SELECT id, status FROM complaints ORDER BY id').fetchall())
+
+
+def test_expired_lease_is_claimed_again(tmp_path, clock):
+    path = str(tmp_path / 'complaints.sqlite3')
+    store = ComplaintStore(path, lease=10)
+    for i in range(3):
+        store.add(i, f'течет кран {i}', f'течь кран {i}')
+    assert [row[3] for row in store.claim(10)] == [1, 1, 1]
+    # The worker dies with the claims taken; a new process opens the same file
+    del store
+    store = ComplaintStore(path, lease=10)
+    assert store.claim(10) == []
+    clock[0] += 11
+    rows = store.claim(10)
+    assert [(row[0], row[3]) for row in rows] == [(1, 2), (2, 2), (3, 2)]
+    for row in rows:
+        store.done(row[0], 'Сантехника')
+    clock[0] += 11
+    assert store.claim(10) == []
+    assert set(statuses(store).values()) == {'done'}
+
+
+def test_crashing_complaint_is_given_up(tmp_path, clock, caplog):
+    store = ComplaintStore(str(tmp_path / 'complaints.sqlite3'), lease=10, max_attempts=2)
+    store.add(1, 'не работает лифт', 'работать лифт')
+    assert len(store.claim(10)) == 1
+    clock[0] += 11
+    assert len(store.claim(10)) == 1
+    clock[0] += 11
+    with caplog.at_level(logging.ERROR, logger='base'):
+        assert store.claim(10) == []
+    assert statuses(store) == {1: 'failed'}
+    assert 'failed' in caplog.text
+
+
+def test_duplicates_and_empty_texts(tmp_path, clock):
+    store = ComplaintStore(str(tmp_path / 'complaints.sqlite3'), dedup_window=60)
+    assert store.add(1, 'Течет кран!', 'течь кран') == (1, None)
+    assert store.add(2, 'течёт кран', 'течь кран') == (2, 1)
+    assert store.add(3, '!!!', '') == (3, None)
+    assert store.add(4, '???', '') == (4, None)
+    clock[0] += 61
+    assert store.add(5, 'кран течет', 'течь кран') == (5, None)
+    assert statuses(store) == {1: 'new', 2: 'duplicate', 3: 'new', 4: 'new', 5: 'new'}
+
+
+class FakeClassifier:
+    async def classify(self, text):
+        return 'Сантехника', 0.9
+
+
+def run_intake(loop, intake, texts, done):
+    async def scenario():
+        tasks = intake.start()
+        try:
+            ids = [(await intake.submit(chat_id, text))[0] for chat_id, text in enumerate(texts)]
+            async with asyncio.timeout(10):
+                while not done(ids):
+                    await asyncio.sleep(0.01)
+            return ids
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+    return loop.run_until_complete(scenario())
+
+
+@pytest.fixture
+def simple_prepare(monkeypatch):
+    monkeypatch.setattr(Complaints, 'prepare', lambda text: ' '.join(text.lower().split()))
+
+
+def test_failing_forward_stops_after_max_attempts(tmp_path, loop, simple_prepare, caplog):
+    calls = []
+
+    async def forward(complaint_id, chat_id, text, label):
+        calls.append(complaint_id)
+        raise RuntimeError('Telegram недоступен')
+
+    intake = ComplaintIntake(FakeClassifier(), forward, workers=2, poll=0.05, max_attempts=3, backoff=0.001)
+    intake.store = ComplaintStore(str(tmp_path / 'complaints.sqlite3'), max_attempts=3)
+    with caplog.at_level(logging.ERROR, logger='base'):
+        ids = run_intake(loop, intake, ['течет кран'],
+                         lambda ids: statuses(intake.store).get(ids[0]) == 'failed')
+    assert calls == ids * 3
+    assert 'failed' in caplog.text
+
+
+def test_intake_forwards_every_complaint_once(tmp_path, loop, simple_prepare):
+    forwarded = []
+
+    async def forward(complaint_id, chat_id, text, label):
+        forwarded.append((complaint_id, label))
+
+    intake = ComplaintIntake(FakeClassifier(), forward, workers=4, maxsize=8, poll=0.05)
+    intake.store = ComplaintStore(str(tmp_path / 'complaints.sqlite3'))
+    texts = [f'заявка номер {i}' for i in range(50)] + ['заявка номер 1']
+    ids = run_intake(loop, intake, texts, lambda ids: len(forwarded) == 50)
+    assert sorted(forwarded) == [(complaint_id, 'Сантехника') for complaint_id in ids[:50]]
+    assert statuses(intake.store)[ids[50]] == 'duplicate'
+
+
+# Management chat behind a real outbox; its sends fail while it is broken
+class ManagementBot:
+    def __init__(self, broken):
+        self.broken = broken
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        if chat_id == 999 and self.broken:
+            raise RuntimeError('Bad Request: chat not found')
+        self.sent.append((chat_id, text))
+
+
+@pytest.mark.parametrize('broken', [False, True])
+def test_complaint_is_done_only_after_delivery(bot_module, tmp_path, loop, simple_prepare, monkeypatch, broken):
+    Bot = bot_module
+    bot = ManagementBot(broken)
+    outbox = Bot.Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000)
+    monkeypatch.setattr(Bot, 'outbox', outbox)
+    monkeypatch.setattr(Bot, 'UK_CHAT_ID', '999')
+    intake = ComplaintIntake(FakeClassifier(), Bot.forward_complaint, workers=2, poll=0.05, max_attempts=2,
+                             backoff=0.001)
+    intake.store = ComplaintStore(str(tmp_path / 'complaints.sqlite3'), max_attempts=2)
+    final = 'failed' if broken else 'done'
+
+    async def start():
+        return outbox.start(2)
+
+    senders = loop.run_until_complete(start())
+    try:
+        ids = run_intake(loop, intake, ['течет кран'], lambda ids: statuses(intake.store).get(ids[0]) == final)
+    finally:
+        for task in senders:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*senders, return_exceptions=True))
+    if broken:
+        assert bot.sent == [] and outbox.metrics['failed'] == 2
+    else:
+        assert [chat_id for chat_id, _ in bot.sent] == [999, 0]
+        assert bot.sent[0][1] == f'Заявка №{ids[0]}, тип: Сантехника\nтечет кран'
+
+
+def test_intake_needs_management_chat(bot_module, monkeypatch, caplog):
+    monkeypatch.setattr(bot_module, 'UK_CHAT_ID', None)
+    with caplog.at_level(logging.ERROR, logger='base'):
+        assert bot_module.start_complaints() == set()
+    assert 'UK_CHAT_ID' in caplog.text
@@ -0,0 +1,118 @@
+import json
+import math
+import time
+
+import pytest
+
+np = pytest.importorskip('numpy')
+
+from Converter import RateTable
+from helpers import feed
+
+rates = {'EUR': 100.0, 'PLN': 25.0, 'HUF': 0.25, 'CNY': 12.5}
+
+
+def test_cross_rates():
+    table = RateTable(rates)
+    assert table.codes == ('RUB', 'CNY', 'EUR', 'HUF', 'PLN')
+    assert len(table) == 5
+    assert 'RUB' in table and 'EUR' in table and 'USD' not in table and None not in table
+    assert table.rate('EUR', 'PLN') == 4.0
+    assert table.convert(100, 'EUR', 'PLN') == 400.0
+    assert table.convert(1000, 'HUF', 'RUB') == 250.0
+    assert table.convert(1, 'RUB', 'EUR') == 0.01
+    assert table.as_dict() == {'CNY': 12.5, 'EUR': 100.0, 'HUF': 0.25, 'PLN': 25.0}
+
+
+def test_cbr_document_is_divided_by_nominal():
+    table = RateTable.from_cbr({'Valute': {'HUF': {'Nominal': 100, 'Value': 25.0},
+                                           'EUR': {'Nominal': 1, 'Value': 100.0}}})
+    assert table.rate('HUF', 'RUB') == 0.25
+    assert table.rate('EUR', 'HUF') == 400.0
+
+
+@pytest.mark.parametrize('bad', [0, -1.0, float('nan'), float('inf')])
+def test_invalid_rates_are_refused(bad):
+    with pytest.raises(ValueError):
+        RateTable({**rates, 'USD': bad})
+
+
+def test_batch_marks_unknown_codes_with_nan():
+    table = RateTable(rates)
+    result = table.convert_many([100, 1, 2, 5], ['EUR', 'XXX', 'PLN', 'RUB'], ['PLN', 'EUR', 'YYY', 'CNY'])
+    assert result[0] == 400.0 and result[3] == 0.4
+    assert math.isnan(result[1]) and math.isnan(result[2])
+    single = [table.convert(100, 'EUR', src) for src in ('RUB', 'HUF')]
+    assert table.convert_many([100, 100], ['EUR', 'EUR'], ['RUB', 'HUF']).tolist() == single
+
+
+def test_matrix_matches_pairwise_rates():
+    table = RateTable(rates)
+    codes, matrix = table.matrix()
+    assert codes == table.codes and matrix.shape == (5, 5)
+    for i, src in enumerate(codes):
+        for j, dst in enumerate(codes):
+            assert matrix[i, j] == pytest.approx(table.rate(src, dst))
+    codes, matrix = table.matrix(['PLN', 'EUR'])
+    assert codes == ('PLN', 'EUR')
+    assert matrix.tolist() == [[1.0, 0.25], [4.0, 1.0]]
+
+
+def test_table_is_read_only():
+    table = RateTable(rates)
+    with pytest.raises(ValueError):
+        table.rates[1] = 1.0
+
+
+@pytest.fixture
+def published(bot_module, monkeypatch):
+    Bot = bot_module
+    monkeypatch.setattr(Bot.CurrencyService, 'rates', Bot.CurrencyService.rates)
+    monkeypatch.setattr(Bot.CurrencyService, 'responses', Bot.CurrencyService.responses)
+    monkeypatch.setattr(Bot.cD, 'cur_data_list', Bot.cD.cur_data_list)
+    Bot.CurrencyService.publish({code: Bot.Currency(code=code, name='Валюта ' + code, value=value)
+                                 for code, value in rates.items() if code in Bot.cD.cur_list},
+                                RateTable(rates), time.time())
+    return Bot
+
+
+def test_endpoints_wait_for_first_rates(bot_module, loop, monkeypatch):
+    Bot = bot_module
+    monkeypatch.setattr(Bot.CurrencyService, 'rates', RateTable({}))
+    replies = [Bot.convert(100, 'EUR', 'PLN'),
+               Bot.convert_many([Bot.ConvertRequest(**{'from': 'EUR', 'to': 'PLN'})]),
+               Bot.convert_matrix()]
+    for reply in replies:
+        assert loop.run_until_complete(reply).status_code == 503
+
+
+def test_convert_endpoints(published, loop):
+    Bot = published
+    assert loop.run_until_complete(Bot.convert(100, 'eur', 'pln')) == {
+        'amount': 100, 'from': 'EUR', 'to': 'PLN', 'rate': 4.0, 'result': 400.0}
+    assert loop.run_until_complete(Bot.convert(1, 'EUR', 'XXX')).status_code == 404
+    items = [Bot.ConvertRequest(**{'amount': 2, 'from': 'pln', 'to': 'eur'}),
+             Bot.ConvertRequest(**{'from': 'XXX', 'to': 'RUB'})]
+    assert loop.run_until_complete(Bot.convert_many(items)) == [
+        {'amount': 2, 'from': 'PLN', 'to': 'EUR', 'result': 0.5},
+        {'amount': 1, 'from': 'XXX', 'to': 'RUB', 'result': None}]
+    # The batch answer has to stay valid JSON
+    json.dumps(loop.run_until_complete(Bot.convert_many(items)), allow_nan=False)
+    matrix = loop.run_until_complete(Bot.convert_matrix('eur,pln'))
+    assert matrix == {'codes': ('EUR', 'PLN'), 'matrix': [[1.0, 4.0], [0.25, 1.0]]}
+    assert loop.run_until_complete(Bot.convert_matrix('EUR,XXX')).status_code == 404
+
+
+def test_free_form_conversion(published, replies, loop):
+    Bot = published
+
+    async def scenario():
+        await feed(Bot, 600, 'Другой вопрос')
+        await feed(Bot, 600, 'Сколько будет 100 EUR в PLN?')
+        await feed(Bot, 600, '1000 форинтов в рубли')
+        await feed(Bot, 600, '5 XXX в EUR')
+
+    loop.run_until_complete(scenario())
+    assert replies[600][1:] == ['100.00 🇪🇺EUR = 400.00 🇵🇱PLN',
+                                '1 000.00 🇭🇺HUF = 250.00 RUB',
+                                'Простите, такой валюты я не знаю 😓']
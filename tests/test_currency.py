@@ -0,0 +1,79 @@
+import json
+
+from email.utils import formatdate
+from types import MappingProxyType
+
+import pytest
+
+from helpers import serve
+
+
+def cbr_document(day=17):
+    valute = {code: {'CharCode': code, 'Nominal': 10 if code == 'HUF' else 1, 'Name': 'Валюта ' + code,
+                     'Value': 10.0 + i} for i, code in enumerate(['EUR', 'BYN', 'UAH', 'MDL', 'RON', 'BGN', 'HUF',
+                                                                  'CZK', 'PLN', 'USD', 'CNY'])}
+    return {'Date': f'2026-10-{day}T11:30:00+03:00', 'Valute': valute}
+
+
+def request(path, headers=()):
+    from starlette.requests import Request
+    return Request({'type': 'http', 'method': 'GET', 'path': path, 'query_string': b'',
+                    'headers': [(name.encode(), value.encode()) for name, value in headers]})
+
+
+# Bot module with no rates at all, as right after a start, and its files in a scratch directory
+@pytest.fixture
+def cold(bot_module, tmp_path, monkeypatch):
+    Bot = bot_module
+    monkeypatch.setattr(Bot, 'snapshot_file', str(tmp_path / 'currency_snapshot.json'))
+    monkeypatch.setattr(Bot, 'rate_history', Bot.RateHistory(str(tmp_path / 'history')))
+    monkeypatch.setattr(Bot.cD, 'cur_data_list', MappingProxyType({}))
+    monkeypatch.setattr(Bot.CurrencyService, 'responses', {})
+    monkeypatch.setattr(Bot.CurrencyService, 'rates', Bot.RateTable({}))
+    return Bot
+
+
+def test_cold_start_serves_last_snapshot(cold, loop):
+    Bot = cold
+    endpoint = Bot.currency_endpoint('EUR')
+    assert Bot.CurrencyService.render('EUR') is None
+    assert loop.run_until_complete(endpoint(request('/EUR'))).status_code == 503
+    data = cbr_document()
+    with open(Bot.snapshot_file, 'w', encoding='utf-8') as file:
+        json.dump({'updated': 1760000000.0,
+                   'currencies': [Bot.CurrencyData.get_cur_value(data, code).model_dump() for code in Bot.cD.cur_list],
+                   'rates': Bot.RateTable.from_cbr(data).as_dict()}, file, ensure_ascii=False)
+    Bot.CurrencyData.restore_snapshot()
+    assert Bot.CurrencyService.render('EUR').endswith('= 10.0 🇷🇺 Российских рублей')
+    assert Bot.CurrencyService.rates.rate('EUR', 'CNY') == pytest.approx(10 / 20)
+    reply = loop.run_until_complete(endpoint(request('/EUR', [('accept', 'application/json')])))
+    assert reply.status_code == 200
+    assert json.loads(reply.body)['updated'] == 1760000000.0
+    assert reply.headers['last-modified'] == formatdate(1760000000.0, usegmt=True)
+    etag = reply.headers['etag']
+    headers = [('accept', 'application/json'), ('if-none-match', etag)]
+    again = loop.run_until_complete(endpoint(request('/EUR', headers)))
+    assert again.status_code == 304
+
+
+def test_restart_keeps_last_modified(cold, loop, monkeypatch):
+    from aiohttp import web
+    Bot = cold
+
+    async def daily(request):
+        return web.json_response(cbr_document(), headers={'ETag': '"cbr-17"'})
+
+    async def scenario():
+        async with serve(('GET', '/daily_json.js', daily)) as url:
+            monkeypatch.setattr(Bot.CurrencyData, 'url', url + '/daily_json.js')
+            await Bot.CurrencyData().refresh()
+        return Bot.CurrencyService.responses[('PLN', 'json')]
+
+    body, _, headers = loop.run_until_complete(scenario())
+    with open(Bot.snapshot_file, encoding='utf-8') as file:
+        snapshot = json.load(file)
+    assert snapshot['updated'] == json.loads(body)['updated']
+    # The next process starts from the snapshot and must not look newer to caches
+    monkeypatch.setattr(Bot.CurrencyService, 'responses', {})
+    Bot.CurrencyData.restore_snapshot()
+    assert Bot.CurrencyService.responses[('PLN', 'json')] == (body, 'application/json', headers)
@@ -0,0 +1,63 @@
+import asyncio
+import threading
+
+import pytest
+
+from Executor import Stage, StageExecutor, StageOverloaded
+
+
+# Thread executor with spare threads, so only the limits of the test stage apply
+@pytest.fixture
+def executor():
+    executor = StageExecutor(kind='thread', workers=2)
+    yield executor
+    executor.shutdown()
+
+
+# Event holding the blocking calls in the pool until the test lets them finish
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    gate.set()
+
+
+def blocking(gate, value):
+    gate.wait(5)
+    return value
+
+
+def test_full_stage_is_rejected(executor, gate, loop):
+    stage = executor.stages['blocking'] = Stage('blocking', limit=1, maxsize=2, timeout=5)
+
+    async def scenario():
+        tasks = [asyncio.ensure_future(executor.run('blocking', blocking, gate, i)) for i in range(2)]
+        await asyncio.sleep(0.05)
+        assert (stage.pending, stage.running) == (2, 1)
+        with pytest.raises(StageOverloaded):
+            await executor.run('blocking', blocking, gate, 2)
+        gate.set()
+        return await asyncio.gather(*tasks)
+
+    assert loop.run_until_complete(scenario()) == [0, 1]
+    assert executor.stats()['blocking'] == {'running': 0, 'pending': 0, 'done': 2, 'rejected': 1, 'timeouts': 0}
+
+
+def test_timed_out_task_keeps_its_slot(executor, gate, loop):
+    stage = executor.stages['blocking'] = Stage('blocking', limit=1, maxsize=10, timeout=0.1)
+
+    async def scenario():
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run('blocking', blocking, gate, 0)
+        # The caller gave up, but the thread is still busy: the slot stays taken
+        assert (stage.pending, stage.running) == (0, 1)
+        with pytest.raises(asyncio.TimeoutError):
+            await executor.run('blocking', abs, -1)
+        gate.set()
+        async with asyncio.timeout(5):
+            while stage.running:
+                await asyncio.sleep(0.01)
+        return await executor.run('blocking', abs, -2)
+
+    assert loop.run_until_complete(scenario()) == 2
+    assert stage.metrics == {'done': 1, 'rejected': 0, 'timeouts': 2}
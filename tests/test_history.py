@@ -0,0 +1,43 @@
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('aiohttp')
+
+from RateHistory import RateHistory
+
+
+def document(day, value):
+    return {'Date': f'2026-10-{day:02d}T11:30:00+03:00', 'Valute': {'EUR': {'Nominal': 1, 'Value': value}}}
+
+
+def day_of(ts):
+    return datetime.fromtimestamp(ts).day
+
+
+def test_append_and_read(tmp_path):
+    history = RateHistory(str(tmp_path))
+    for day, value in [(10, 100.0), (11, 101.0), (11, 999.0), (12, 102.0)]:
+        history.append(document(day, value))
+    ts, val = history.read('EUR')
+    assert [day_of(t) for t in ts.tolist()] == [10, 11, 12]
+    assert val.tolist() == [100.0, 101.0, 102.0]
+
+
+# What a failed append of day 12 may leave behind: bytes written to each column before the error
+@pytest.mark.parametrize('val_bytes, ts_bytes', [(8, 0), (8, 3), (5, 0)])
+def test_torn_append_is_repaired(tmp_path, val_bytes, ts_bytes):
+    history = RateHistory(str(tmp_path))
+    history.append(document(10, 100.0))
+    history.append(document(11, 101.0))
+    ts, _ = RateHistory.parse(document(12, 111.0))
+    with open(history.column('EUR', 'val'), 'ab') as file:
+        file.write(np.float64(111.0).tobytes()[:val_bytes])
+    with open(history.column('EUR', 'ts'), 'ab') as file:
+        file.write(np.float64(ts).tobytes()[:ts_bytes])
+    history.append(document(12, 120.0))
+    history.append(document(13, 130.0))
+    ts, val = history.read('EUR')
+    assert [day_of(t) for t in ts.tolist()] == [10, 11, 12, 13]
+    assert val.tolist() == [100.0, 101.0, 120.0, 130.0]
@@ -0,0 +1,152 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+import pytest
+
+aiohttp = pytest.importorskip('aiohttp')
+
+import HttpClient as http
+from aiohttp import web
+from helpers import feed, serve
+from HttpClient import CircuitBreaker, CircuitOpenError, HttpClient, UpstreamError
+
+
+@pytest.fixture
+def client(loop, monkeypatch):
+    monkeypatch.setattr(HttpClient, 'breakers', {})
+    monkeypatch.setattr(HttpClient, 'pending', {})
+    monkeypatch.setattr(HttpClient, 'backoff', 0.001)
+    yield HttpClient
+    loop.run_until_complete(HttpClient.close())
+
+
+# Stub answering with the given statuses in turn, then 200 for every call after them
+def sequence(statuses, calls, delay=0.0):
+    statuses = list(statuses)
+
+    async def handler(request):
+        calls.append(dict(request.query))
+        await asyncio.sleep(delay)
+        status = statuses.pop(0) if statuses else 200
+        return web.json_response({'status': status}, status=status)
+    return ('GET', '/api', handler)
+
+
+def test_breaker_transitions(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(http, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    breaker = CircuitBreaker('owm', threshold=3, reset=30)
+    for _ in range(2):
+        breaker.failure()
+    assert breaker.state == 'closed' and breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    now[0] += 29
+    assert not breaker.allow()
+    now[0] += 1
+    # Half-open: exactly one probe goes through
+    assert breaker.allow() and breaker.state == 'half-open'
+    assert not breaker.allow()
+    breaker.failure()
+    assert breaker.state == 'open' and not breaker.allow()
+    now[0] += 30
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == 'closed' and breaker.failures == 0 and breaker.allow()
+
+
+@pytest.mark.parametrize('status', [500, 503, 429])
+def test_retries_on_server_errors(client, loop, status):
+    calls = []
+
+    async def scenario():
+        async with serve(sequence([status, status], calls)) as url:
+            return await client.request('cbr', 'GET', url + '/api', retries=2)
+
+    assert loop.run_until_complete(scenario()).status == 200
+    assert len(calls) == 3
+    assert client.get_breaker('cbr').state == 'closed'
+
+
+def test_client_errors_are_not_retried(client, loop):
+    calls = []
+
+    async def scenario():
+        async with serve(sequence([404], calls)) as url:
+            return await client.request('owm', 'GET', url + '/api', retries=2)
+
+    assert loop.run_until_complete(scenario()).json() == {'status': 404}
+    assert len(calls) == 1
+
+
+def test_exhausted_retries_open_breaker(client, loop, monkeypatch):
+    monkeypatch.setattr(HttpClient, 'breaker_threshold', 3)
+    calls = []
+
+    async def scenario():
+        async with serve(sequence([502] * 10, calls)) as url:
+            with pytest.raises(UpstreamError):
+                await client.request('joke', 'GET', url + '/api', retries=2)
+            with pytest.raises(CircuitOpenError):
+                await client.request('joke', 'GET', url + '/api', retries=2)
+
+    loop.run_until_complete(scenario())
+    assert len(calls) == 3
+    assert client.stats() == {'joke': {'state': 'open', 'failures': 3}}
+
+
+def test_identical_gets_are_merged(client, loop):
+    calls = []
+
+    async def scenario():
+        async with serve(sequence([], calls, delay=0.05)) as url:
+            same = [client.get('owm', url + '/api', params={'q': 'Пермь'}) for _ in range(20)]
+            other = [client.get('owm', url + '/api', params={'q': 'Казань'}) for _ in range(5)]
+            return await asyncio.gather(*same, *other)
+
+    replies = loop.run_until_complete(scenario())
+    assert [reply.status for reply in replies] == [200] * 25
+    assert sorted(call['q'] for call in calls) == ['Казань', 'Пермь']
+    assert not client.pending
+
+
+def test_hung_upstream_does_not_block_other_chats(published, replies, loop, monkeypatch):
+    Bot = published
+    monkeypatch.setattr(HttpClient, 'breakers', {})
+    monkeypatch.setattr(HttpClient, 'timeout', aiohttp.ClientTimeout(total=1))
+    monkeypatch.setattr(HttpClient, 'retries', 0)
+    monkeypatch.setattr(Bot.WeatherData, 'cache', Bot.TTLCache(ttl=600))
+    button = next(iter(Bot.cD.cur_buttons))
+    answered = {}
+    release = asyncio.Event()
+
+    async def hang(request):
+        await release.wait()
+        return web.json_response({'cod': 200})
+
+    async def currency_chat(chat_id):
+        await feed(Bot, chat_id, 'валюты')
+        await feed(Bot, chat_id, button)
+        answered[chat_id] = time.monotonic()
+
+    async def scenario():
+        async with serve(('GET', '/weather', hang)) as url:
+            monkeypatch.setattr(Bot.WeatherData, 'url', url + '/weather')
+            await feed(Bot, 500, 'Другой вопрос')
+            start = time.monotonic()
+            weather = asyncio.ensure_future(feed(Bot, 500, 'Какая погода в Москве'))
+            try:
+                await asyncio.sleep(0.05)
+                await asyncio.gather(*(currency_chat(chat_id) for chat_id in range(501, 521)))
+                await weather
+                return start, time.monotonic()
+            finally:
+                release.set()
+
+    start, finished = loop.run_until_complete(scenario())
+    assert len(answered) == 20
+    assert max(answered.values()) - start < 0.5
+    assert finished - start >= 0.9
+    assert replies[500][-1] == 'Сервис погоды сейчас недоступен, попробуйте позже 🙏'
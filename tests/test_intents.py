@@ -0,0 +1,71 @@
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('rapidfuzz')
+
+from ConstantData import ConstDat
+from IntentRouter import IntentRouter
+from rapidfuzz import fuzz, process, utils
+
+# Phrasings users actually send, with the intent they expect
+labelled = [
+    ('Который час?', 'time'),
+    ('сколько времени', 'time'),
+    ('Подскажи время пожалуйста', 'time'),
+    ('Какой сейчас час', 'time'),
+    ('время не подскажешь', 'time'),
+    ('Какая погода на улице?', 'weather_locale'),
+    ('как погода?', 'weather_locale'),
+    ('Что за погода за окном?', 'weather_locale'),
+    ('Как погодка?', 'weather_locale'),
+    ('Какая погода в Москве', 'weather'),
+    ('Погода в Перми', 'weather'),
+    ('Сколько градусов в Казани?', 'weather'),
+    ('подскажи погоду в Санкт-Петербурге', 'weather'),
+    ('Что с погодой в Екатеринбурге', 'weather'),
+    ('Расскажи анекдот', 'joke'),
+    ('анекдот', 'joke'),
+    ('Хочу анекдот!', 'joke'),
+    ('Почините крышу', None),
+    ('12345', None),
+    ('Привет, бот', None),
+]
+
+
+# Plain reference: best template of each list in turn, the best score over its threshold wins
+def route_sequential(message, intents):
+    best, best_score = None, -1
+    for name, (templates, threshold) in intents.items():
+        _, score, _ = process.extractOne(message, templates, scorer=fuzz.WRatio, processor=utils.default_process)
+        if round(score) >= threshold and round(score) > best_score:
+            best, best_score = name, round(score)
+    return best
+
+
+@pytest.fixture(scope='module')
+def router():
+    return IntentRouter(ConstDat.intents)
+
+
+def test_router_matches_sequential_scans(router):
+    messages = [message for message, _ in labelled]
+    routed = [intent for intent, _ in router.route_many(messages)]
+    assert routed == [route_sequential(message, ConstDat.intents) for message in messages]
+
+
+@pytest.mark.parametrize('message, expected', labelled)
+def test_labelled_phrases(router, message, expected):
+    intent, scores = router.route(message)
+    assert intent == expected, scores
+
+
+def test_single_and_batch_agree(router):
+    messages = [message for message, _ in labelled]
+    assert [router.route(message) for message in messages] == router.route_many(messages)
+
+
+def test_intents_come_from_config():
+    router = IntentRouter({'greeting': (['Привет', 'Здравствуйте'], 80), **ConstDat.intents})
+    intent, scores = router.route('привет!')
+    assert intent == 'greeting'
+    assert set(scores) == {'greeting', *ConstDat.intents}
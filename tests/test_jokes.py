@@ -0,0 +1,96 @@
+import asyncio
+import itertools
+
+from collections import deque
+
+import pytest
+
+from helpers import serve
+
+
+@pytest.fixture
+def joke(bot_module, monkeypatch):
+    Joke = bot_module.Joke
+    monkeypatch.setattr(Joke, 'buffers', {i: deque() for i in Joke.buffers})
+    monkeypatch.setattr(Joke, 'seen', set())
+    monkeypatch.setattr(Joke, 'seen_order', deque())
+    monkeypatch.setattr(Joke, 'metrics', dict.fromkeys(Joke.metrics, 0))
+    monkeypatch.setattr(Joke, 'refill_interval', 0.001)
+    monkeypatch.setattr(Joke, 'buffer_size', 3)
+    return Joke
+
+
+# Fake anecdotica: numbered jokes, every third one repeats the previous text
+def joke_api(calls, exhausted=False):
+    from aiohttp import web
+    numbers = itertools.count()
+
+    async def handler(request):
+        calls.append(request.query['country'])
+        if exhausted:
+            return web.json_response({'result': {'error': 1, 'errMsg': 'limit'}})
+        n = next(numbers)
+        return web.json_response({'result': {'error': 0}, 'item': {'text': f'Анекдот {n - (n % 3 == 2)}'}})
+    return ('GET', '/api', handler)
+
+
+# Running the refill loop until the condition holds, then a little longer to catch extra calls
+async def refill_until(Joke, condition, linger=0.05, timeout=5):
+    task = asyncio.ensure_future(Joke.refill_jokes())
+    try:
+        async with asyncio.timeout(timeout):
+            while not condition():
+                await asyncio.sleep(0.005)
+        await asyncio.sleep(linger)
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def test_buffers_fill_up_without_duplicates(joke, loop, monkeypatch):
+    calls = []
+
+    async def scenario():
+        async with serve(joke_api(calls)) as url:
+            monkeypatch.setattr(joke, 'url', url + '/api')
+            await refill_until(joke, lambda: all(len(buf) == joke.buffer_size for buf in joke.buffers.values()))
+
+    loop.run_until_complete(scenario())
+    texts = [text for buf in joke.buffers.values() for text in buf]
+    assert len(texts) == len(set(texts)) == joke.buffer_size * len(joke.buffers)
+    assert joke.metrics['duplicates'] > 0
+    assert joke.metrics['fetched'] == len(texts)
+    assert len(calls) == joke.metrics['fetched'] + joke.metrics['duplicates']
+    answer = loop.run_until_complete(joke.get_joke())
+    assert answer.split('\n', 1)[1] in texts
+    assert joke.metrics['served'] == 1
+
+
+def test_exhausted_api_pauses_refill(joke, loop, monkeypatch):
+    calls = []
+
+    async def scenario():
+        async with serve(joke_api(calls, exhausted=True)) as url:
+            monkeypatch.setattr(joke, 'url', url + '/api')
+            await refill_until(joke, lambda: calls)
+
+    loop.run_until_complete(scenario())
+    assert len(calls) == 1
+    assert joke.metrics['exhausted'] == 1
+    assert loop.run_until_complete(joke.get_joke()).startswith('Свежих анекдотов пока нет')
+    assert joke.metrics['fallback'] == 1
+
+
+def test_unreachable_api_counts_errors(joke, loop, monkeypatch):
+    from aiohttp import web
+
+    async def broken(request):
+        return web.Response(text='not json')
+
+    async def scenario():
+        async with serve(('GET', '/api', broken)) as url:
+            monkeypatch.setattr(joke, 'url', url + '/api')
+            await refill_until(joke, lambda: joke.metrics['errors'] >= 2)
+
+    loop.run_until_complete(scenario())
+    assert not any(joke.buffers.values())
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from helpers import bot_requirements
+
+# Separate interpreter: the rest of the suite imports the bot once with metrics off
+script = '''
+import asyncio
+import Bot
+from helpers import feed
+
+
+async def main():
+    for text in ('/start', 'Другой вопрос', 'Который час?'):
+        await feed(Bot, 1, text)
+    reply = await Bot.metrics()
+    print(reply.media_type)
+    print(reply.body.decode())
+    await Bot.bot.session.close()
+
+asyncio.run(main())
+'''
+
+
+def test_metrics_endpoint(tmp_path):
+    for name in bot_requirements + ['prometheus_client']:
+        pytest.importorskip(name)
+    tests_dir = os.path.dirname(os.path.abspath(__file__))
+    project = os.path.join(os.path.dirname(tests_dir), 'project')
+    env = dict(os.environ, TOKEN='123456:TEST', WAKEY='test', JOKEPID='test', JOKETOKEN='test', METRICS='1',
+               LOGLEVEL='warning', PYTHONPATH=os.pathsep.join([project, tests_dir]))
+    result = subprocess.run([sys.executable, '-c', script], cwd=tmp_path, env=env, capture_output=True, text=True,
+                            timeout=120)
+    assert result.returncode == 0, result.stderr
+    media_type, body = result.stdout.split('\n', 1)
+    assert media_type.startswith('text/plain')
+    assert 'bot_handler_seconds_count{handler="hello"} 1.0' in body
+    assert 'bot_handler_seconds_count{handler="other_questions"} 1.0' in body
+    assert 'bot_stage_calls_total{stage="fuzzy"} 1.0' in body
+    assert 'bot_state{name="outbox_depth"} 3.0' in body
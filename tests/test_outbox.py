@@ -0,0 +1,201 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip('aiogram')
+pytest.importorskip('aiohttp')
+
+from aiogram.exceptions import TelegramNetworkError
+from helpers import serve
+from SendQueue import Outbox
+
+
+# Fake bot: records what was sent, raises for the chats it is told to, fails the first sends of flaky chats
+class FakeBot:
+    def __init__(self, broken=(), flaky=None):
+        self.broken = set(broken)
+        self.flaky = dict(flaky or {})
+        self.sent = []
+
+    async def send_message(self, chat_id, text, reply_markup=None):
+        await asyncio.sleep(0)
+        if chat_id in self.broken:
+            raise RuntimeError('connection reset')
+        if self.flaky.get(chat_id):
+            self.flaky[chat_id] -= 1
+            raise TelegramNetworkError(None, 'connection reset')
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+async def drain(outbox, senders=4, timeout=5):
+    tasks = outbox.start(senders)
+    try:
+        async with asyncio.timeout(timeout):
+            while outbox.depth():
+                await asyncio.sleep(0.005)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def test_unexpected_errors_release_slots(loop):
+    bot = FakeBot(broken={13})
+    outbox = Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, maxsize=2)
+
+    async def scenario():
+        tasks = outbox.start(2)
+        try:
+            async with asyncio.timeout(5):
+                for i in range(5):
+                    await outbox.send(13, f'сообщение {i}')
+                await outbox.send(1, 'привет')
+                while outbox.depth():
+                    await asyncio.sleep(0.005)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    loop.run_until_complete(scenario())
+    assert outbox.metrics['failed'] == 5
+    assert outbox.metrics['sent'] == 1
+    assert [text for _, text, _ in bot.sent] == ['привет']
+    assert not outbox.chats
+
+
+def test_transient_errors_are_retried_in_order(loop):
+    bot = FakeBot(flaky={7: 2, 8: 10})
+    outbox = Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, retries=3, backoff=0.01)
+
+    async def scenario():
+        for i in range(3):
+            await outbox.send(7, str(i))
+        await outbox.send(8, 'не дойдет')
+        await outbox.send(9, 'сразу')
+        await drain(outbox)
+
+    loop.run_until_complete(scenario())
+    assert [(chat_id, text) for chat_id, text, _ in bot.sent] == [(9, 'сразу'), (7, '0'), (7, '1'), (7, '2')]
+    assert outbox.metrics['retried'] == 2 + 3
+    assert outbox.metrics['failed'] == 1
+    assert not outbox.chats
+
+
+def test_deliver_waits_for_telegram(loop):
+    bot = FakeBot(broken={13}, flaky={7: 1})
+    outbox = Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, backoff=0.01)
+
+    async def scenario():
+        tasks = outbox.start(2)
+        try:
+            await outbox.deliver(7, 'заявка')
+            assert [text for _, text, _ in bot.sent] == ['заявка']
+            with pytest.raises(RuntimeError):
+                await outbox.deliver(13, 'заявка')
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    loop.run_until_complete(asyncio.wait_for(scenario(), 5))
+    assert outbox.metrics['retried'] == 1 and outbox.metrics['failed'] == 1
+
+
+def test_global_rate_is_respected(loop):
+    bot = FakeBot()
+    outbox = Outbox(bot, rate=200, chat_rate=1, chat_burst=3)
+
+    async def scenario():
+        for chat_id in range(400):
+            await outbox.send(chat_id, 'курс евро')
+        start = time.monotonic()
+        await drain(outbox)
+        return time.monotonic() - start
+
+    elapsed = loop.run_until_complete(scenario())
+    assert outbox.metrics['sent'] == 400
+    assert elapsed >= (400 - 200) / 200 * 0.9
+
+
+def test_chat_keeps_order_within_its_limit(loop):
+    bot = FakeBot()
+    outbox = Outbox(bot, rate=1000, chat_rate=20, chat_burst=2)
+
+    async def scenario():
+        for i in range(10):
+            await outbox.send(7, str(i))
+        await drain(outbox)
+
+    loop.run_until_complete(scenario())
+    assert [text for _, text, _ in bot.sent] == [str(i) for i in range(10)]
+    times = [sent for _, _, sent in bot.sent]
+    assert times[-1] - times[0] >= (10 - 2) / 20 * 0.9
+
+
+def test_same_keyboard_message_is_coalesced(loop):
+    bot = FakeBot()
+    outbox = Outbox(bot)
+    keyboard = object()
+
+    async def scenario():
+        await outbox.send(5, 'Доступные действия:', reply_markup=keyboard)
+        await outbox.send(5, 'Доступные действия:', reply_markup=keyboard)
+        await outbox.send(5, 'Доступные действия:')
+        await drain(outbox)
+
+    loop.run_until_complete(scenario())
+    assert outbox.metrics['coalesced'] == 1
+    assert len(bot.sent) == 2
+
+
+def test_stub_bot_api_errors(loop):
+    from aiogram import Bot
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiohttp import web
+    limited = []
+    unavailable = []
+
+    async def send_message(request):
+        data = await request.post() or await request.json()
+        chat_id = int(data['chat_id'])
+        if chat_id == 2:
+            return web.json_response({'ok': False, 'error_code': 400, 'description': 'Bad Request: chat not found'},
+                                     status=400)
+        if chat_id == 3 and not limited:
+            limited.append(time.monotonic())
+            return web.json_response({'ok': False, 'error_code': 429, 'parameters': {'retry_after': 1},
+                                      'description': 'Too Many Requests: retry after 1'}, status=429)
+        if chat_id == 4:
+            return web.Response(text='<html>Bad Gateway</html>', content_type='text/html')
+        if chat_id == 5 and len(unavailable) < 2:
+            unavailable.append(time.monotonic())
+            return web.json_response({'ok': False, 'error_code': 502, 'description': 'Bad Gateway'}, status=502)
+        return web.json_response({'ok': True, 'result': {
+            'message_id': 1, 'date': int(time.time()), 'text': data['text'],
+            'chat': {'id': chat_id, 'type': 'private'}}})
+
+    async def scenario():
+        async with serve(('POST', '/bot{token}/sendMessage', send_message)) as url:
+            bot = Bot(token='123456:TEST', session=AiohttpSession(api=TelegramAPIServer.from_base(url)))
+            outbox = Outbox(bot, rate=1000, chat_rate=1000, chat_burst=1000, maxsize=5, backoff=0.05)
+            try:
+                for chat_id in (1, 2, 3, 4, 5):
+                    await outbox.send(chat_id, 'проверка')
+                await drain(outbox)
+                resumed = time.monotonic()
+                # Every slot is free again, so these do not wait for anything
+                async with asyncio.timeout(1):
+                    for _ in range(4):
+                        await outbox.send(1, 'еще раз')
+                await drain(outbox)
+            finally:
+                await bot.session.close()
+            return outbox, resumed
+
+    outbox, resumed = loop.run_until_complete(scenario())
+    assert outbox.metrics == {'sent': 7, 'coalesced': 0, 'retry_after': 1, 'retried': 2, 'failed': 2}
+    assert unavailable[1] - unavailable[0] >= 0.05
+    assert resumed - limited[0] >= 0.9
@@ -0,0 +1,149 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('aiogram')
+
+import UserState
+from aiogram.fsm.storage.base import StorageKey
+from helpers import feed
+from UserState import LRUStorage, Menu
+
+garbage = 'Простите, на данный вопрос ответить я не могу 😓'
+
+
+def key(chat_id):
+    return StorageKey(bot_id=123456, chat_id=chat_id, user_id=chat_id)
+
+
+def test_lru_evicts_least_recently_used(loop):
+    storage = LRUStorage(maxsize=2)
+    loop.run_until_complete(storage.set_state(key(1), Menu.currencies))
+    loop.run_until_complete(storage.set_state(key(2), Menu.other))
+    assert loop.run_until_complete(storage.get_state(key(1))) == Menu.currencies.state
+    loop.run_until_complete(storage.set_data(key(3), {'city': 'Пермь'}))
+    assert loop.run_until_complete(storage.get_state(key(2))) is None
+    assert loop.run_until_complete(storage.get_state(key(1))) == Menu.currencies.state
+    assert loop.run_until_complete(storage.get_data(key(3))) == {'city': 'Пермь'}
+    assert len(storage.records) == 2
+
+
+def test_lru_expires_after_ttl(loop, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(UserState, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    storage = LRUStorage(ttl=60)
+    loop.run_until_complete(storage.set_state(key(1), Menu.query))
+    now[0] += 59
+    assert loop.run_until_complete(storage.get_state(key(1))) == Menu.query.state
+    loop.run_until_complete(storage.set_data(key(1), {'text': 'течет кран'}))
+    now[0] += 59
+    assert loop.run_until_complete(storage.get_state(key(1))) == Menu.query.state
+    now[0] += 2
+    assert loop.run_until_complete(storage.get_state(key(1))) is None
+    assert loop.run_until_complete(storage.get_data(key(1))) == {}
+    assert not storage.records
+
+
+def test_data_is_copied(loop):
+    storage = LRUStorage()
+    data = {'n': 1}
+    loop.run_until_complete(storage.set_data(key(1), data))
+    data['n'] = 2
+    loop.run_until_complete(storage.get_data(key(1)))['n'] = 3
+    assert loop.run_until_complete(storage.get_data(key(1))) == {'n': 1}
+
+
+def test_chats_are_routed_independently(published, replies, loop):
+    Bot = published
+    button = next(iter(Bot.cD.cur_buttons))
+
+    async def scenario():
+        await feed(Bot, 101, 'валюты')
+        await feed(Bot, 202, 'Заявка в УК')
+        await feed(Bot, 101, button)
+        await feed(Bot, 202, 'Назад')
+        await feed(Bot, 202, button)
+
+    loop.run_until_complete(scenario())
+    assert Bot.dp.storage.records[key(101)]['state'] == Menu.currencies.state
+    assert loop.run_until_complete(Bot.dp.storage.get_state(key(202))) is None
+    assert replies[101][-1] == Bot.CurrencyService.render(Bot.cD.cur_buttons[button])
+    assert replies[202][-1] == garbage
+
+
+def test_thousands_of_concurrent_chats(published, replies, loop):
+    Bot = published
+    button = next(iter(Bot.cD.cur_buttons))
+    currency = Bot.CurrencyService.render(Bot.cD.cur_buttons[button])
+    chats = range(10000, 12000)
+
+    async def chat(chat_id):
+        await feed(Bot, chat_id, 'валюты' if chat_id % 2 else '/start')
+        await feed(Bot, chat_id, button)
+
+    async def scenario():
+        await asyncio.gather(*(chat(chat_id) for chat_id in chats))
+
+    loop.run_until_complete(scenario())
+    for chat_id in chats:
+        if chat_id % 2:
+            assert replies[chat_id][-1] == currency
+        else:
+            assert replies[chat_id][-1] == garbage
+
+
+# Two RedisStorage instances over one fake server stand for two worker processes
+@pytest.fixture
+def redis_pair():
+    fakeredis = pytest.importorskip('fakeredis')
+    from aiogram.fsm.storage.redis import RedisStorage
+    server = fakeredis.FakeServer()
+    return [RedisStorage(redis=fakeredis.aioredis.FakeRedis(server=server), state_ttl=60, data_ttl=60)
+            for _ in range(2)]
+
+
+def test_redis_url_selects_redis(monkeypatch):
+    pytest.importorskip('redis')
+    from aiogram.fsm.storage.redis import RedisStorage
+    monkeypatch.setenv('REDIS_URL', 'redis://127.0.0.1:6379/0')
+    assert isinstance(UserState.create_storage(workers=4), RedisStorage)
+    monkeypatch.delenv('REDIS_URL')
+    assert isinstance(UserState.create_storage(workers=1), LRUStorage)
+
+
+def test_redis_storage_is_shared_between_workers(redis_pair, loop):
+    first, second = redis_pair
+
+    async def scenario():
+        await first.set_state(key(1), Menu.currencies)
+        await first.set_data(key(1), {'city': 'Пермь'})
+        await second.set_state(key(2), Menu.query)
+        return [await second.get_state(key(1)), await second.get_data(key(1)),
+                await first.get_state(key(2)), await first.get_state(key(3))]
+
+    assert loop.run_until_complete(scenario()) == [Menu.currencies.state, {'city': 'Пермь'}, Menu.query.state, None]
+
+
+def test_chats_are_routed_across_workers(published, replies, redis_pair, loop, monkeypatch):
+    Bot = published
+    first, second = redis_pair
+    button = next(iter(Bot.cD.cur_buttons))
+
+    # Every update of a chat may land on any worker
+    async def on(storage, chat_id, text):
+        monkeypatch.setattr(Bot.dp.fsm, 'storage', storage)
+        await feed(Bot, chat_id, text)
+
+    async def scenario():
+        await on(first, 101, 'валюты')
+        await on(second, 202, 'Другой вопрос')
+        await on(second, 101, button)
+        await on(first, 202, button)
+
+    loop.run_until_complete(scenario())
+    assert loop.run_until_complete(first.get_state(key(101))) == Menu.currencies.state
+    assert loop.run_until_complete(second.get_state(key(202))) == Menu.other.state
+    assert replies[101][-1] == Bot.CurrencyService.render(Bot.cD.cur_buttons[button])
+    assert replies[202][-1] == garbage
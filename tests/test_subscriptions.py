@@ -0,0 +1,171 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from helpers import feed
+from Subscriptions import Subscription, SubscriptionScheduler, Subscriptions, SubscriptionStore, next_due
+
+midnight = datetime(2026, 10, 18)
+
+
+def at(days=0, hours=0, minutes=0):
+    return (midnight + timedelta(days=days, hours=hours, minutes=minutes)).timestamp()
+
+
+# Scheduler driven by a virtual clock, recording renders and deliveries
+class Harness:
+    def __init__(self, broken=()):
+        self.now = [at()]
+        self.broken = set(broken)
+        self.renders = []
+        self.delivered = []
+        self.scheduler = SubscriptionScheduler(self.render, self.deliver, clock=lambda: self.now[0])
+
+    async def render(self, kind, arg):
+        self.renders.append((kind, arg))
+        if (kind, arg) in self.broken:
+            raise RuntimeError('сервис недоступен')
+        return kind + ':' + arg
+
+    async def deliver(self, chat_id, text):
+        self.delivered.append((chat_id, text))
+
+    def tick(self, loop, when):
+        self.now[0] = when
+        self.renders.clear()
+        self.delivered.clear()
+        loop.run_until_complete(self.scheduler.tick())
+
+
+def test_next_due():
+    assert next_due(8 * 60, at(hours=7)) == at(hours=8)
+    assert next_due(8 * 60, at(hours=8)) == at(days=1, hours=8)
+    assert next_due(0, at(hours=23, minutes=59)) == at(days=1)
+
+
+def test_each_minute_fires_once_a_day(loop):
+    harness = Harness()
+    for sub in [Subscription(1, 101, 'weather', 'Пермь', 480), Subscription(2, 102, 'weather', 'Пермь', 480),
+                Subscription(3, 103, 'currency', 'EUR', 480), Subscription(4, 104, 'joke', '', 570)]:
+        harness.scheduler.add(sub)
+    assert harness.scheduler.next_time() == at(hours=8)
+    harness.tick(loop, at(hours=7, minutes=59))
+    assert harness.delivered == []
+    harness.tick(loop, at(hours=8))
+    # Subscribers of the same city share one render
+    assert sorted(harness.renders) == [('currency', 'EUR'), ('weather', 'Пермь')]
+    assert sorted(harness.delivered) == [(101, 'weather:Пермь'), (102, 'weather:Пермь'), (103, 'currency:EUR')]
+    harness.tick(loop, at(hours=8, minutes=0.5))
+    assert harness.delivered == []
+    harness.tick(loop, at(hours=9, minutes=30))
+    assert harness.delivered == [(104, 'joke:')]
+    assert harness.scheduler.next_time() == at(days=1, hours=8)
+    harness.tick(loop, at(days=1, hours=8))
+    assert len(harness.delivered) == 3
+    assert harness.scheduler.metrics == {'ticks': 3, 'renders': 5, 'delivered': 7, 'errors': 0}
+
+
+def test_no_burst_after_missed_days(loop):
+    harness = Harness()
+    harness.scheduler.add(Subscription(1, 101, 'currency', 'PLN', 480))
+    harness.scheduler.add(Subscription(2, 102, 'joke', '', 1200))
+    # The process was asleep for three and a half days: every missed minute fires once, not once per day
+    harness.tick(loop, at(days=3, hours=12))
+    assert sorted(harness.delivered) == [(101, 'currency:PLN'), (102, 'joke:')]
+    assert harness.scheduler.next_time() == at(days=3, hours=20)
+    harness.tick(loop, at(days=3, hours=20))
+    assert harness.delivered == [(102, 'joke:')]
+    assert sorted(due for due, _ in harness.scheduler.heap) == [at(days=4, hours=8), at(days=4, hours=20)]
+
+
+def test_removed_and_moved_subscriptions(loop):
+    harness = Harness()
+    harness.scheduler.add(Subscription(1, 101, 'weather', 'Казань', 480))
+    harness.scheduler.add(Subscription(2, 102, 'weather', 'Казань', 480))
+    harness.scheduler.remove(1)
+    harness.scheduler.remove(1)
+    harness.scheduler.add(Subscription(2, 102, 'weather', 'Казань', 540))
+    assert len(harness.scheduler) == 1
+    harness.tick(loop, at(hours=8))
+    assert harness.delivered == [] and 480 not in harness.scheduler.scheduled
+    harness.tick(loop, at(hours=9))
+    assert harness.delivered == [(102, 'weather:Казань')]
+
+
+def test_failed_render_does_not_stop_others(loop):
+    harness = Harness(broken={('weather', 'Пермь')})
+    harness.scheduler.add(Subscription(1, 101, 'weather', 'Пермь', 480))
+    harness.scheduler.add(Subscription(2, 102, 'currency', 'EUR', 480))
+    harness.tick(loop, at(hours=8))
+    assert harness.delivered == [(102, 'currency:EUR')]
+    assert harness.scheduler.metrics['errors'] == 1
+
+
+def test_workers_follow_the_store(loop, tmp_path):
+    path = str(tmp_path / 'subscriptions.sqlite3')
+
+    async def render(kind, arg):
+        return arg
+
+    async def deliver(chat_id, text):
+        pass
+
+    owner, worker = Subscriptions(render, deliver), Subscriptions(render, deliver)
+    owner.store, worker.store = SubscriptionStore(path), SubscriptionStore(path)
+
+    async def scenario():
+        assert await worker.add(1, 'currency', 'EUR', 480) == 1
+        assert await worker.add(1, 'currency', 'EUR', 480) == 1
+        ids = [await worker.add(2, 'currency', 'EUR', minute) for minute in range(12)]
+        assert None not in ids[:10] and ids[10:] == [None, None]
+        await owner.sync()
+        assert len(owner.scheduler) == 11
+        assert await worker.remove_chat(2) == 10
+        await owner.sync()
+        assert list(owner.scheduler.by_id) == [1]
+        assert await owner.list_chat(1) == [Subscription(1, 1, 'currency', 'EUR', 480)]
+        assert await owner.remove_chat(3) == 0
+
+    loop.run_until_complete(scenario())
+
+
+@pytest.fixture
+def with_rates(bot_module, monkeypatch):
+    Bot = bot_module
+    monkeypatch.setattr(Bot.CurrencyService, 'rates', Bot.RateTable({'EUR': 100.0, 'USD': 90.0}))
+    return Bot
+
+
+@pytest.mark.parametrize('subject, expected', [
+    ('курс евро', ('currency', 'EUR')),
+    ('курс доллара', ('currency', 'USD')),
+    ('курс рубля', (None, None)),
+    ('курс RUB', (None, None)),
+    ('курс рубля к евро', ('currency', 'EUR')),
+    ('анекдот', ('joke', '')),
+    ('погоду', ('weather', 'Пермь')),
+    ('погоду в Казани', ('weather', 'Казань')),
+])
+def test_parse_subscription(with_rates, loop, subject, expected):
+    assert loop.run_until_complete(with_rates.parse_subscription(subject)) == expected
+
+
+def test_unknown_place_is_refused(with_rates, loop, monkeypatch):
+    Bot = with_rates
+    monkeypatch.setattr(Bot.Location, 'find_ner', classmethod(lambda cls, msg: None))
+    assert loop.run_until_complete(Bot.parse_subscription('погоду в Шмурдяндии')) == (None, None)
+
+
+def test_ruble_subscription_is_refused(with_rates, replies, loop, tmp_path, monkeypatch):
+    Bot = with_rates
+    monkeypatch.setattr(Bot.subscriptions, 'store', SubscriptionStore(str(tmp_path / 'subscriptions.sqlite3')))
+
+    async def scenario():
+        await feed(Bot, 700, 'Другой вопрос')
+        await feed(Bot, 700, 'присылай курс рубля в 9:00')
+        await feed(Bot, 700, 'присылай курс евро в 9:00')
+        await feed(Bot, 700, 'мои подписки')
+
+    loop.run_until_complete(scenario())
+    assert replies[700][1].startswith('Простите, не понял на что подписаться')
+    assert replies[700][2:] == ['Готово! Буду присылать каждый день в 9:00 ⏰', 'Ваши подписки:\n9:00 - курс EUR']
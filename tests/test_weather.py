@@ -0,0 +1,144 @@
+import asyncio
+
+from types import SimpleNamespace
+
+import pytest
+
+import Cache
+from Cache import TTLCache
+from helpers import serve
+
+perm = {'cod': 200, 'dt': 1700000000, 'weather': [{'main': 'Clouds', 'description': 'пасмурно'}],
+        'main': {'temp': 3.5}, 'wind': {'speed': 4}, 'sys': {'country': 'RU', 'sunrise': 1699990000,
+                                                              'sunset': 1700020000}}
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(Cache, 'time', SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_concurrent_gets_share_one_fetch(loop):
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'солнечно'
+
+    async def scenario():
+        return await asyncio.gather(*(cache.get('пермь', fetch) for _ in range(100)))
+
+    assert loop.run_until_complete(scenario()) == ['солнечно'] * 100
+    assert loop.run_until_complete(cache.get('пермь', fetch)) == 'солнечно'
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 100)
+
+
+def test_negative_results_use_their_own_ttl(loop, clock):
+    cache = TTLCache(ttl=60, negative_ttl=600, is_negative=lambda data: data['cod'] != 200)
+    calls = []
+
+    async def fetch(data):
+        calls.append(data['cod'])
+        return data
+
+    loop.run_until_complete(cache.get('пермь', lambda: fetch({'cod': 200})))
+    loop.run_until_complete(cache.get('абвгд', lambda: fetch({'cod': '404'})))
+    clock[0] += 61
+    loop.run_until_complete(cache.get('пермь', lambda: fetch({'cod': 200})))
+    loop.run_until_complete(cache.get('абвгд', lambda: fetch({'cod': '404'})))
+    assert calls == [200, '404', 200]
+    clock[0] += 600
+    loop.run_until_complete(cache.get('абвгд', lambda: fetch({'cod': '404'})))
+    assert calls == [200, '404', 200, '404']
+
+
+def test_errors_are_not_cached(loop):
+    cache = TTLCache(ttl=60)
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        if len(calls) == 1:
+            raise asyncio.TimeoutError()
+        return 'ясно'
+
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(cache.get('пермь', fetch))
+    assert loop.run_until_complete(cache.get('пермь', fetch)) == 'ясно'
+    assert len(calls) == 2
+
+
+def test_cancelled_caller_does_not_cancel_fetch(loop):
+    cache = TTLCache(ttl=60)
+
+    async def fetch():
+        await asyncio.sleep(0.02)
+        return 'снег'
+
+    async def scenario():
+        first = asyncio.ensure_future(cache.get('пермь', fetch))
+        second = asyncio.ensure_future(cache.get('пермь', fetch))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second
+
+    assert loop.run_until_complete(scenario()) == 'снег'
+    assert 'пермь' in cache.items
+
+
+def test_weather_for_one_city_is_fetched_once(bot_module, loop, monkeypatch):
+    from aiohttp import web
+    WeatherData = bot_module.WeatherData
+    monkeypatch.setattr(WeatherData, 'cache', TTLCache(ttl=600, negative_ttl=6 * 60 * 60,
+                                                       is_negative=bot_module.place_not_found))
+    calls = []
+
+    async def weather(request):
+        calls.append(request.query['q'])
+        await asyncio.sleep(0.05)
+        if request.query['q'] == 'Пермь':
+            return web.json_response(perm)
+        return web.json_response({'cod': '404', 'message': 'city not found'}, status=404)
+
+    async def scenario():
+        async with serve(('GET', '/weather', weather)) as url:
+            monkeypatch.setattr(WeatherData, 'url', url + '/weather')
+            first = await asyncio.gather(*(WeatherData.get_loc_weather('Пермь') for _ in range(50)))
+            again = await WeatherData.get_loc_weather('Пермь')
+            unknown = [await WeatherData.get_loc_weather('Абвгд') for _ in range(3)]
+        return first, again, unknown
+
+    first, again, unknown = loop.run_until_complete(scenario())
+    assert len(set(first)) == 1 and 'Температура: 3.5°C' in first[0]
+    assert again == first[0]
+    assert unknown == ['Простите, такого места я не знаю 😳'] * 3
+    assert calls == ['Пермь', 'Абвгд']
+
+
+def test_key_errors_are_not_cached_as_unknown_places(bot_module, loop, monkeypatch):
+    from aiohttp import web
+    WeatherData = bot_module.WeatherData
+    monkeypatch.setattr(WeatherData, 'cache', TTLCache(ttl=600, negative_ttl=6 * 60 * 60,
+                                                       is_negative=bot_module.place_not_found))
+    key_valid = []
+
+    async def weather(request):
+        if not key_valid:
+            return web.json_response({'cod': 401, 'message': 'Invalid API key'}, status=401)
+        return web.json_response(perm)
+
+    async def scenario():
+        async with serve(('GET', '/weather', weather)) as url:
+            monkeypatch.setattr(WeatherData, 'url', url + '/weather')
+            broken = [await WeatherData.get_loc_weather('Пермь') for _ in range(2)]
+            key_valid.append(True)
+            return broken, await WeatherData.get_loc_weather('Пермь')
+
+    broken, fixed = loop.run_until_complete(scenario())
+    assert broken == ['Сервис погоды сейчас недоступен, попробуйте позже 🙏'] * 2
+    assert 'Температура: 3.5°C' in fixed